@@ -1,11 +1,27 @@
 # Copyright 2013 Christopher Foo <chris.foo@gmail.com>
 # Licensed under GPLv3. See COPYING.txt for details.
-from warcat.model import WARC
-from warcat.tool import ListTool, ConcatTool, SplitTool, ExtractTool, VerifyTool
+from warcat.digeststore import DigestStore
+from warcat.expression import Expression, ExpressionError
+from warcat.extractarchive import FORMATS, new_writer
+from warcat.gzipcheck import check_gzip
+from warcat.index import CollectionIndex, INDEX_EXTENSION, open_index
+from warcat.model import WARC, BlockWithPayload
+from warcat.objectstore import ObjectStore
+from warcat.recordfilter import RecordFilter, load_list
+from warcat.salvage import salvage
+from warcat.serve import serve
+from warcat.tool import ListTool, ConcatTool, SplitTool, ExtractTool, \
+    VerifyTool, IndexTool, CollectionIndexTool, AddDigestsTool, DedupTool, \
+    FilterTool
+from warcat.verify import RULES, ALGORITHM_MAP
+from warcat.verifycache import VerifyCache
 import argparse
+import cProfile
+import gzip
 import logging
 import os
 import sys
+import warcat.stats
 import warcat.version
 
 _logger = logging.getLogger(__name__)
@@ -26,8 +42,8 @@ def main():
     arg_parser.add_argument('file', help='Filename of file to be read.',
         nargs='*')
     arg_parser.add_argument('--output', '-o', metavar='FILE',
-        help='Output to FILE instead of standard out',
-        type=argparse.FileType('wb'), default=sys.stdout,
+        help='Output to FILE instead of standard out. With --resume, FILE is'
+        ' truncated to its size at the checkpoint and written to after it.',
     )
     arg_parser.add_argument('--gzip', '-z', action='store_true',
         help='When outputting a file, use gzip compression',
@@ -43,9 +59,53 @@ def main():
     arg_parser.add_argument('--target-uri', action='append',
         help='Only process records with the given target URI.'
         'Can be used more than once.')
+    arg_parser.add_argument('--record-file', metavar='FILE',
+        action='append',
+        help='Like --record but read the IDs from FILE, one per line.')
+    arg_parser.add_argument('--target-uri-file', metavar='FILE',
+        action='append',
+        help='Like --target-uri but read the URIs from FILE, one per line.')
+    arg_parser.add_argument('--target-uri-prefix', action='append',
+        help='Only process records with a target URI starting with the'
+        ' given prefix. Can be used more than once.')
+    arg_parser.add_argument('--surt-prefix', action='append',
+        help='Only process records with a target URI that has a SURT'
+        ' starting with the given prefix. Can be used more than once.')
+    arg_parser.add_argument('--target-uri-regex', action='append',
+        help='Only process records with a target URI matching the given'
+        ' regular expression. Can be used more than once.')
+    arg_parser.add_argument('--approximate-filter', action='store_true',
+        help='Use a Bloom filter for large record ID and target URI lists.'
+        ' Uses less memory but rarely, extra records are processed.')
     arg_parser.add_argument('--preserve-block', action='store_true',
         help="Don't attempt to parse content blocks. Parsed content blocks"
         " may not match content-length and hash digests on serialization.")
+    arg_parser.add_argument('--decode-content', action='store_true',
+        help='When extracting, decompress gzip, deflate, and br content'
+        ' encodings')
+    arg_parser.add_argument('--dedup-dir', metavar='DIR',
+        help='When extracting, store each unique payload once in DIR and'
+        ' link the extracted files to it. DIR can be used again later.')
+    arg_parser.add_argument('--dedup-symlink', action='store_true',
+        help='With --dedup-dir, use symbolic links instead of hard links')
+    arg_parser.add_argument('--plan-paths', action='store_true',
+        help='When extracting, read the record headers first to place every'
+        ' file, then write without checking the output directory')
+    arg_parser.add_argument('--archive', choices=FORMATS,
+        help='When extracting, write the files into a tar or zip archive to'
+        ' the output instead of the output directory. Zip needs Python 3.6'
+        ' or newer.')
+    arg_parser.add_argument('--digest-algorithm', action='append',
+        choices=sorted(ALGORITHM_MAP),
+        help='When adding digests, the algorithm to use. Can be used more'
+        ' than once. The default is sha1.')
+    arg_parser.add_argument('--digest-store', metavar='FILE',
+        help='When deduplicating, the database of payload digests to use.'
+        ' It can be used again to deduplicate against earlier runs.')
+    arg_parser.add_argument('--where', action='append', metavar='EXPR',
+        help='When filtering, copy records matching the expression, such as'
+        ' "type=response status=200 mime^=text/ date>=2013-04". Can be used'
+        ' more than once to require all of them.')
     arg_parser.add_argument('--output-dir', '-d',
         default=os.getcwd(),
         help='For output operations that make multiple files, use given'
@@ -54,6 +114,60 @@ def main():
         help='Show progress or activity')
     arg_parser.add_argument('--keep-going', action='store_true',
         help='Continue processing records despite errors')
+    arg_parser.add_argument('--stats', action='store_true',
+        help='Print throughput and time spent in each stage at the end')
+    arg_parser.add_argument('--stats-file', metavar='FILE',
+        help='Write throughput and time spent in each stage as JSON')
+    arg_parser.add_argument('--profile', metavar='FILE',
+        help='Write profiling statistics of the run to FILE. View them with'
+        ' "python3 -m pstats FILE".')
+    arg_parser.add_argument('--slow-record', type=float, metavar='MS',
+        help='Log records that take at least MS milliseconds to read and'
+        ' process')
+    arg_parser.add_argument('--checkpoint', metavar='FILE',
+        help='Periodically save the position and state to the given file')
+    arg_parser.add_argument('--checkpoint-interval', type=float, default=300,
+        metavar='SECONDS', help='The time between checkpoints')
+    arg_parser.add_argument('--resume', action='store_true',
+        help='Continue from the checkpoint file')
+    arg_parser.add_argument('--offset', type=int,
+        help='Get the record at the given file offset. For gzip files, '
+        'it is the offset of the gzip member.')
+    arg_parser.add_argument('--index', action='append',
+        help='Use the given index file or collection index directory instead'
+        ' of the index next to the archive. Can be used more than once.')
+    arg_parser.add_argument('--payload', action='store_true',
+        help='Output only the payload of the record')
+    arg_parser.add_argument('--timestamp',
+        help='Get or query the captures of the target URI closest to the'
+        ' given timestamp or date')
+    arg_parser.add_argument('--limit', type=int,
+        help='The maximum number of captures to query')
+    arg_parser.add_argument('--host', default='localhost',
+        help='When serving, the address to listen on')
+    arg_parser.add_argument('--port', type=int, default=8080,
+        help='When serving, the port to listen on')
+    arg_parser.add_argument('--collection', metavar='DIR',
+        help='When indexing, add the archives to the collection index in'
+        ' the given directory')
+    arg_parser.add_argument('--compact', action='store_true',
+        help='When indexing, merge the segments of the collection index')
+    arg_parser.add_argument('--enable-rule', action='append', metavar='NAME',
+        choices=[rule.name for rule in RULES],
+        help='When verifying, enable an optional rule such as warcinfo-id')
+    arg_parser.add_argument('--disable-rule', action='append', metavar='NAME',
+        choices=[rule.name for rule in RULES],
+        help='When verifying, disable a rule')
+    arg_parser.add_argument('--gzip-only', action='store_true',
+        help='When verifying, only check the integrity of gzip members')
+    arg_parser.add_argument('--jobs', '-j', type=int, metavar='N',
+        help='The number of processes or threads to use')
+    arg_parser.add_argument('--verify-cache', metavar='FILE',
+        help='When verifying, store results in the given database and skip'
+        ' files that did not change')
+    arg_parser.add_argument('--verify-cache-hash', action='store_true',
+        help='When verifying with a cache, also compare a hash of the start'
+        ' and end of files')
 
     original_print_help = arg_parser.print_help
 
@@ -66,6 +180,14 @@ def main():
 
     args = arg_parser.parse_args()
 
+    if args.resume and not args.checkpoint:
+        arg_parser.error('--resume requires --checkpoint')
+
+    try:
+        args.output = open_output(args)
+    except OSError as error:
+        arg_parser.error('can\'t open \'{}\': {}'.format(args.output, error))
+
     if args.verbose:
         if args.verbose > 1:
             logging.basicConfig(level=logging.DEBUG)
@@ -74,10 +196,32 @@ def main():
 
     command_info = commands.get(args.command)
 
-    if command_info:
-        command_info[1](args)
+    if args.stats or args.stats_file:
+        stats_recorder = warcat.stats.enable()
+    else:
+        stats_recorder = None
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
     else:
-        help_command(args)
+        profiler = None
+
+    try:
+        if command_info:
+            command_info[1](args)
+        else:
+            help_command(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+        if args.stats:
+            stats_recorder.write_report()
+
+        if args.stats_file:
+            stats_recorder.write_json(args.stats_file)
 
 
 def help_command(args=None, file=sys.stderr):
@@ -88,6 +232,23 @@ def help_command(args=None, file=sys.stderr):
         print('{}\n    {}'.format(command, label), file=file)
 
 
+def open_output(args):
+    '''Open the output file.
+
+    When resuming from a checkpoint, the output file is opened without
+    truncating it, so the tool can truncate it to its size at the
+    checkpoint.
+    '''
+
+    if not args.output or args.output == '-':
+        return sys.stdout
+    elif args.resume and os.path.exists(args.checkpoint) \
+    and os.path.exists(args.output):
+        return open(args.output, 'r+b')
+    else:
+        return open(args.output, 'wb')
+
+
 def get_file_buffer(file_obj):
     if file_obj == sys.stdout:
         return sys.stdout.buffer
@@ -95,7 +256,7 @@ def get_file_buffer(file_obj):
         return file_obj
 
 
-def build_tool(class_, args):
+def build_tool(class_, args, **kwargs):
     return class_(args.file,
         write_gzip=args.gzip,
         force_read_gzip=args.force_read_gzip,
@@ -106,6 +267,33 @@ def build_tool(class_, args):
         print_progress=args.progress,
         keep_going=args.keep_going,
         read_target_uris=args.target_uri,
+        record_filter=build_record_filter(args),
+        checkpoint_filename=args.checkpoint,
+        resume=args.resume,
+        checkpoint_interval=args.checkpoint_interval,
+        slow_record_threshold=args.slow_record / 1000
+            if args.slow_record is not None else None,
+        **kwargs
+    )
+
+
+def build_record_filter(args):
+    record_ids = list(args.record or ())
+    target_uris = list(args.target_uri or ())
+
+    for filename in args.record_file or ():
+        record_ids.extend(load_list(filename))
+
+    for filename in args.target_uri_file or ():
+        target_uris.extend(load_list(filename))
+
+    return RecordFilter(
+        record_ids=record_ids,
+        target_uris=target_uris,
+        uri_prefixes=args.target_uri_prefix,
+        surt_prefixes=args.surt_prefix,
+        uri_patterns=args.target_uri_regex,
+        approximate=args.approximate_filter,
     )
 
 
@@ -136,26 +324,256 @@ def split_command(args):
 
 
 def extract_command(args):
-    tool = build_tool(ExtractTool, args)
+    if args.archive and args.dedup_dir:
+        sys.exit('--archive and --dedup-dir cannot be used together.')
+
+    if args.archive and args.resume:
+        sys.exit('--archive and --resume cannot be used together.')
+
+    try:
+        archive = new_writer(args.archive, get_file_buffer(args.output)) \
+            if args.archive else None
+    except ValueError as error:
+        sys.exit(str(error))
+
+    object_store = ObjectStore(args.dedup_dir) if args.dedup_dir else None
+    tool = build_tool(ExtractTool, args, jobs=args.jobs or 1,
+        decode_content=args.decode_content, object_store=object_store,
+        symbolic_links=args.dedup_symlink, plan_paths=args.plan_paths,
+        archive=archive)
+
+    try:
+        tool.process()
+    finally:
+        if object_store:
+            object_store.close()
+
+    if archive:
+        archive.close()
+
+
+def add_digests_command(args):
+    tool = build_tool(AddDigestsTool, args,
+        digest_algorithms=args.digest_algorithm or ['sha1'])
     tool.process()
 
 
-def verify_command(args):
-    tool = build_tool(VerifyTool, args)
+def dedup_command(args):
+    if not args.digest_store:
+        sys.exit('A digest store is required.')
+
+    digest_store = DigestStore(args.digest_store)
+    tool = build_tool(DedupTool, args, digest_store=digest_store)
+
+    try:
+        tool.process()
+    finally:
+        digest_store.close()
+
+    sys.stderr.write('Wrote {} revisit records. Saved {} bytes.\n'.format(
+        tool.num_revisits, tool.bytes_saved))
+
+
+def filter_command(args):
+    try:
+        expression = Expression(' and '.join('({})'.format(text)
+            for text in args.where)) if args.where else None
+    except ExpressionError as error:
+        sys.exit('Bad expression: {}'.format(error))
+
+    tool = build_tool(FilterTool, args, expression=expression)
     tool.process()
 
+    sys.stderr.write('Copied {} records.\n'.format(tool.num_matched))
+
+
+def verify_command(args):
+    if args.gzip_only:
+        verify_gzip_command(args)
+        return
+
+    cache = VerifyCache(args.verify_cache, use_hash=args.verify_cache_hash) \
+        if args.verify_cache else None
+    tool = build_tool(VerifyTool, args,
+        enabled_rules=args.enable_rule or (),
+        disabled_rules=args.disable_rule or (),
+        cache=cache)
+
+    try:
+        tool.process()
+    finally:
+        if cache:
+            cache.close()
+
     if tool.problems:
         sys.exit('Validation failed. Problems: {}.'.format(tool.problems))
 
 
+def verify_gzip_command(args):
+    num_problems = 0
+
+    for filename in args.file:
+        for problem in check_gzip(filename, processes=args.jobs):
+            _logger.error('%s', problem)
+            num_problems += 1
+
+    if num_problems:
+        sys.exit('Validation failed. Problems: {}.'.format(num_problems))
+
+
+def index_command(args):
+    if not args.collection:
+        tool = build_tool(IndexTool, args)
+        tool.process()
+        return
+
+    collection = CollectionIndex(args.collection)
+    tool = build_tool(CollectionIndexTool, args, collection=collection)
+    tool.process()
+
+    if args.compact:
+        collection.compact()
+
+
+def get_command(args):
+    out_file = get_file_buffer(args.output)
+
+    if args.offset is not None:
+        records = [read_record_at_offset(filename, args)
+            for filename in args.file]
+    else:
+        records = [index.get_record(entry, preserve_block=not args.payload)
+            for index, entry in find_index_entries(args)]
+
+    if not records:
+        sys.exit('Record not found.')
+
+    for record in records:
+        if args.gzip:
+            f = gzip.GzipFile(fileobj=out_file, mode='wb')
+        else:
+            f = out_file
+
+        if not args.payload:
+            iterable = record.iter_bytes()
+        elif isinstance(record.content_block, BlockWithPayload):
+            iterable = record.content_block.payload.iter_bytes()
+        else:
+            iterable = record.content_block.iter_bytes()
+
+        for v in iterable:
+            f.write(v)
+
+        if args.gzip:
+            f.close()
+
+
+def read_record_at_offset(filename, args):
+    if filename.endswith('.gz') or args.force_read_gzip:
+        return WARC.read_record_at(filename, None, member_offset=args.offset,
+            preserve_block=not args.payload)
+    else:
+        return WARC.read_record_at(filename, args.offset,
+            preserve_block=not args.payload)
+
+
+def find_index_entries(args):
+    index_filenames = args.index or [filename + INDEX_EXTENSION
+        for filename in args.file]
+    results = []
+
+    for index_filename in index_filenames:
+        if not os.path.exists(index_filename):
+            sys.exit('Index {} not found. Use the index command to create it.'
+                .format(index_filename))
+
+        index = open_index(index_filename)
+
+        record_ids = list(args.record or ())
+
+        for filename in args.record_file or ():
+            record_ids.extend(load_list(filename))
+
+        for record_id in record_ids:
+            results.extend((index, entry)
+                for entry in index.find_record(record_id))
+
+        for url in args.target_uri or ():
+            if args.timestamp:
+                entries = index.closest(url, args.timestamp,
+                    limit=args.limit or 1)
+            else:
+                entries = index.find_uri(url)
+
+            results.extend((index, entry) for entry in entries)
+
+    return results
+
+
+def query_command(args):
+    if not args.target_uri or not args.timestamp:
+        sys.exit('A target URI and timestamp are required.')
+
+    args.limit = args.limit or 10
+
+    for index, entry in find_index_entries(args):
+        print(entry.timestamp, entry.warc_type, entry.record_id,
+            index.get_path(entry), entry.offset,
+            '-' if entry.member_offset is None else entry.member_offset,
+            entry.target_uri, sep='\t')
+
+
+def serve_command(args):
+    index_filenames = args.index or [filename + INDEX_EXTENSION
+        for filename in args.file
+        if os.path.exists(filename + INDEX_EXTENSION)]
+
+    serve((args.host, args.port),
+        indexes=[open_index(filename) for filename in index_filenames],
+        filenames=args.file,
+        force_gzip=args.force_read_gzip,
+    )
+
+
+def salvage_command(args):
+    out_file = get_file_buffer(args.output)
+    num_records = 0
+    num_problems = 0
+
+    for filename in args.file:
+        file_num_records, problems = salvage(filename, out_file,
+            write_gzip=args.gzip, force_gzip=args.force_read_gzip)
+        num_records += file_num_records
+        num_problems += len(problems)
+
+    sys.stderr.write('Recovered {} records. Problems: {}.\n'.format(
+        num_records, num_problems))
+
+
 commands = {
+    'filter': ('Copy records matching an expression to a new archive',
+        filter_command),
     'help': ('List commands available', help_command),
+    'add-digests': ('Rewrite archives with the block and payload digests '
+        'that are missing', add_digests_command),
     'list': ('List contents of archive', list_command),
     'pass': ('Load archive and write it back out', pass_command),
     'concat': ('Naively join archives into one', concat_command),
     'split': ('Split archives into individual records', split_command),
+    'dedup': ('Rewrite archives with duplicate payloads as revisit records',
+        dedup_command),
     'extract': ('Extract files from archive', extract_command),
     'verify': ('Verify digest and validate conformance', verify_command),
+    'index': ('Write an index next to archives for random access',
+        index_command),
+    'get': ('Get records by ID, URL or offset without reading the whole '
+        'archive', get_command),
+    'serve': ('Serve records and payloads over HTTP using indexes',
+        serve_command),
+    'query': ('List captures of a URL closest to a timestamp using an index',
+        query_command),
+    'salvage': ('Recover intact records from damaged archives',
+        salvage_command),
 }
 
 
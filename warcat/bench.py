@@ -0,0 +1,564 @@
+'''Benchmarks using synthetic WARC files
+
+Run ``python3 -m warcat.bench --help`` for options. The corpus is generated
+from a seed, so results from different versions with the same options are
+comparable.
+'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import util
+from warcat.model.common import FIELD_DELIM_BYTES, NEWLINE_BYTES
+from warcat.model.field import Fields
+from warcat.model.warc import WARC
+from warcat.tool import ListTool, VerifyTool, ExtractTool, ConcatTool
+import argparse
+import base64
+import collections
+import contextlib
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+import warcat.stats
+import warcat.version
+
+
+_logger = logging.getLogger(__name__)
+
+SIZE_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+GZIP_MODES = ('none', 'record', 'file')
+BASE_DATE = datetime.datetime(2013, 1, 1)
+WORD_POOL_SIZE = 262144
+
+CorpusOptions = collections.namedtuple('CorpusOptions', ['num_records',
+    'seed', 'size_distribution', 'mean_size', 'gzip_mode', 'http_ratio'])
+'''The options that decide the contents of a synthetic WARC file.
+
+.. attribute:: num_records
+
+    The number of records after the ``warcinfo`` record. An HTTP exchange
+    is a request record and a response record.
+
+.. attribute:: size_distribution
+
+    One of :data:`SIZE_DISTRIBUTIONS` for the sizes of payloads.
+
+.. attribute:: mean_size
+
+    The mean payload size in bytes.
+
+.. attribute:: gzip_mode
+
+    ``none``, ``record`` for a gzip member for each record, or ``file`` for
+    one member for the whole file.
+
+.. attribute:: http_ratio
+
+    The fraction of records that are HTTP exchanges. The others are
+    ``resource`` records of random binary data.
+'''
+
+Corpus = collections.namedtuple('Corpus', ['options', 'filename',
+    'plain_filename', 'offsets', 'temp_dir'])
+'''A generated WARC file.
+
+``plain_filename`` is the same records without compression. ``offsets`` are
+the offsets of the records in the uncompressed data.
+'''
+
+
+def make_word_pool(rand, size=WORD_POOL_SIZE):
+    '''Return `bytes` of random lowercase words.
+
+    The text compresses about as well as HTML does.
+    '''
+
+    words = [''.join(chr(rand.randrange(97, 123))
+        for dummy in range(rand.randint(2, 9))) for dummy in range(2000)]
+    pool = io.StringIO()
+
+    while pool.tell() < size:
+        pool.write(rand.choice(words))
+        pool.write('\n' if rand.random() < 0.1 else ' ')
+
+    return pool.getvalue().encode()[:size]
+
+
+def choose_size(rand, size_distribution, mean_size):
+    '''Return a payload size'''
+
+    if size_distribution == 'fixed':
+        return mean_size
+    elif size_distribution == 'uniform':
+        return rand.randint(0, mean_size * 2)
+    elif size_distribution == 'lognormal':
+        # A mean of exp(mu + sigma ** 2 / 2)
+        sigma = 1.0
+        mu = math.log(max(1, mean_size)) - sigma ** 2 / 2
+        return min(int(rand.lognormvariate(mu, sigma)), mean_size * 64)
+
+    raise ValueError('Unknown size distribution {}'.format(size_distribution))
+
+
+def slice_pool(pool, start, size):
+    '''Return `size` bytes of the pool from `start`, wrapping around'''
+
+    data = bytearray()
+
+    while len(data) < size:
+        data += pool[start:start + size - len(data)]
+        start = 0
+
+    return bytes(data)
+
+
+def format_digest(data):
+    return 'sha1:{}'.format(
+        base64.b32encode(hashlib.sha1(data).digest()).decode())
+
+
+def format_record(warc_type, record_id, date, block, content_type,
+extra_fields=()):
+    '''Return the `bytes` of a record'''
+
+    fields = [
+        ('WARC-Type', warc_type),
+        ('WARC-Record-ID', '<urn:uuid:{}>'.format(record_id)),
+        ('WARC-Date', date.strftime('%Y-%m-%dT%H:%M:%SZ')),
+    ]
+    fields.extend(extra_fields)
+    fields.extend([
+        ('Content-Type', content_type),
+        ('WARC-Block-Digest', format_digest(block)),
+        ('Content-Length', str(len(block))),
+    ])
+
+    header = 'WARC/1.0\r\n' + ''.join('{}: {}\r\n'.format(name, value)
+        for name, value in fields) + '\r\n'
+
+    return b''.join([header.encode(), block, FIELD_DELIM_BYTES])
+
+
+def iter_synthetic_records(options):
+    '''Yield the `bytes` of the records of a synthetic WARC file'''
+
+    rand = random.Random(options.seed)
+    pool = make_word_pool(rand)
+
+    def new_id():
+        return uuid.UUID(int=rand.getrandbits(128), version=4)
+
+    warcinfo_id = new_id()
+
+    yield format_record('warcinfo', warcinfo_id, BASE_DATE,
+        'software: warcat-bench/{}\r\nseed: {}\r\n\r\n'.format(
+            warcat.version.__version__, options.seed).encode(),
+        'application/warc-fields')
+
+    num_records = 0
+
+    while num_records < options.num_records:
+        date = BASE_DATE + datetime.timedelta(seconds=num_records)
+        size = choose_size(rand, options.size_distribution, options.mean_size)
+        info_field = ('WARC-Warcinfo-ID', '<urn:uuid:{}>'.format(warcinfo_id))
+
+        if rand.random() < options.http_ratio \
+        and options.num_records - num_records >= 2:
+            path = '/{:03d}/{}.html'.format(num_records % 1000, num_records)
+            url = 'http://bench.invalid' + path
+            request_id = new_id()
+            response_id = new_id()
+            payload = slice_pool(pool, rand.randrange(len(pool)), size)
+            http_header = ('HTTP/1.1 200 OK\r\n'
+                'Content-Type: text/html\r\n'
+                'Content-Length: {}\r\n'
+                'Last-Modified: {}\r\n\r\n').format(len(payload),
+                date.strftime('%a, %d %b %Y %H:%M:%S GMT')).encode()
+
+            yield format_record('request', request_id, date,
+                'GET {} HTTP/1.1\r\nHost: bench.invalid\r\n\r\n'.format(
+                    path).encode(),
+                'application/http;msgtype=request',
+                [('WARC-Target-URI', url), info_field,
+                    ('WARC-Concurrent-To', '<urn:uuid:{}>'.format(
+                        response_id))])
+            yield format_record('response', response_id, date,
+                http_header + payload, 'application/http;msgtype=response',
+                [('WARC-Target-URI', url), info_field,
+                    ('WARC-Payload-Digest', format_digest(payload))])
+
+            num_records += 2
+        else:
+            block = rand.getrandbits(size * 8).to_bytes(size, 'little') \
+                if size else b''
+
+            yield format_record('resource', new_id(), date, block,
+                'application/octet-stream',
+                [('WARC-Target-URI',
+                    'urn:bench:{}'.format(num_records)), info_field])
+
+            num_records += 1
+
+
+def write_synthetic_warc(filename, options, plain_filename=None):
+    '''Write a synthetic WARC file.
+
+    :param options: A :class:`CorpusOptions`.
+    :param plain_filename: If given, also write the file without
+        compression.
+    :returns: A list of the offsets of the records in the uncompressed data.
+    '''
+
+    offsets = []
+    position = 0
+
+    with contextlib.ExitStack() as stack:
+        out_file = stack.enter_context(open(filename, 'wb'))
+        plain_file = stack.enter_context(open(plain_filename, 'wb')) \
+            if plain_filename else None
+
+        if options.gzip_mode == 'file':
+            # An empty name and mtime keep the output the same every time
+            out_file = stack.enter_context(gzip.GzipFile(filename='',
+                mode='wb', fileobj=out_file, mtime=0))
+
+        for data in iter_synthetic_records(options):
+            offsets.append(position)
+            position += len(data)
+
+            if options.gzip_mode == 'record':
+                with gzip.GzipFile(filename='', mode='wb', fileobj=out_file,
+                mtime=0) as member_file:
+                    member_file.write(data)
+            else:
+                out_file.write(data)
+
+            if plain_file:
+                plain_file.write(data)
+
+    return offsets
+
+
+def generate_corpus(options, temp_dir):
+    '''Write the files of a :class:`Corpus` in the directory'''
+
+    if options.gzip_mode == 'none':
+        filename = plain_filename = os.path.join(temp_dir, 'bench.warc')
+        offsets = write_synthetic_warc(filename, options)
+    else:
+        filename = os.path.join(temp_dir, 'bench.warc.gz')
+        plain_filename = os.path.join(temp_dir, 'bench-plain.warc')
+        offsets = write_synthetic_warc(filename, options, plain_filename)
+
+    return Corpus(options, filename, plain_filename, offsets, temp_dir)
+
+
+def bench_record_load(corpus):
+    def run():
+        num_bytes = 0
+
+        with WARC.open(corpus.filename) as file_obj:
+            has_more = True
+
+            while has_more:
+                record, has_more = WARC.read_record(file_obj)
+                num_bytes += record.content_length
+
+        return (len(corpus.offsets), num_bytes)
+
+    return run
+
+
+def bench_fields_parse(corpus):
+    field_strings = []
+
+    with open(corpus.plain_filename, 'rb') as file_obj:
+        for offset in corpus.offsets:
+            file_obj.seek(offset)
+            header = file_obj.read(4096).split(FIELD_DELIM_BYTES, 1)[0]
+            field_strings.append(
+                header.split(NEWLINE_BYTES, 1)[1].decode() + '\r\n')
+
+    num_bytes = sum(len(s) for s in field_strings)
+
+    def run():
+        for field_string in field_strings:
+            Fields.parse(field_string)
+
+        return (len(field_strings), num_bytes)
+
+    return run
+
+
+def bench_find_file_pattern(corpus):
+    with open(corpus.plain_filename, 'rb') as file_obj:
+        data = file_obj.read()
+
+    def run():
+        file_obj = io.BytesIO(data)
+        num_bytes = 0
+
+        for offset in corpus.offsets:
+            file_obj.seek(offset)
+            num_bytes += util.find_file_pattern(file_obj, FIELD_DELIM_BYTES,
+                inclusive=True)
+
+        return (len(corpus.offsets), num_bytes)
+
+    return run
+
+
+def bench_disk_buffered_reader(corpus):
+    def run():
+        num_bytes = 0
+
+        # A small disk buffer so blocks are replaced during the read
+        with util.DiskBufferedReader(open(corpus.plain_filename, 'rb'),
+        disk_buffer_size=1048576, spool_size=262144) as file_obj:
+            for offset in corpus.offsets:
+                file_obj.seek(offset)
+                num_bytes += len(file_obj.read(4096))
+
+            file_obj.seek(0)
+
+            while True:
+                data = file_obj.read(65536)
+
+                if not data:
+                    break
+
+                num_bytes += len(data)
+
+        return (len(corpus.offsets), num_bytes)
+
+    return run
+
+
+def run_tool(corpus, tool_class, **kwargs):
+    tool = tool_class([corpus.filename], preserve_block=False, **kwargs)
+    tool.process()
+
+    return (tool.num_records, os.path.getsize(corpus.filename))
+
+
+def bench_list(corpus):
+    def run():
+        with open(os.devnull, 'w') as null_file, \
+        contextlib.redirect_stdout(null_file):
+            return run_tool(corpus, ListTool)
+
+    return run
+
+
+def bench_verify(corpus):
+    def run():
+        return run_tool(corpus, VerifyTool)
+
+    return run
+
+
+def bench_extract(corpus):
+    out_dirs = iter(range(sys.maxsize))
+
+    def run():
+        out_dir = os.path.join(corpus.temp_dir,
+            'extract-{}'.format(next(out_dirs)))
+
+        return run_tool(corpus, ExtractTool, out_dir=out_dir)
+
+    return run
+
+
+def bench_concat(corpus):
+    def run():
+        with open(os.devnull, 'wb') as null_file:
+            return run_tool(corpus, ConcatTool, out_file=null_file)
+
+    return run
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('record_load', bench_record_load),
+    ('fields_parse', bench_fields_parse),
+    ('find_file_pattern', bench_find_file_pattern),
+    ('disk_buffered_reader', bench_disk_buffered_reader),
+    ('list', bench_list),
+    ('verify', bench_verify),
+    ('extract', bench_extract),
+    ('concat', bench_concat),
+])
+'''Benchmark names to functions that are given a :class:`Corpus` and
+return a function to time. The timed function returns a tuple of the
+number of records and bytes it handled.'''
+
+
+def measure(run, repeat=3, trace_memory=True):
+    '''Time a function and return a `dict` of the results.
+
+    Memory is traced in an extra untimed run since tracing slows down
+    allocations.
+    '''
+
+    times = []
+
+    for dummy in range(repeat):
+        start_time = time.perf_counter()
+        num_records, num_bytes = run()
+        times.append(time.perf_counter() - start_time)
+
+    best_time = min(times)
+    result = collections.OrderedDict()
+    result['min'] = best_time
+    result['median'] = statistics.median(times)
+    result['max'] = max(times)
+    result['records'] = num_records
+    result['bytes'] = num_bytes
+    result['records_per_second'] = num_records / best_time \
+        if best_time else 0
+    result['bytes_per_second'] = num_bytes / best_time if best_time else 0
+
+    if trace_memory:
+        tracemalloc.start()
+
+        try:
+            run()
+            result['peak_traced_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+
+def run_benchmarks(options, names=None, repeat=3, trace_memory=True):
+    '''Generate a corpus, run the benchmarks, and return a `dict` of the
+    results that can be serialized as JSON.
+
+    :param options: A :class:`CorpusOptions`.
+    :param names: A list of names in :data:`BENCHMARKS`. The default is all
+        of them.
+    '''
+
+    names = names or list(BENCHMARKS)
+    results = collections.OrderedDict()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start_time = time.perf_counter()
+        corpus = generate_corpus(options, temp_dir)
+        _logger.info('Generated %s in %.3f seconds', corpus.filename,
+            time.perf_counter() - start_time)
+
+        corpus_info = collections.OrderedDict(options._asdict())
+        corpus_info['file_size'] = os.path.getsize(corpus.filename)
+        corpus_info['uncompressed_size'] = os.path.getsize(
+            corpus.plain_filename)
+
+        for name in names:
+            _logger.info('Running %s', name)
+            results[name] = measure(BENCHMARKS[name](corpus), repeat=repeat,
+                trace_memory=trace_memory)
+
+    report = collections.OrderedDict()
+    report['warcat_version'] = warcat.version.__version__
+    report['python'] = '{} {}'.format(platform.python_implementation(),
+        platform.python_version())
+    report['platform'] = platform.platform()
+    report['repeat'] = repeat
+    report['corpus'] = corpus_info
+    report['results'] = results
+    report['peak_memory'] = warcat.stats.peak_memory()
+
+    return report
+
+
+def compare(baseline, report):
+    '''Return a `dict` of benchmark names to the ratio of the baseline
+    minimum time to the new minimum time. Ratios above 1 are faster.
+
+    :raises ValueError: The corpora are not the same.
+    '''
+
+    if baseline['corpus'] != report['corpus']:
+        raise ValueError('The results are from different corpora.')
+
+    ratios = collections.OrderedDict()
+
+    for name, result in report['results'].items():
+        baseline_result = baseline['results'].get(name)
+
+        if baseline_result and result['min']:
+            ratios[name] = baseline_result['min'] / result['min']
+
+    return ratios
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark Warcat with a synthetic WARC file.')
+    arg_parser.add_argument('--records', type=int, default=2000,
+        help='Number of records to generate')
+    arg_parser.add_argument('--seed', type=int, default=1,
+        help='Seed of the random generator')
+    arg_parser.add_argument('--size-distribution', choices=SIZE_DISTRIBUTIONS,
+        default='lognormal', help='Distribution of payload sizes')
+    arg_parser.add_argument('--mean-size', type=int, default=16384,
+        help='Mean payload size in bytes')
+    arg_parser.add_argument('--gzip', choices=GZIP_MODES, default='record',
+        help='Compress each record, the whole file, or nothing')
+    arg_parser.add_argument('--http-ratio', type=float, default=0.8,
+        help='Fraction of records that are HTTP exchanges')
+    arg_parser.add_argument('--repeat', type=int, default=3,
+        help='Number of timed runs of each benchmark')
+    arg_parser.add_argument('--benchmark', action='append',
+        choices=list(BENCHMARKS),
+        help='Run only this benchmark. May be given more than once.')
+    arg_parser.add_argument('--no-memory', action='store_true',
+        help='Do not trace memory allocations')
+    arg_parser.add_argument('--output', '-o', metavar='FILE',
+        help='Write JSON results to FILE instead of standard out')
+    arg_parser.add_argument('--compare', metavar='FILE',
+        help='Print the speed up over the JSON results in FILE')
+    arg_parser.add_argument('--verbose', '-v', action='store_true')
+
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARN)
+
+    options = CorpusOptions(args.records, args.seed, args.size_distribution,
+        args.mean_size, args.gzip, args.http_ratio)
+    report = run_benchmarks(options, names=args.benchmark, repeat=args.repeat,
+        trace_memory=not args.no_memory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        try:
+            ratios = compare(baseline, report)
+        except ValueError as error:
+            sys.exit('Cannot compare: {}'.format(error))
+
+        for name, ratio in ratios.items():
+            print('{}: {:.3f}x'.format(name, ratio), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
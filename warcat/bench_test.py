@@ -0,0 +1,38 @@
+from warcat import bench
+import hashlib
+import tempfile
+import unittest
+
+
+class TestBench(unittest.TestCase):
+    def test_generate_deterministic(self):
+        options = bench.CorpusOptions(20, 1, 'lognormal', 1000, 'record', 0.5)
+        digests = []
+
+        for dummy in range(2):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                corpus = bench.generate_corpus(options, temp_dir)
+
+                self.assertEqual(21, len(corpus.offsets))
+
+                with open(corpus.filename, 'rb') as f:
+                    digests.append(hashlib.sha1(f.read()).digest())
+
+        self.assertEqual(digests[0], digests[1])
+
+    def test_run_benchmarks(self):
+        options = bench.CorpusOptions(10, 1, 'uniform', 500, 'file', 0.8)
+        report = bench.run_benchmarks(options, repeat=1)
+
+        self.assertEqual(list(bench.BENCHMARKS), list(report['results']))
+        self.assertEqual(11, report['results']['verify']['records'])
+        self.assertIn('peak_traced_memory', report['results']['list'])
+
+        ratios = bench.compare(report, report)
+
+        self.assertAlmostEqual(1.0, ratios['concat'])
+
+        other_report = dict(report,
+            corpus=dict(report['corpus'], gzip_mode='none'))
+
+        self.assertRaises(ValueError, bench.compare, report, other_report)
@@ -0,0 +1,100 @@
+'''Persistent storage of the first captures of payload digests'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat.model.writer import format_digest
+from warcat.verify import parse_digest_field
+import binascii
+import collections
+import logging
+import sqlite3
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Capture(collections.namedtuple('Capture', ['record_id', 'target_uri',
+'date'])):
+    '''The record that a payload digest was first seen in.
+
+    .. attribute:: date
+
+        The ``WARC-Date`` value.
+    '''
+
+    __slots__ = ()
+
+
+def normalize_digest(value):
+    '''Return a ``WARC-Payload-Digest`` value in one form or `None`.
+
+    The algorithm name is lowercase and the digest is base32, so digests
+    written with different encodings match.
+    '''
+
+    try:
+        algorithm, digest = parse_digest_field(value)
+    except (ValueError, binascii.Error):
+        return
+
+    return format_digest(algorithm, digest)
+
+
+class DigestStore(object):
+    '''A sqlite database of payload digests to :class:`Capture`.
+
+    New digests are held in memory and inserted in batches of
+    `batch_size` in one transaction. Lookups check the batch first. The
+    database can be used across runs.
+
+    :param filename: The filename of the database.
+    '''
+
+    BATCH_SIZE = 10000
+
+    def __init__(self, filename, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self._batch = collections.OrderedDict()
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS digests ('
+            'digest TEXT PRIMARY KEY, record_id TEXT NOT NULL, '
+            'target_uri TEXT NOT NULL, date TEXT NOT NULL) WITHOUT ROWID')
+
+    def get(self, digest):
+        '''Return the :class:`Capture` of the digest or `None`'''
+
+        if digest in self._batch:
+            return self._batch[digest]
+
+        row = self._connection.execute('SELECT record_id, target_uri, date '
+            'FROM digests WHERE digest = ?', (digest,)).fetchone()
+
+        if row:
+            return Capture(*row)
+
+    def add(self, digest, capture):
+        '''Add the capture of a digest that is not stored yet'''
+
+        self._batch[digest] = capture
+
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Insert the batch'''
+
+        if not self._batch:
+            return
+
+        _logger.debug('Inserting %d digests', len(self._batch))
+
+        with self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO digests '
+                '(digest, record_id, target_uri, date) VALUES (?, ?, ?, ?)',
+                [(digest,) + tuple(capture)
+                    for digest, capture in self._batch.items()])
+
+        self._batch.clear()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
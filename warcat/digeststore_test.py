@@ -0,0 +1,34 @@
+from warcat.digeststore import Capture, DigestStore, normalize_digest
+import os.path
+import tempfile
+import unittest
+
+
+class TestDigestStore(unittest.TestCase):
+    def test_store(self):
+        capture = Capture('<urn:uuid:1>', 'http://example.com/',
+            '2013-01-01T00:00:00Z')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'digests.db')
+            store = DigestStore(filename, batch_size=2)
+
+            store.add('sha1:A', capture)
+            self.assertEqual(capture, store.get('sha1:A'))
+            self.assertIsNone(store.get('sha1:B'))
+
+            store.add('sha1:B', capture._replace(record_id='<urn:uuid:2>'))
+            store.add('sha1:C', capture._replace(record_id='<urn:uuid:3>'))
+            store.close()
+
+            store = DigestStore(filename)
+
+            self.assertEqual(capture, store.get('sha1:A'))
+            self.assertEqual('<urn:uuid:3>', store.get('sha1:C').record_id)
+
+            store.close()
+
+    def test_normalize_digest(self):
+        self.assertEqual('sha1:3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ',
+            normalize_digest('SHA1:3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ'))
+        self.assertIsNone(normalize_digest('sha1'))
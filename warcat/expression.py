@@ -0,0 +1,486 @@
+'''Filter expressions over record headers'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import util
+from warcat.model.block import BlockWithPayload
+from warcat.model.field import HTTPHeader
+import logging
+import re
+import urllib.parse
+
+
+_logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'''\s*(?:
+    (?P<paren>[()])
+    |(?P<name>[a-z]+)\s*(?P<operator>!=|<=|>=|\^=|[=<>~])\s*
+        (?P<value>"(?:[^"\\]|\\.)*"|[^\s()"]+)
+    |(?P<word>[a-z]+)
+    )''', re.IGNORECASE | re.VERBOSE)
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+ORDERED_NAMES = frozenset(['status', 'size', 'date'])
+'''Names that can be compared with ``<``, ``<=``, ``>``, and ``>=``'''
+
+HTTP_NAMES = frozenset(['status', 'mime'])
+'''Names whose values may come from the HTTP header'''
+
+
+class ExpressionError(ValueError):
+    '''The expression is not valid'''
+
+
+class RecordView(object):
+    '''A record and the parts of it that terms look at.
+
+    The HTTP header is read from `file_obj` only when a term needs it.
+
+    :param record: A :class:`.Record`.
+    :param file_obj: If the block is not parsed, a file object of the
+        archive to read the HTTP header from. Without it, records with an
+        unparsed block have no HTTP header.
+    '''
+
+    def __init__(self, record, file_obj=None):
+        self.record = record
+        self.file_obj = file_obj
+        self._http_header = False
+
+    @property
+    def is_http(self):
+        return self.record.header.fields.get('Content-Type', '').startswith(
+            'application/http')
+
+    @property
+    def http_header(self):
+        '''The :class:`.HTTPHeader` or `None`'''
+
+        if self._http_header is False:
+            self._http_header = self._read_http_header()
+
+        return self._http_header
+
+    def _read_http_header(self):
+        block = self.record.content_block
+
+        if isinstance(block, BlockWithPayload):
+            if isinstance(block.fields, HTTPHeader):
+                return block.fields
+
+            return
+
+        if not self.is_http or not self.file_obj:
+            return
+
+        self.file_obj.seek(block.file_offset)
+        data = util.read_header_bytes(self.file_obj, block.length)
+
+        if not data:
+            return
+
+        try:
+            return HTTPHeader.parse(data.decode(errors='replace'))
+        except ValueError as error:
+            _logger.debug('Bad HTTP header in %s: %s',
+                self.record.record_id, error)
+
+
+def get_type(view):
+    return view.record.warc_type.lower()
+
+
+def get_status(view):
+    if view.http_header and view.http_header.status:
+        try:
+            return view.http_header.status_code
+        except (ValueError, IndexError):
+            pass
+
+
+def get_mime(view):
+    if view.is_http:
+        value = view.http_header.get('Content-Type') if view.http_header \
+            else None
+    else:
+        value = view.record.header.fields.get('Content-Type')
+
+    if value:
+        return value.split(';', 1)[0].strip().lower()
+
+
+def get_date(view):
+    return normalize_date(view.record.header.fields.get('WARC-Date', ''))
+
+
+def get_host(view):
+    try:
+        host = urllib.parse.urlsplit(view.record.target_uri).hostname
+    except ValueError:
+        return
+
+    return host
+
+
+def get_url(view):
+    return view.record.target_uri or None
+
+
+def get_size(view):
+    return view.record.content_length
+
+
+GETTERS = {
+    'type': get_type,
+    'status': get_status,
+    'mime': get_mime,
+    'date': get_date,
+    'host': get_host,
+    'domain': get_host,
+    'url': get_url,
+    'size': get_size,
+}
+'''Functions that return the value of a name from a :class:`RecordView`
+or `None` if the record has no value'''
+
+
+def normalize_date(s):
+    '''Return the digits of a date, such as ``20130409001114``'''
+
+    return ''.join(char for char in s if char.isdigit())[:14]
+
+
+def parse_size(s):
+    match = re.match(r'(\d+)([kmg]?)i?b?$', s.lower())
+
+    if not match:
+        raise ValueError('Bad size {}'.format(s))
+
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+class Term(object):
+    '''A comparison of one value of a record such as ``status>=400``.
+
+    Terms on a value the record does not have do not match.
+    '''
+
+    def __init__(self, name, operator, value):
+        if name not in GETTERS:
+            raise ExpressionError('Unknown name {}'.format(name))
+
+        if operator in ('<', '<=', '>', '>=') and name not in ORDERED_NAMES:
+            raise ExpressionError('{} cannot be compared with {}'.format(
+                name, operator))
+
+        self.name = name
+        self.operator = operator
+        self.value = value
+        self.getter = GETTERS[name]
+        self.needs_http = name in HTTP_NAMES
+        self.test = self._compile(name, operator, value)
+
+    def _compile(self, name, operator, value):
+        if operator == '~':
+            try:
+                pattern = re.compile(value)
+            except re.error as error:
+                raise ExpressionError('Bad regular expression {}: {}'.format(
+                    value, error))
+
+            return lambda record_value: \
+                pattern.search(str(record_value)) is not None
+
+        values = [item for item in value.split(',') if item]
+
+        if not values:
+            raise ExpressionError('Missing value for {}'.format(name))
+
+        if name in ('status', 'size'):
+            try:
+                values = [parse_size(item) if name == 'size' else int(item)
+                    for item in values]
+            except ValueError:
+                raise ExpressionError('Bad number {} for {}'.format(value,
+                    name))
+        elif name == 'date':
+            values = [normalize_date(item) for item in values]
+
+            if not all(values):
+                raise ExpressionError('Bad date {}'.format(value))
+        elif name != 'url':
+            values = [item.lower() for item in values]
+
+        if operator in ('<', '<=', '>', '>='):
+            if len(values) != 1:
+                raise ExpressionError('{} takes one value'.format(operator))
+
+            return self._compile_order(name, operator, values[0])
+
+        if operator == '^=':
+            prefixes = tuple(str(item) for item in values)
+
+            return lambda record_value: \
+                str(record_value).startswith(prefixes)
+
+        if name == 'date':
+            # A date matches the dates it is a prefix of
+            prefixes = tuple(values)
+            test = lambda record_value: record_value.startswith(prefixes)
+        elif name == 'domain':
+            suffixes = tuple('.' + item for item in values)
+            domains = frozenset(values)
+            test = lambda record_value: record_value in domains \
+                or record_value.endswith(suffixes)
+        else:
+            value_set = frozenset(values)
+            test = lambda record_value: record_value in value_set
+
+        if operator == '!=':
+            return lambda record_value: not test(record_value)
+
+        return test
+
+    def _compile_order(self, name, operator, value):
+        if name == 'date':
+            # A partial date covers the whole period, so 2013-04 is from
+            # 201304 followed by zeros up to 201304 followed by nines
+            if operator in ('<=', '>'):
+                value = value.ljust(14, '9')
+            else:
+                value = value.ljust(14, '0')
+
+        if operator == '<':
+            return lambda record_value: record_value < value
+        elif operator == '<=':
+            return lambda record_value: record_value <= value
+        elif operator == '>':
+            return lambda record_value: record_value > value
+        else:
+            return lambda record_value: record_value >= value
+
+    def match(self, view):
+        record_value = self.getter(view)
+
+        if record_value is None:
+            return False
+
+        return self.test(record_value)
+
+    def __str__(self):
+        return '{}{}{}'.format(self.name, self.operator, self.value)
+
+
+class And(object):
+    def __init__(self, children):
+        # Terms that need the HTTP header go last so it is read only if
+        # the other terms match
+        self.children = sorted(children, key=lambda child: child.needs_http)
+        self.needs_http = any(child.needs_http for child in children)
+
+    def match(self, view):
+        return all(child.match(view) for child in self.children)
+
+    def __str__(self):
+        return '({})'.format(' and '.join(str(child)
+            for child in self.children))
+
+
+class Or(And):
+    def match(self, view):
+        return any(child.match(view) for child in self.children)
+
+    def __str__(self):
+        return '({})'.format(' or '.join(str(child)
+            for child in self.children))
+
+
+class Not(object):
+    def __init__(self, child):
+        self.child = child
+        self.needs_http = child.needs_http
+
+    def match(self, view):
+        return not self.child.match(view)
+
+    def __str__(self):
+        return 'not {}'.format(self.child)
+
+
+def tokenize(text):
+    '''Return a list of tuples of the kind and value of tokens'''
+
+    tokens = []
+    position = 0
+    text = text.rstrip()
+
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+
+        if not match or match.end() == position:
+            raise ExpressionError('Unexpected text at {}: {}'.format(
+                position, text[position:]))
+
+        if match.group('paren'):
+            tokens.append(('paren', match.group('paren')))
+        elif match.group('name'):
+            value = match.group('value')
+
+            if value.startswith('"'):
+                value = re.sub(r'\\(["\\])', r'\1', value[1:-1])
+
+            tokens.append(('term', Term(match.group('name').lower(),
+                match.group('operator'), value)))
+        else:
+            word = match.group('word').lower()
+
+            if word not in ('and', 'or', 'not'):
+                if re.match(r'\s*[!<>^=~]', text[match.end():]):
+                    raise ExpressionError('Missing value for {}'.format(word))
+
+                raise ExpressionError('Unknown word {}'.format(word))
+
+            tokens.append(('word', word))
+
+        position = match.end()
+
+    return tokens
+
+
+class Parser(object):
+    '''Recursive descent parser of an expression.
+
+    ``not`` binds tighter than ``and``, which binds tighter than ``or``.
+    Terms next to each other without a word between them are joined with
+    ``and``.
+    '''
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.index = 0
+
+    def peek(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.index += 1
+
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError('Empty expression')
+
+        node = self.parse_or()
+
+        if self.index < len(self.tokens):
+            raise ExpressionError('Unexpected {}'.format(self.peek()[1]))
+
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+
+        while self.peek() == ('word', 'or'):
+            self.next()
+            children.append(self.parse_and())
+
+        return Or(children) if len(children) > 1 else children[0]
+
+    def parse_and(self):
+        children = [self.parse_not()]
+
+        while True:
+            kind, value = self.peek()
+
+            if (kind, value) == ('word', 'and'):
+                self.next()
+            elif kind == 'term' or (kind, value) in (('word', 'not'),
+            ('paren', '(')):
+                pass
+            else:
+                break
+
+            children.append(self.parse_not())
+
+        return And(children) if len(children) > 1 else children[0]
+
+    def parse_not(self):
+        kind, value = self.next()
+
+        if (kind, value) == ('word', 'not'):
+            return Not(self.parse_not())
+        elif (kind, value) == ('paren', '('):
+            node = self.parse_or()
+
+            if self.next() != ('paren', ')'):
+                raise ExpressionError('Missing )')
+
+            return node
+        elif kind == 'term':
+            return value
+
+        raise ExpressionError('Unexpected {}'.format(value or 'end'))
+
+
+class Expression(object):
+    '''A compiled filter expression.
+
+    An expression is terms joined with ``and``, ``or``, ``not``, and
+    parentheses, for example::
+
+        type=response status>=200 status<300 mime^=text/ date>=2013-04
+
+    A term is a name, an operator, and a value. Values with spaces or
+    parentheses are quoted with ``"``. The names are:
+
+    ``type``
+        The WARC type.
+    ``status``
+        The HTTP status code.
+    ``mime``
+        The media type of the HTTP ``Content-Type`` of HTTP records or the
+        WARC ``Content-Type`` of other records, without parameters.
+    ``date``
+        The WARC date. Partial dates such as ``2013-04`` cover the whole
+        period.
+    ``host``
+        The host of the target URI.
+    ``domain``
+        Like ``host`` but ``domain=example.com`` also matches subdomains.
+    ``url``
+        The target URI.
+    ``size``
+        The length of the block. Units ``K``, ``M``, and ``G`` can be
+        used.
+
+    The operators are ``=`` and ``!=``, which take values separated by
+    commas, ``^=`` for prefixes, ``~`` for regular expressions, and
+    ``<``, ``<=``, ``>``, and ``>=`` for ``status``, ``size``, and
+    ``date``. Text values other than URLs are compared in lowercase.
+
+    The expression is parsed once. ``status`` and ``mime`` read the HTTP
+    header, so they are evaluated after the other terms.
+
+    :raises ExpressionError: The expression is not valid.
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.root = Parser(text).parse()
+        self.needs_http = self.root.needs_http
+
+    def match(self, record, file_obj=None):
+        '''Return whether the :class:`.Record` matches.
+
+        :param file_obj: See :class:`RecordView`.
+        '''
+
+        return self.root.match(RecordView(record, file_obj))
+
+    def __str__(self):
+        return str(self.root)
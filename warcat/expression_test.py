@@ -0,0 +1,66 @@
+from warcat import model
+from warcat.expression import Expression, ExpressionError
+import os.path
+import unittest
+
+
+class TestExpression(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def setUp(self):
+        self.warc = model.WARC()
+        self.warc.load(os.path.join(self.test_dir, 'at.warc'))
+
+    def count(self, text):
+        expression = Expression(text)
+
+        return sum(1 for record in self.warc.records
+            if expression.match(record))
+
+    def test_terms(self):
+        self.assertEqual(2, self.count('type=response'))
+        self.assertEqual(4, self.count('type=response,request'))
+        self.assertEqual(6, self.count('type!=request'))
+        self.assertEqual(1, self.count('status=200'))
+        self.assertEqual(1, self.count('status>=300 status<400'))
+        self.assertEqual(2, self.count('mime=text/html'))
+        self.assertEqual(5, self.count('mime^=TEXT/'))
+        self.assertEqual(4, self.count('host=www.archiveteam.org'))
+        self.assertEqual(4, self.count('domain=archiveteam.org'))
+        self.assertEqual(0, self.count('domain=teamarchiveteam.org'))
+        self.assertEqual(4, self.count('url^=http://www.archiveteam.org/'))
+        self.assertEqual(2, self.count(r'url~"\.org/$"'))
+        self.assertEqual(1, self.count('size>10K'))
+        self.assertEqual(8, self.count('date=2013-04'))
+        self.assertEqual(0, self.count('date<2013-04-09'))
+        self.assertEqual(8, self.count('date<=2013-04-09'))
+
+    def test_operators(self):
+        self.assertEqual(2, self.count('(type=warcinfo or status=200) '
+            'size<1M'))
+        self.assertEqual(1, self.count('type=response and not status=200'))
+        self.assertEqual(1, self.count('type=response status!=200'))
+
+    def test_unparsed_block(self):
+        expression = Expression('type=response status=200')
+        records = []
+
+        with open(os.path.join(self.test_dir, 'at.warc'), 'rb') as f:
+            has_more = True
+
+            while has_more:
+                record, has_more = model.WARC.read_record(f,
+                    preserve_block=True)
+                records.append(record)
+
+            self.assertEqual(1, sum(1 for record in records
+                if expression.match(record, f)))
+
+        # Without a file object, the HTTP header cannot be read
+        self.assertEqual(0, sum(1 for record in records
+            if expression.match(record)))
+
+    def test_errors(self):
+        for text in ['', 'foo=1', 'url<a', 'type=', '(type=a', 'type=a )',
+        'size=abc', 'url~"("', 'type=a xor b', 'status>=200,300']:
+            self.assertRaises(ExpressionError, Expression, text)
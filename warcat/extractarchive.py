@@ -0,0 +1,136 @@
+'''Streaming tar and zip output of extracted files'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+import contextlib
+import logging
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+
+_logger = logging.getLogger(__name__)
+
+FORMATS = ('tar', 'zip')
+
+CAN_WRITE_ZIP = sys.version_info >= (3, 6)
+'''Whether zip streams can be written. Writing a file without knowing its
+size needs Python 3.6.'''
+
+
+class SequentialWriter(object):
+    '''Collects writes into large blocks.
+
+    It cannot seek, so archive writers never go back to earlier data.
+    '''
+
+    def __init__(self, file_obj, buffer_size=1048576):
+        self._file_obj = file_obj
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        if self._buffer:
+            self._file_obj.write(self._buffer)
+            self._buffer = bytearray()
+
+        self._file_obj.flush()
+
+
+class TarWriter(object):
+    '''Writes a tar stream.
+
+    The size of a file is written before its data, so each file is
+    spooled first. Files up to `spool_size` stay in memory.
+    '''
+
+    def __init__(self, file_obj, spool_size=10485760):
+        self._writer = SequentialWriter(file_obj)
+        self._tar = tarfile.open(fileobj=self._writer, mode='w|',
+            format=tarfile.PAX_FORMAT)
+        self._spool_size = spool_size
+
+    @contextlib.contextmanager
+    def open(self, name, mtime=None):
+        '''Return a context manager of a file object to write a file to'''
+
+        with tempfile.SpooledTemporaryFile(max_size=self._spool_size) \
+        as spool_file:
+            yield spool_file
+
+            tar_info = tarfile.TarInfo(name)
+            tar_info.size = spool_file.tell()
+            tar_info.mtime = time.time() if mtime is None else mtime
+            tar_info.mode = 0o644
+            spool_file.seek(0)
+            self._tar.addfile(tar_info, spool_file)
+
+    def close(self):
+        self._tar.close()
+        self._writer.flush()
+
+
+class ZipWriter(object):
+    '''Writes a zip64 stream.
+
+    Files are written as they are given. Their sizes and checksums follow
+    their data.
+
+    :raises ValueError: :data:`CAN_WRITE_ZIP` is `False`.
+    '''
+
+    def __init__(self, file_obj, compress=False):
+        if not CAN_WRITE_ZIP:
+            raise ValueError('Writing zip archives needs Python 3.6 or newer')
+
+        self._writer = SequentialWriter(file_obj)
+        self._zip = zipfile.ZipFile(self._writer, 'w', allowZip64=True)
+        self._compress_type = zipfile.ZIP_DEFLATED if compress \
+            else zipfile.ZIP_STORED
+
+    def open(self, name, mtime=None):
+        '''Return a context manager of a file object to write a file to'''
+
+        # Zip dates cannot be before 1980
+        date_time = time.localtime(max(mtime or time.time(), 315576000))[:6]
+        zip_info = zipfile.ZipInfo(name, date_time)
+        zip_info.compress_type = self._compress_type
+        zip_info.external_attr = 0o644 << 16
+
+        return self._zip.open(zip_info, 'w', force_zip64=True)
+
+    def close(self):
+        self._zip.close()
+        self._writer.flush()
+
+
+def new_writer(archive_format, file_obj):
+    '''Return a :class:`TarWriter` or :class:`ZipWriter`'''
+
+    if archive_format == 'tar':
+        return TarWriter(file_obj)
+    elif archive_format == 'zip':
+        return ZipWriter(file_obj)
+
+    raise ValueError('Unknown archive format {}'.format(archive_format))
+
+
+def archive_name(path):
+    '''Return the name in an archive of a relative path'''
+
+    return path.replace(os.sep, '/')
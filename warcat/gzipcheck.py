@@ -0,0 +1,236 @@
+'''Integrity checking of gzip files without parsing records'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+import collections
+import concurrent.futures
+import logging
+import os
+import zlib
+
+
+_logger = logging.getLogger(__name__)
+
+MEMBER_HEADER = b'\x1f\x8b\x08'
+'''The gzip magic bytes followed by the deflate compression method'''
+
+
+class GzipProblem(collections.namedtuple('GzipProblem', ['filename',
+'offset', 'message'])):
+    '''A damaged gzip member or data that is not a member'''
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '{} at offset {}: {}'.format(self.filename, self.offset,
+            self.message)
+
+
+RangeResult = collections.namedtuple('RangeResult', ['first_member',
+    'problems', 'end'])
+'''The result of :func:`check_range`.
+
+.. attribute:: first_member
+
+    The offset of the first member that was intact or `None`.
+
+.. attribute:: end
+
+    The offset where checking stopped.
+'''
+
+
+class Window(object):
+    '''A forward moving window over a file'''
+
+    def __init__(self, file_obj, read_size):
+        self._file = file_obj
+        self._read_size = read_size
+        self._data = b''
+        self._start = 0
+
+    def _fill(self, position):
+        if position < self._start \
+        or position > self._start + len(self._data):
+            self._file.seek(position)
+            self._data = b''
+            self._start = position
+
+        chunk = self._file.read(self._read_size)
+
+        if chunk:
+            self._data = self._data[position - self._start:] + chunk
+            self._start = position
+
+        return bool(chunk)
+
+    def get(self, position, size):
+        '''Return a `memoryview` of up to `size` bytes at the position'''
+
+        while position < self._start \
+        or self._start + len(self._data) < position + size:
+            if not self._fill(position):
+                break
+
+        offset = position - self._start
+
+        if offset < 0:
+            return memoryview(b'')
+
+        return memoryview(self._data)[offset:offset + size]
+
+    def find(self, pattern, position):
+        '''Return the offset of the pattern at or after the position'''
+
+        while True:
+            if self._start <= position <= self._start + len(self._data):
+                offset = self._data.find(pattern, position - self._start)
+
+                if offset >= 0:
+                    return self._start + offset
+
+                position = max(position,
+                    self._start + len(self._data) - len(pattern) + 1)
+
+            if not self._fill(position):
+                return
+
+
+def check_member(window, position, read_size=65536):
+    '''Decompress the member at the position.
+
+    :returns: A tuple of the offset after the member and `None`, or `None`
+        and a problem message.
+    '''
+
+    if window.get(position, len(MEMBER_HEADER)) != MEMBER_HEADER:
+        return (None, 'Not a gzip member')
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    try:
+        while not decompressor.eof:
+            data = window.get(position, read_size)
+
+            if not data:
+                return (None, 'Truncated member')
+
+            decompressor.decompress(data, read_size)
+
+            while decompressor.unconsumed_tail:
+                decompressor.decompress(decompressor.unconsumed_tail,
+                    read_size)
+
+            position += len(data) - len(decompressor.unused_data)
+    except zlib.error as error:
+        return (None, 'Bad member: {}'.format(error))
+
+    return (position, None)
+
+
+def skip_padding(window, position):
+    '''Return the position after null bytes'''
+
+    while True:
+        data = window.get(position, 4096)
+
+        if not data:
+            return position
+
+        stripped = bytes(data).lstrip(b'\x00')
+        position += len(data) - len(stripped)
+
+        if stripped:
+            return position
+
+
+def check_range(filename, start=0, end=None, resync=False,
+read_size=1048576):
+    '''Check the members that start between the offsets.
+
+    After a problem, checking continues at the next gzip header.
+
+    :param resync: If `True`, start at the first gzip header at or after
+        `start`. Otherwise, `start` must be the start of a member.
+    :returns: A :class:`RangeResult`.
+    '''
+
+    problems = []
+    first_member = None
+
+    with open(filename, 'rb') as file_obj:
+        size = os.fstat(file_obj.fileno()).st_size
+        window = Window(file_obj, read_size)
+        position = window.find(MEMBER_HEADER, start) if resync else start
+
+        while position is not None and position < size \
+        and (end is None or position < end):
+            member_end, message = check_member(window, position)
+
+            if not message:
+                if first_member is None:
+                    first_member = position
+
+                position = skip_padding(window, member_end)
+                continue
+
+            _logger.debug('Problem at %d: %s', position, message)
+            problems.append(GzipProblem(filename, position, message))
+            position = window.find(MEMBER_HEADER, position + 1)
+
+    if position is None:
+        position = size
+
+    return RangeResult(first_member, problems, position)
+
+
+def check_gzip(filename, processes=None, chunk_size=67108864):
+    '''Check every member of a gzip file and return a list of problems.
+
+    The file is split into chunks that are checked in a process pool. A
+    chunk starts checking at its first gzip header, so the results are
+    joined only where a chunk is in step with the one before it. Other
+    parts are checked again in order. The problems are the same as a
+    check from the start.
+
+    :param processes: The number of processes. If 1, the file is checked
+        in this process.
+    :param chunk_size: The number of bytes for each process to check.
+    '''
+
+    size = os.path.getsize(filename)
+
+    if processes == 1 or size <= chunk_size:
+        return check_range(filename).problems
+
+    starts = list(range(0, size, chunk_size))
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(check_range, filename, start,
+            start + chunk_size, resync=bool(start)) for start in starts]
+        problems = []
+        position = 0
+
+        for future in futures:
+            result = future.result()
+
+            if result.first_member is None \
+            or result.first_member < position:
+                continue
+
+            if position < result.first_member:
+                gap_result = check_range(filename, position,
+                    result.first_member)
+                problems.extend(gap_result.problems)
+                position = gap_result.end
+
+                if position != result.first_member:
+                    continue
+
+            problems.extend(problem for problem in result.problems
+                if problem.offset >= result.first_member)
+            position = result.end
+
+    if position < size:
+        problems.extend(check_range(filename, position).problems)
+
+    return problems
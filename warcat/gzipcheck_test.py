@@ -0,0 +1,36 @@
+from warcat import gzipcheck
+import gzip
+import os.path
+import tempfile
+import unittest
+
+
+class TestGzipCheck(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def test_intact(self):
+        self.assertFalse(gzipcheck.check_gzip(
+            os.path.join(self.test_dir, 'at.warc.gz')))
+
+    def test_problems(self):
+        members = [gzip.compress('{}'.format(i).encode() * 500)
+            for i in range(200)]
+        offsets = [sum(len(member) for member in members[:i])
+            for i in range(len(members))]
+        data = bytearray(b''.join(members))
+        data[offsets[50] + len(members[50]) - 6] ^= 0xff
+        data += b'garbage' + members[0][:10]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'a.gz')
+
+            with open(filename, 'wb') as f:
+                f.write(data)
+
+            problems = gzipcheck.check_gzip(filename, processes=1)
+
+            self.assertEqual([offsets[50], len(data) - 17, len(data) - 10],
+                [problem.offset for problem in problems])
+            self.assertIn('Truncated', problems[-1].message)
+            self.assertEqual(problems, gzipcheck.check_gzip(filename,
+                processes=2, chunk_size=1000))
@@ -0,0 +1,423 @@
+'''Compact storage of record IDs'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+import bisect
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import uuid
+
+
+_logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+BLOCK_KEYS = 256
+UUID_PREFIX = '<urn:uuid:'
+LENGTH_STRUCT = struct.Struct('>Q')
+
+
+def write_blob(file_obj, data):
+    '''Write bytes prefixed with their length'''
+
+    file_obj.write(LENGTH_STRUCT.pack(len(data)))
+    file_obj.write(data)
+
+
+def read_blob(file_obj):
+    '''Read bytes written by :func:`write_blob`'''
+
+    length = LENGTH_STRUCT.unpack(file_obj.read(LENGTH_STRUCT.size))[0]
+    data = file_obj.read(length)
+
+    if len(data) != length:
+        raise EOFError('Data is truncated')
+
+    return data
+
+
+def iter_blob_keys(file_obj, chunk_keys=4096):
+    '''Iterate the keys of a blob without reading it at once'''
+
+    length = LENGTH_STRUCT.unpack(file_obj.read(LENGTH_STRUCT.size))[0]
+
+    while length:
+        chunk = file_obj.read(min(length, chunk_keys * KEY_SIZE))
+
+        if not chunk:
+            raise EOFError('Data is truncated')
+
+        length -= len(chunk)
+
+        for offset in range(0, len(chunk), KEY_SIZE):
+            yield chunk[offset:offset + KEY_SIZE]
+
+
+def pack_record_id(record_id):
+    '''Return the 16 bytes of a ``<urn:uuid:...>`` record ID or `None`.
+
+    Only the canonical lowercase form is packed so the bytes map back to
+    exactly one string.
+    '''
+
+    if len(record_id) != 47 or not record_id.startswith(UUID_PREFIX) \
+    or record_id[-1] != '>':
+        return
+
+    text = record_id[10:-1]
+
+    try:
+        uuid_obj = uuid.UUID(text)
+    except ValueError:
+        return
+
+    if str(uuid_obj) == text:
+        return uuid_obj.bytes
+
+
+def unpack_record_id(key):
+    '''Return the record ID string of 16 packed bytes'''
+
+    return '{}{}>'.format(UUID_PREFIX, uuid.UUID(bytes=key))
+
+
+class SortedRun(object):
+    '''An immutable sorted sequence of fixed-size keys.
+
+    Every 256th key is kept in a list so a lookup is a bisect of the list
+    followed by a search of one block.
+
+    :param data: A `bytes` or `mmap.mmap` of the concatenated keys.
+    :param filename: The file backing the data or `None`.
+    '''
+
+    def __init__(self, data, filename=None):
+        self.data = data
+        self.filename = filename
+        self.count = len(data) // KEY_SIZE
+        self.fences = [data[offset:offset + KEY_SIZE]
+            for offset in range(0, len(data), KEY_SIZE * BLOCK_KEYS)]
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        block_index = bisect.bisect_right(self.fences, key) - 1
+
+        if block_index < 0:
+            return False
+
+        start = block_index * BLOCK_KEYS * KEY_SIZE
+        block = self.data[start:start + BLOCK_KEYS * KEY_SIZE]
+        low = 0
+        high = len(block) // KEY_SIZE
+
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = block[middle * KEY_SIZE:(middle + 1) * KEY_SIZE]
+
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                return True
+
+        return False
+
+    def iter_keys(self, chunk_keys=4096):
+        for start in range(0, len(self.data), chunk_keys * KEY_SIZE):
+            chunk = self.data[start:start + chunk_keys * KEY_SIZE]
+
+            for offset in range(0, len(chunk), KEY_SIZE):
+                yield chunk[offset:offset + KEY_SIZE]
+
+    def close(self):
+        if self.filename:
+            self.data.close()
+            os.remove(self.filename)
+
+
+class RecordIDStore(object):
+    '''A set of record IDs that uses little memory.
+
+    UUID record IDs are packed into 16 bytes. New IDs go into a small
+    `set` that is sorted into a :class:`SortedRun` when full. Runs of
+    similar size are merged so the number of runs stays logarithmic.
+    Once the runs in memory reach the memory limit, new runs are written
+    to temporary files and memory mapped. Other record IDs are kept in a
+    `set` as is.
+
+    :param memory_limit: The number of bytes of runs kept in memory.
+    :param buffer_size: The number of IDs added before a run is made.
+    :param fan_in: The number of runs of similar size that are merged.
+    :param temp_dir: The directory of temporary files.
+    '''
+
+    def __init__(self, memory_limit=64 * 1024 ** 2, buffer_size=65536,
+    fan_in=8, temp_dir=None):
+        self._memory_limit = memory_limit
+        self._buffer_size = buffer_size
+        self._fan_in = fan_in
+        self._temp_dir = temp_dir
+        self._buffer = set()
+        self._runs = []
+        self._other_ids = set()
+        self._memory_used = 0
+
+    def add(self, record_id):
+        key = pack_record_id(record_id)
+
+        if key is None:
+            self._other_ids.add(record_id)
+            return
+
+        self._buffer.add(key)
+
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def __contains__(self, record_id):
+        key = pack_record_id(record_id)
+
+        if key is None:
+            return record_id in self._other_ids
+
+        return self.contains_key(key)
+
+    def contains_key(self, key):
+        '''Return whether the packed record ID is in the store'''
+
+        if key in self._buffer:
+            return True
+
+        for run in reversed(self._runs):
+            if key in run:
+                return True
+
+        return False
+
+    def __len__(self):
+        '''Return the number of IDs, counting repeated adds of an ID'''
+
+        return len(self._buffer) + len(self._other_ids) \
+            + sum(len(run) for run in self._runs)
+
+    def flush(self):
+        '''Sort the new IDs into a run'''
+
+        if not self._buffer:
+            return
+
+        keys = sorted(self._buffer)
+        self._buffer = set()
+        self._runs.append(self._new_run(keys, len(keys) * KEY_SIZE))
+        self._merge_runs()
+
+    def _tier(self, run):
+        tier = 0
+        size = self._buffer_size
+
+        while len(run) > size:
+            size *= self._fan_in
+            tier += 1
+
+        return tier
+
+    def _merge_runs(self):
+        while len(self._runs) >= self._fan_in:
+            runs = self._runs[-self._fan_in:]
+            tier = self._tier(runs[-1])
+
+            if any(self._tier(run) != tier for run in runs):
+                break
+
+            _logger.debug('Merging %d runs of tier %d', len(runs), tier)
+
+            del self._runs[-self._fan_in:]
+            self._runs.append(self._new_run(self._iter_merged(runs),
+                sum(len(run) for run in runs) * KEY_SIZE))
+
+            for run in runs:
+                if not run.filename:
+                    self._memory_used -= len(run.data)
+
+                run.close()
+
+    def _iter_merged(self, runs):
+        previous_key = None
+
+        for key in heapq.merge(*[run.iter_keys() for run in runs]):
+            if key != previous_key:
+                yield key
+                previous_key = key
+
+    def _new_run(self, keys, size):
+        if self._memory_used + size <= self._memory_limit:
+            data = b''.join(keys)
+            self._memory_used += len(data)
+
+            return SortedRun(data)
+
+        file_obj = tempfile.NamedTemporaryFile(prefix='warcat-ids-',
+            suffix='.tmp', dir=self._temp_dir, delete=False)
+
+        with file_obj:
+            batch = []
+
+            for key in keys:
+                batch.append(key)
+
+                if len(batch) >= 4096:
+                    file_obj.write(b''.join(batch))
+                    batch = []
+
+            file_obj.write(b''.join(batch))
+            file_obj.flush()
+            data = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _logger.debug('Spilled run of %d bytes to %s', size, file_obj.name)
+
+        return SortedRun(data, file_obj.name)
+
+    def save(self, file_obj):
+        '''Write the IDs to a binary file object'''
+
+        self.flush()
+        file_obj.write(LENGTH_STRUCT.pack(len(self._runs)))
+
+        for run in self._runs:
+            file_obj.write(LENGTH_STRUCT.pack(len(run.data)))
+
+            for start in range(0, len(run.data), 65536):
+                file_obj.write(run.data[start:start + 65536])
+
+        write_blob(file_obj, json.dumps(sorted(self._other_ids)).encode())
+
+    def load(self, file_obj):
+        '''Add the IDs written by :meth:`save`'''
+
+        self.flush()
+        num_runs = LENGTH_STRUCT.unpack(file_obj.read(LENGTH_STRUCT.size))[0]
+
+        for dummy in range(num_runs):
+            position = file_obj.tell()
+            size = LENGTH_STRUCT.unpack(file_obj.read(LENGTH_STRUCT.size))[0]
+            file_obj.seek(position)
+            self._runs.append(self._new_run(iter_blob_keys(file_obj), size))
+
+        self._runs.sort(key=len, reverse=True)
+        self._merge_runs()
+        self._other_ids.update(json.loads(read_blob(file_obj).decode()))
+
+    def close(self):
+        '''Remove the temporary files'''
+
+        for run in self._runs:
+            run.close()
+
+        self._runs = []
+        self._buffer = set()
+        self._other_ids = set()
+        self._memory_used = 0
+
+
+class ReferenceQueue(object):
+    '''References to record IDs that were not seen yet.
+
+    References between UUID record IDs are packed into a `bytearray` of
+    the field name number, the referring ID, and the referenced ID.
+    Queues of several runs can be combined with :meth:`update` before they
+    are resolved.
+    '''
+
+    ENTRY_SIZE = 1 + KEY_SIZE * 2
+
+    def __init__(self):
+        self._packed = bytearray()
+        self._others = []
+        self._names = []
+
+    def add(self, record_id, referenced_id, name):
+        if name not in self._names:
+            self._names.append(name)
+
+        key = pack_record_id(record_id) if record_id else None
+        referenced_key = pack_record_id(referenced_id)
+
+        if key is None or referenced_key is None:
+            self._others.append((record_id, referenced_id, name))
+        else:
+            self._packed.append(self._names.index(name))
+            self._packed.extend(key)
+            self._packed.extend(referenced_key)
+
+    def __len__(self):
+        return len(self._packed) // self.ENTRY_SIZE + len(self._others)
+
+    def __iter__(self):
+        '''Iterate tuples of the referring ID, referenced ID, and name'''
+
+        for offset in range(0, len(self._packed), self.ENTRY_SIZE):
+            entry = bytes(self._packed[offset:offset + self.ENTRY_SIZE])
+
+            yield (unpack_record_id(entry[1:1 + KEY_SIZE]),
+                unpack_record_id(entry[1 + KEY_SIZE:]),
+                self._names[entry[0]])
+
+        for reference in self._others:
+            yield reference
+
+    def update(self, other):
+        '''Add the references of another queue'''
+
+        for reference in other:
+            self.add(*reference)
+
+    def save(self, file_obj):
+        '''Write the references to a binary file object'''
+
+        write_blob(file_obj, bytes(self._packed))
+        write_blob(file_obj, json.dumps([self._names, self._others]).encode())
+
+    def load(self, file_obj):
+        '''Add the references written by :meth:`save`'''
+
+        other = ReferenceQueue()
+        other._packed = bytearray(read_blob(file_obj))
+        other._names, others = json.loads(read_blob(file_obj).decode())
+        other._others = [tuple(reference) for reference in others]
+
+        self.update(other)
+
+    def resolve(self, store):
+        '''Return a list of the references not in the store and clear.
+
+        :param store: A :class:`RecordIDStore`.
+        '''
+
+        dangling = []
+        packed = self._packed
+
+        for offset in range(0, len(packed), self.ENTRY_SIZE):
+            referenced_key = bytes(
+                packed[offset + 1 + KEY_SIZE:offset + self.ENTRY_SIZE])
+
+            if not store.contains_key(referenced_key):
+                dangling.append((
+                    unpack_record_id(bytes(packed[offset + 1:
+                        offset + 1 + KEY_SIZE])),
+                    unpack_record_id(referenced_key),
+                    self._names[packed[offset]]))
+
+        for reference in self._others:
+            if reference[1] not in store:
+                dangling.append(reference)
+
+        self._packed = bytearray()
+        self._others = []
+
+        return dangling
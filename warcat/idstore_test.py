@@ -0,0 +1,64 @@
+from warcat import idstore
+import random
+import tempfile
+import unittest
+import uuid
+
+
+class TestRecordIDStore(unittest.TestCase):
+    def test_pack_record_id(self):
+        record_id = '<urn:uuid:972777d2-4177-4c63-9fde-3877dacc174e>'
+
+        self.assertEqual(16, len(idstore.pack_record_id(record_id)))
+        self.assertFalse(idstore.pack_record_id(record_id.upper()))
+        self.assertFalse(idstore.pack_record_id('<urn:test:1>'))
+
+    def test_store(self):
+        rand = random.Random(1)
+        record_ids = ['<urn:uuid:{}>'.format(uuid.UUID(int=rand.getrandbits(128)))
+            for dummy in range(5000)]
+        other_ids = ['<urn:uuid:{}>'.format(uuid.UUID(int=rand.getrandbits(128)))
+            for dummy in range(100)]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = idstore.RecordIDStore(memory_limit=16 * 1000,
+                buffer_size=100, fan_in=4, temp_dir=temp_dir)
+
+            for record_id in record_ids:
+                self.assertNotIn(record_id, store)
+                store.add(record_id)
+
+            store.add('<urn:test:1>')
+
+            for record_id in record_ids:
+                self.assertIn(record_id, store)
+
+            for record_id in other_ids:
+                self.assertNotIn(record_id, store)
+
+            self.assertIn('<urn:test:1>', store)
+            self.assertNotIn('<urn:test:2>', store)
+            self.assertEqual(5001, len(store))
+
+            store.close()
+
+    def test_reference_queue(self):
+        id_1 = '<urn:uuid:00000000-0000-0000-0000-000000000001>'
+        id_2 = '<urn:uuid:00000000-0000-0000-0000-000000000002>'
+        queue = idstore.ReferenceQueue()
+        other_queue = idstore.ReferenceQueue()
+        store = idstore.RecordIDStore()
+
+        queue.add(id_1, id_2, 'WARC-Refers-To')
+        other_queue.add(id_2, '<urn:test:1>', 'WARC-Concurrent-To')
+        queue.update(other_queue)
+
+        self.assertEqual(2, len(queue))
+        self.assertEqual([(id_1, id_2, 'WARC-Refers-To'),
+            (id_2, '<urn:test:1>', 'WARC-Concurrent-To')], list(queue))
+
+        store.add(id_2)
+
+        self.assertEqual([(id_2, '<urn:test:1>', 'WARC-Concurrent-To')],
+            queue.resolve(store))
+        self.assertEqual(0, len(queue))
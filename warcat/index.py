@@ -0,0 +1,527 @@
+'''Sorted record indexes for random access'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import util
+from warcat.model import WARC
+import calendar
+import collections
+import functools
+import glob
+import heapq
+import logging
+import os
+import re
+import tempfile
+
+
+_logger = logging.getLogger(__name__)
+
+
+INDEX_EXTENSION = '.idx'
+'''Extension of index files written next to archives'''
+
+ID_KEY_PREFIX = 'id '
+'''Prefix of keys for looking up by record ID'''
+
+URL_KEY_PREFIX = 'url '
+'''Prefix of keys for looking up by SURT and timestamp'''
+
+CAPTURE_TYPES = ('response', 'resource', 'revisit')
+'''WARC types of records that are captures of a URL'''
+
+
+class IndexEntry(collections.namedtuple('IndexEntry', ['key', 'filename',
+'offset', 'member_offset', 'record_id', 'warc_type', 'timestamp',
+'target_uri'])):
+    '''A line of an index.
+
+    Each line is tab separated and lines are sorted by bytes.
+
+    .. attribute:: key
+
+        ``id`` followed by the record ID or ``url`` followed by the SURT
+        and timestamp.
+
+    .. attribute:: filename
+
+        The archive filename relative to the directory of the index.
+
+    .. attribute:: offset
+
+        The offset of the record in the uncompressed archive.
+
+    .. attribute:: member_offset
+
+        The offset of the gzip member the record starts. `None` if the
+        archive is not compressed or the record is not at the start of a
+        member.
+
+    .. attribute:: timestamp
+
+        The WARC date as a 14 digit string.
+    '''
+
+    __slots__ = ()
+
+    def to_line(self):
+        '''Return the `bytes` line'''
+
+        member_offset = '-' if self.member_offset is None \
+            else str(self.member_offset)
+
+        return '\t'.join([self.key, self.filename, str(self.offset),
+            member_offset, self.record_id, self.warc_type, self.timestamp,
+            self.target_uri]).encode() + b'\n'
+
+    @classmethod
+    def parse(cls, line):
+        '''Parse a `bytes` line and return a :class:`IndexEntry`'''
+
+        (key, filename, offset, member_offset, record_id, warc_type,
+            timestamp, target_uri) = line.rstrip(b'\n').decode().split('\t')
+
+        return IndexEntry(key, filename, int(offset),
+            None if member_offset == '-' else int(member_offset),
+            record_id, warc_type, timestamp, target_uri)
+
+
+def escape_field(s):
+    '''Percent encode whitespace and control characters'''
+
+    return re.sub(r'[\x00-\x20\x7f]',
+        lambda match: '%{:02X}'.format(ord(match.group())), s)
+
+
+def to_timestamp(s):
+    '''Convert a ISO 8601 WARC date to a 14 digit timestamp'''
+
+    return re.sub(r'\D', '', s)[:14].ljust(14, '0')
+
+
+def timestamp_to_seconds(timestamp):
+    '''Convert a 14 digit timestamp to seconds since the epoch'''
+
+    year, month, day, hour, minute, second = [int(timestamp[i:i + 2])
+        for i in range(2, 14, 2)]
+    year += int(timestamp[:2]) * 100
+
+    return calendar.timegm((year, max(1, month), max(1, day), hour, minute,
+        second))
+
+
+def url_key(url, timestamp=''):
+    '''Return the index key of a URL at a timestamp'''
+
+    return '{}{} {}'.format(URL_KEY_PREFIX, escape_field(util.surt(url)),
+        timestamp)
+
+
+def record_entries(record, filename, member_offset=None):
+    '''Return a list of :class:`IndexEntry` for a record'''
+
+    record_id = escape_field(record.record_id)
+    warc_type = escape_field(record.header.fields.get('WARC-Type', ''))
+    timestamp = to_timestamp(record.header.fields.get('WARC-Date', ''))
+    target_uri = escape_field(record.target_uri)
+
+    entries = [IndexEntry(ID_KEY_PREFIX + record_id, filename,
+        record.file_offset, member_offset, record_id, warc_type, timestamp,
+        target_uri)]
+
+    if target_uri:
+        entries.append(IndexEntry(url_key(record.target_uri, timestamp),
+            filename, record.file_offset, member_offset, record_id,
+            warc_type, timestamp, target_uri))
+
+    return entries
+
+
+def write_index(lines, filename):
+    '''Sort the `bytes` lines and write them to an index file'''
+
+    temp_filename = filename + '.tmp'
+
+    with open(temp_filename, 'wb') as f:
+        f.writelines(sorted(lines))
+
+    os.replace(temp_filename, filename)
+
+    _logger.info('Wrote index %s', filename)
+
+
+def merge_index_files(filenames, filename):
+    '''K-way merge sorted index files into one sorted index file'''
+
+    files = [open(name, 'rb') for name in filenames]
+    temp_filename = filename + '.tmp'
+
+    try:
+        with open(temp_filename, 'wb') as f:
+            f.writelines(heapq.merge(*files))
+    finally:
+        for file_obj in files:
+            file_obj.close()
+
+    os.replace(temp_filename, filename)
+
+    _logger.info('Merged %d indexes into %s', len(filenames), filename)
+
+
+def _seek_line(file_obj, position):
+    '''Seek to the start of the first line at or after the position'''
+
+    if position:
+        file_obj.seek(position - 1)
+        file_obj.readline()
+    else:
+        file_obj.seek(0)
+
+
+def bisect_file(file_obj, key, size):
+    '''Seek to the first line with a key not less than the given key'''
+
+    key = key.encode()
+    low = 0
+    high = size
+
+    while low < high:
+        middle = (low + high) // 2
+        _seek_line(file_obj, middle)
+        line = file_obj.readline()
+
+        if not line or line.split(b'\t', 1)[0] >= key:
+            high = middle
+        else:
+            low = middle + 1
+
+    _seek_line(file_obj, low)
+
+
+def iter_lines_reversed(file_obj, position, block_size=65536):
+    '''Return an iterator of lines before the position in reverse order'''
+
+    buffer = b''
+
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        file_obj.seek(position)
+        lines = (file_obj.read(size) + buffer).split(b'\n')
+        buffer = lines[0]
+
+        for line in reversed(lines[1:]):
+            if line:
+                yield line + b'\n'
+
+    if buffer:
+        yield buffer + b'\n'
+
+
+class Index(object):
+    '''A sorted index file.
+
+    Lookups use binary search so the index is never loaded into memory.
+
+    :param filename: The path of the index file.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+
+    def iter_segments(self):
+        '''Return a list of sorted files to search.
+
+        Each item is a tuple of the filename and a function that returns
+        whether an :class:`IndexEntry` in the file is valid.
+        '''
+
+        return [(self.filename, None)]
+
+    def iter_prefix(self, prefix):
+        '''Return an iterator of :class:`IndexEntry` with the key prefix'''
+
+        return heapq.merge(*[self._iter_prefix(filename, prefix, entry_filter)
+            for filename, entry_filter in self.iter_segments()],
+            key=lambda entry: (entry.key, entry.filename))
+
+    def _iter_prefix(self, filename, prefix, entry_filter):
+        encoded_prefix = prefix.encode()
+
+        with open(filename, 'rb') as f:
+            bisect_file(f, prefix, os.path.getsize(filename))
+
+            for line in f:
+                if not line.startswith(encoded_prefix):
+                    break
+
+                entry = IndexEntry.parse(line)
+
+                if not entry_filter or entry_filter(entry):
+                    yield entry
+
+    def find_record(self, record_id):
+        '''Return a list of :class:`IndexEntry` with the record ID'''
+
+        key = ID_KEY_PREFIX + escape_field(record_id)
+
+        return [entry for entry in self.iter_prefix(key) if entry.key == key]
+
+    def find_uri(self, url):
+        '''Return a list of :class:`IndexEntry` of the URL by timestamp'''
+
+        return list(self.iter_prefix(url_key(url)))
+
+    def closest(self, url, timestamp, limit=1, warc_types=CAPTURE_TYPES):
+        '''Return a list of :class:`IndexEntry` of the URL closest in time.
+
+        :param url: The URL.
+        :param timestamp: A timestamp or ISO 8601 date. It may be
+            truncated such as ``2013`` or ``2013-04``.
+        :param limit: The maximum number of entries to return.
+        :param warc_types: If given, only entries of records with these
+            WARC types are returned.
+        '''
+
+        timestamp = to_timestamp(timestamp)
+        seconds = timestamp_to_seconds(timestamp)
+        prefix = url_key(url).encode()
+        key = url_key(url, timestamp)
+        entries = []
+
+        for filename, entry_filter in self.iter_segments():
+            with open(filename, 'rb') as f:
+                bisect_file(f, key, os.path.getsize(filename))
+                position = f.tell()
+                entries.extend(self._take_captures(iter(f.readline, b''),
+                    prefix, limit, warc_types, entry_filter))
+                entries.extend(self._take_captures(
+                    iter_lines_reversed(f, position), prefix, limit,
+                    warc_types, entry_filter))
+
+        entries.sort(key=lambda entry: (abs(
+            timestamp_to_seconds(entry.timestamp) - seconds), entry.timestamp))
+
+        return entries[:limit]
+
+    @classmethod
+    def _take_captures(cls, lines, prefix, limit, warc_types, entry_filter):
+        entries = []
+
+        for line in lines:
+            if len(entries) >= limit or not line.startswith(prefix):
+                break
+
+            entry = IndexEntry.parse(line)
+
+            if warc_types and entry.warc_type not in warc_types:
+                continue
+
+            if not entry_filter or entry_filter(entry):
+                entries.append(entry)
+
+        return entries
+
+    def get_path(self, entry):
+        '''Return the path of the archive of the entry'''
+
+        return os.path.normpath(os.path.join(self.directory, entry.filename))
+
+    def get_record(self, entry, preserve_block=False):
+        '''Return the :class:`.Record` of the entry using random access'''
+
+        return WARC.read_record_at(self.get_path(entry), entry.offset,
+            member_offset=entry.member_offset, preserve_block=preserve_block)
+
+
+def open_index(path):
+    '''Return a :class:`CollectionIndex` if path is a directory, otherwise
+    :class:`Index`'''
+
+    if os.path.isdir(path):
+        return CollectionIndex(path)
+    else:
+        return Index(path)
+
+
+class ManifestEntry(collections.namedtuple('ManifestEntry', ['size',
+'mtime', 'segment'])):
+    '''A archive in the manifest of a :class:`CollectionIndex`.
+
+    .. attribute:: mtime
+
+        The modification time in nanoseconds.
+
+    .. attribute:: segment
+
+        The filename of the segment containing the entries of the archive.
+    '''
+
+    __slots__ = ()
+
+
+class CollectionIndex(Index):
+    '''An index of many archives that can be appended to.
+
+    The collection is a directory containing a manifest and segments. The
+    manifest lists the size, modification time, and segment of each
+    archive. Each segment is a sorted index. Adding archives writes a new
+    segment and :meth:`compact` merges the segments into one. Entries of
+    archives that were added again are ignored in the old segments.
+
+    Filenames are relative to the collection directory.
+    '''
+
+    MANIFEST_FILENAME = 'manifest'
+    SEGMENT_PATTERN = 'segment-{:08d}' + INDEX_EXTENSION
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.filename = directory
+        self.manifest = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_manifest()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, self.MANIFEST_FILENAME)
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return
+
+        with open(self.manifest_path, 'rb') as f:
+            for line in f:
+                filename, size, mtime, segment = \
+                    line.rstrip(b'\n').decode().split('\t')
+                self.manifest[filename] = ManifestEntry(int(size),
+                    int(mtime), segment)
+
+    def _save_manifest(self):
+        temp_filename = self.manifest_path + '.tmp'
+
+        with open(temp_filename, 'wb') as f:
+            for filename in sorted(self.manifest):
+                size, mtime, segment = self.manifest[filename]
+                f.write('{}\t{}\t{}\t{}\n'.format(filename, size, mtime,
+                    segment).encode())
+
+        os.replace(temp_filename, self.manifest_path)
+
+    def relative_path(self, filename):
+        '''Return the filename of the archive as used in the entries'''
+
+        return os.path.relpath(os.path.abspath(filename), self.directory)
+
+    def is_current(self, filename):
+        '''Return whether the archive is indexed and unchanged'''
+
+        manifest_entry = self.manifest.get(self.relative_path(filename))
+
+        if not manifest_entry:
+            return False
+
+        stat_result = os.stat(filename)
+
+        return (manifest_entry.size, manifest_entry.mtime) == \
+            (stat_result.st_size, stat_result.st_mtime_ns)
+
+    @property
+    def segments(self):
+        '''Return the sorted segment filenames'''
+
+        return sorted(os.path.basename(path) for path in glob.glob(
+            os.path.join(self.directory, 'segment-*' + INDEX_EXTENSION)))
+
+    def _new_segment(self):
+        segments = self.segments
+        number = int(segments[-1][8:16]) + 1 if segments else 1
+
+        return self.SEGMENT_PATTERN.format(number)
+
+    def write_run(self, lines):
+        '''Sort and write `bytes` lines to a temporary file.
+
+        Returns the filename of the run to be given to :meth:`add_runs`.
+        '''
+
+        run_filename = self._temp_filename()
+        write_index(lines, run_filename)
+
+        return run_filename
+
+    def _temp_filename(self):
+        file_descriptor, filename = tempfile.mkstemp(dir=self.directory,
+            suffix='.run')
+        os.close(file_descriptor)
+
+        return filename
+
+    def add_runs(self, run_filenames, filenames):
+        '''Merge sorted runs into a new segment.
+
+        :param run_filenames: Filenames returned by :meth:`write_run`.
+        :param filenames: The archive filenames indexed by the runs.
+        '''
+
+        segment = self._new_segment()
+        merge_index_files(run_filenames,
+            os.path.join(self.directory, segment))
+
+        for filename in filenames:
+            stat_result = os.stat(filename)
+            self.manifest[self.relative_path(filename)] = ManifestEntry(
+                stat_result.st_size, stat_result.st_mtime_ns, segment)
+
+        self._save_manifest()
+
+        for run_filename in run_filenames:
+            os.remove(run_filename)
+
+    def _iter_live_lines(self, segment):
+        with open(os.path.join(self.directory, segment), 'rb') as f:
+            for line in f:
+                if self._is_live(segment, line.split(b'\t', 2)[1].decode()):
+                    yield line
+
+    def _is_live(self, segment, filename):
+        manifest_entry = self.manifest.get(filename)
+
+        return manifest_entry and manifest_entry.segment == segment
+
+    def _is_live_entry(self, segment, entry):
+        return self._is_live(segment, entry.filename)
+
+    def compact(self):
+        '''Merge all segments into one'''
+
+        old_segments = self.segments
+
+        if len(old_segments) < 2:
+            return
+
+        segment = self._new_segment()
+        run_filename = self._temp_filename()
+
+        with open(run_filename, 'wb') as f:
+            f.writelines(heapq.merge(*[self._iter_live_lines(old_segment)
+                for old_segment in old_segments]))
+
+        os.replace(run_filename, os.path.join(self.directory, segment))
+
+        for filename, manifest_entry in self.manifest.items():
+            self.manifest[filename] = manifest_entry._replace(segment=segment)
+
+        self._save_manifest()
+
+        for old_segment in old_segments:
+            os.remove(os.path.join(self.directory, old_segment))
+
+        _logger.info('Compacted %d segments into %s', len(old_segments),
+            segment)
+
+    def iter_segments(self):
+        return [(os.path.join(self.directory, segment),
+            functools.partial(self._is_live_entry, segment))
+            for segment in self.segments]
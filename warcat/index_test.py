@@ -0,0 +1,135 @@
+from warcat import index
+from warcat.tool import IndexTool, CollectionIndexTool
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+class IndexTestCase(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+        for filename in ('at.warc', 'at.warc.gz'):
+            shutil.copy(os.path.join(self.test_dir, filename),
+                self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def build_index(self, filename):
+        path = os.path.join(self.temp_dir.name, filename)
+        tool = IndexTool([path])
+        tool.process()
+
+        return index.Index(path + index.INDEX_EXTENSION)
+
+
+class TestIndex(IndexTestCase):
+    def test_find_record(self):
+        for filename in ('at.warc', 'at.warc.gz'):
+            warc_index = self.build_index(filename)
+            record_id = '<urn:uuid:972777d2-4177-4c63-9fde-3877dacc174e>' \
+                if filename.endswith('.gz') else \
+                '<urn:uuid:5eadc318-9729-4418-8888-e55814dbcbe8>'
+            entries = warc_index.find_record(record_id)
+
+            self.assertEqual(1, len(entries))
+            self.assertEqual(filename, entries[0].filename)
+
+            record = warc_index.get_record(entries[0])
+
+            self.assertEqual(record_id, record.record_id)
+            self.assertEqual([], warc_index.find_record('<urn:uuid:123>'))
+
+    def test_find_uri(self):
+        warc_index = self.build_index('at.warc.gz')
+        entries = warc_index.find_uri('http://www.archiveteam.org/')
+
+        self.assertEqual(['request', 'response'],
+            sorted(entry.warc_type for entry in entries))
+        self.assertTrue(all(entry.member_offset for entry in entries))
+
+        record = warc_index.get_record(
+            [entry for entry in entries if entry.warc_type == 'response'][0])
+
+        self.assertEqual('http://www.archiveteam.org/', record.target_uri)
+        self.assertEqual(301, record.content_block.fields.status_code)
+
+    def test_closest(self):
+        warc_index = self.build_index('at.warc.gz')
+        url = 'http://www.archiveteam.org/index.php?title=Main_Page'
+        entries = warc_index.closest(url, '2013-04-09T00:11:14Z')
+
+        self.assertEqual(1, len(entries))
+        self.assertEqual('response', entries[0].warc_type)
+        self.assertEqual('20130409001114', entries[0].timestamp)
+        self.assertEqual(1948, entries[0].member_offset)
+
+        entries = warc_index.closest(url, '2012', limit=5, warc_types=None)
+
+        self.assertEqual(['request', 'response'],
+            sorted(entry.warc_type for entry in entries))
+        self.assertEqual([], warc_index.closest('http://example.com/', '2013'))
+
+    def test_entry_line(self):
+        entry = index.IndexEntry('id <a>', 'a.warc', 10, None, '<a>',
+            'response', '20130409000347', 'http://example.com/%20')
+
+        self.assertEqual(entry, index.IndexEntry.parse(entry.to_line()))
+
+
+class TestCollectionIndex(IndexTestCase):
+    def add(self, collection, filenames):
+        tool = CollectionIndexTool([os.path.join(self.temp_dir.name, filename)
+            for filename in filenames], collection=collection)
+        tool.process()
+
+        return tool
+
+    def test_add_and_compact(self):
+        collection = index.CollectionIndex(
+            os.path.join(self.temp_dir.name, 'collection'))
+        record_id = '<urn:uuid:972777d2-4177-4c63-9fde-3877dacc174e>'
+
+        self.add(collection, ['at.warc.gz'])
+        self.assertEqual(1, len(collection.find_record(record_id)))
+
+        tool = self.add(collection, ['at.warc.gz'])
+        self.assertEqual([], tool.indexed_filenames)
+
+        self.build_index('at.warc')
+        tool = self.add(collection, ['at.warc', 'at.warc.gz'])
+        self.assertEqual(1, len(tool.indexed_filenames))
+        self.assertEqual(2, len(collection.segments))
+
+        os.utime(os.path.join(self.temp_dir.name, 'at.warc.gz'), (1, 1))
+        self.add(collection, ['at.warc.gz'])
+        self.assertEqual(3, len(collection.segments))
+        self.assertEqual(1, len(collection.find_record(record_id)))
+
+        collection.compact()
+        collection = index.CollectionIndex(collection.directory)
+
+        self.assertEqual(1, len(collection.segments))
+        self.assertEqual(1, len(collection.find_record(record_id)))
+
+        entries = collection.find_uri('http://www.archiveteam.org/')
+
+        self.assertEqual(4, len(entries))
+        self.assertEqual(sorted(entry.to_line() for entry in entries),
+            [entry.to_line() for entry in entries])
+        self.assertEqual(os.path.join('..', 'at.warc'), entries[0].filename)
+
+        record = collection.get_record(entries[-1])
+        self.assertEqual('http://www.archiveteam.org/', record.target_uri)
+
+        entries = collection.closest('http://www.archiveteam.org/',
+            '20130409001114', limit=2)
+
+        self.assertEqual(['20130409001114', '20130409000347'],
+            [entry.timestamp for entry in entries])
+        self.assertEqual('at.warc.gz', os.path.basename(
+            collection.get_path(entries[0])))
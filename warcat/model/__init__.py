@@ -7,3 +7,4 @@ from .common import *
 from .field import *
 from .record import *
 from .warc import *
+from .writer import *
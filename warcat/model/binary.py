@@ -3,7 +3,6 @@
 # Licensed under GPLv3. See COPYING.txt for details.
 from warcat import util
 import abc
-import gzip
 import logging
 import tempfile
 
@@ -121,7 +120,7 @@ class BinaryFileRef(metaclass=abc.ABCMeta):
             if not file_obj:
                 if self.filename.endswith('.gz'):
                     file_obj = util.DiskBufferedReader(
-                        gzip.GzipFile(self.filename))
+                        util.GzipMemberReader(self.filename))
                 else:
                     file_obj = open(self.filename, 'rb')
 
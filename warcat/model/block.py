@@ -123,6 +123,31 @@ class BlockWithPayload(ContentBlock):
         for v in self.payload.iter_bytes():
             yield v
 
+    def get_decoded_payload(self, decode_content=True, safe=True,
+    strict=True):
+        '''Return a file object of the payload without HTTP codings.
+
+        The transfer coding, such as ``chunked``, is removed. The data is
+        decoded as it is read.
+
+        :param decode_content: If `True`, also remove the content codings
+            such as ``gzip``, ``deflate``, and ``br``.
+        :param safe: See :meth:`.BinaryFileRef.get_file`.
+        :param strict: See :func:`.util.open_decoded`.
+        :raises ValueError: A coding is not supported.
+        '''
+
+        if isinstance(self.fields, HTTPHeader):
+            transfer_encoding = self.fields.get('Transfer-Encoding')
+            content_encoding = self.fields.get('Content-Encoding') \
+                if decode_content else None
+        else:
+            transfer_encoding = content_encoding = None
+
+        return self.payload.get_decoded_file(
+            transfer_encoding=transfer_encoding,
+            content_encoding=content_encoding, safe=safe, strict=strict)
+
 
 class Payload(BytesSerializable, BinaryFileRef):
     '''Data within a content block that has fields'''
@@ -134,5 +159,26 @@ class Payload(BytesSerializable, BinaryFileRef):
         for v in self.iter_file():
             yield v
 
+    def get_decoded_file(self, transfer_encoding=None, content_encoding=None,
+    safe=True, strict=True):
+        '''Return a file object of the data with HTTP codings removed.
+
+        See :func:`.util.open_decoded`. Closing the file object also closes
+        the copy made when `safe` is `True`.
+        '''
+
+        file_obj = self.get_file(safe=safe)
+
+        try:
+            return util.open_decoded(file_obj, self.length,
+                transfer_encoding=transfer_encoding,
+                content_encoding=content_encoding, strict=strict,
+                close_file=safe)
+        except ValueError:
+            if safe:
+                file_obj.close()
+
+            raise
+
 
 __all__ = ['ContentBlock', 'BinaryBlock', 'BlockWithPayload', 'Payload']
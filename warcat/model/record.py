@@ -1,7 +1,7 @@
 '''A WARC record'''
 # Copyright 2013 Christopher Foo <chris.foo@gmail.com>
 # Licensed under GPLv3. See COPYING.txt for details.
-from warcat import util
+from warcat import util, stats
 from warcat.model.binary import BytesSerializable
 from warcat.model.block import ContentBlock, BinaryBlock
 from warcat.model.common import FIELD_DELIM_BYTES, NEWLINE_BYTES
@@ -50,24 +50,30 @@ class Record(BytesSerializable):
             whitespace.
         '''
 
-        _logger.debug('Record start at %d 0x%x', file_obj.tell(),
-            file_obj.tell())
-
         record = Record()
         record.file_offset = file_obj.tell()
-        header_length = util.find_file_pattern(file_obj, FIELD_DELIM_BYTES,
-            inclusive=True)
-        record.header = Header.parse(file_obj.read(header_length))
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Record start at %d 0x%x', record.file_offset,
+                record.file_offset)
+
+        with stats.recorder.time('header_parse'):
+            header_length = util.find_file_pattern(file_obj,
+                FIELD_DELIM_BYTES, inclusive=True)
+            record.header = Header.parse(file_obj.read(header_length))
+
         block_length = record.content_length
 
         _logger.debug('Block length=%d', block_length)
 
-        if not preserve_block:
-            content_type = record.header.fields.get('content-type')
-            record.content_block = ContentBlock.load(file_obj, block_length,
-                content_type)
-        else:
-            record.content_block = BinaryBlock.load(file_obj, block_length)
+        with stats.recorder.time('block_parse'):
+            if not preserve_block:
+                content_type = record.header.fields.get('content-type')
+                record.content_block = ContentBlock.load(file_obj,
+                    block_length, content_type)
+            else:
+                record.content_block = BinaryBlock.load(file_obj,
+                    block_length)
 
         if check_block_length:
             new_content_length = record.content_block.length
@@ -121,7 +127,8 @@ class Record(BytesSerializable):
         self.header.fields['WARC-Target-URI'] = s
 
     def iter_bytes(self):
-        _logger.debug('Iter bytes on record %s', self.record_id)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Iter bytes on record %s', self.record_id)
 
         for v in self.header.iter_bytes():
             yield v
@@ -5,7 +5,6 @@ from warcat import util
 from warcat.model.binary import BytesSerializable
 from warcat.model.common import FIELD_DELIM_BYTES
 from warcat.model.record import Record
-import gzip
 import logging
 
 
@@ -42,22 +41,38 @@ class WARC(BytesSerializable):
                 break
 
     @classmethod
-    def open(cls, filename, force_gzip=False):
+    def open(cls, filename, force_gzip=False, offset=0, member=None):
         '''Return a logical file object.
 
         :param filename: The path of the file. gzip compression is detected
             using file extension.
         :param force_gzip: Use gzip compression always.
+        :param offset: The position in the uncompressed data to seek to.
+        :param member: For gzip compressed files, a tuple of the position and
+            offset of a gzip member at or before `offset` to start
+            decompression from. Data before the member cannot be read.
         '''
 
         if filename.endswith('.gz') or force_gzip:
-            f = gzip.open(filename)
+            if member:
+                # The reader is given a file object so content blocks
+                # reference it instead of decompressing from the start
+                f = util.GzipMemberReader(open(filename, 'rb'),
+                    member_offset=member[1], position=member[0])
+            else:
+                f = util.GzipMemberReader(filename)
+
             _logger.info('Opened gziped file %s', filename)
-            return util.DiskBufferedReader(f)
+            f = util.DiskBufferedReader(f,
+                base_offset=member[0] if member else 0)
         else:
             f = open(filename, 'rb')
             _logger.info('Opened file %s', filename)
-            return f
+
+        if offset:
+            f.seek(offset)
+
+        return f
 
     @classmethod
     def read_record(cls, file_object, preserve_block=False,
@@ -73,7 +88,8 @@ class WARC(BytesSerializable):
 
         record = Record.load(file_object, preserve_block=preserve_block,
             check_block_length=check_block_length)
-        _logger.debug('Finished reading a record %s', record.record_id)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Finished reading a record %s', record.record_id)
 
         data = file_object.read(len(FIELD_DELIM_BYTES))
 
@@ -88,6 +104,42 @@ class WARC(BytesSerializable):
         else:
             return (record, True)
 
+    @classmethod
+    def read_record_at(cls, filename, offset, member_offset=None,
+    force_gzip=False, preserve_block=False):
+        '''Return the record at the given offset without reading the records
+        before it.
+
+        :param filename: The path of the file.
+        :param offset: The offset of the record in the uncompressed data.
+            If `None`, the record is read from the start of the member at
+            `member_offset` and the offsets of the record are relative to
+            the member.
+        :param member_offset: For gzip compressed files, the offset of the
+            gzip member that the record starts in. If not given, the file is
+            decompressed from the start up to `offset`.
+        :param force_gzip: Use gzip compression always.
+        :param preserve_block: See :meth:`.Record.load`.
+        '''
+
+        if filename.endswith('.gz') or force_gzip \
+        or member_offset is not None:
+            # The content block references the reader since only it knows
+            # where the member is
+            if member_offset is None:
+                file_obj = util.GzipMemberReader(open(filename, 'rb'))
+            else:
+                file_obj = util.GzipMemberReader(open(filename, 'rb'),
+                    member_offset=member_offset, position=offset or 0)
+
+            file_obj.seek(offset or 0)
+
+            return Record.load(file_obj, preserve_block=preserve_block)
+
+        with open(filename, 'rb') as file_obj:
+            file_obj.seek(offset)
+            return Record.load(file_obj, preserve_block=preserve_block)
+
     def iter_bytes(self):
         for record in self.records:
             for v in record.iter_bytes():
@@ -0,0 +1,319 @@
+'''Writing WARC files'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import stats, util
+from warcat.model.common import FIELD_DELIM_BYTES, NEWLINE_BYTES
+from warcat.model.field import Fields, Header
+import base64
+import collections
+import datetime
+import hashlib
+import logging
+import tempfile
+import uuid
+import zlib
+
+
+_logger = logging.getLogger(__name__)
+
+
+class WrittenRecord(collections.namedtuple('WrittenRecord', ['record_id',
+'warc_type', 'offset', 'length', 'file_offset', 'file_length',
+'payload_digest'])):
+    '''Where a record was written by :class:`WARCWriter`.
+
+    .. attribute:: offset
+
+        The offset of the record in the uncompressed data.
+
+    .. attribute:: length
+
+        The uncompressed length of the record including the separator.
+
+    .. attribute:: file_offset
+
+        The offset of the record in the file. If the file is compressed,
+        this is the offset of the gzip member of the record.
+
+    .. attribute:: file_length
+
+        The number of bytes written to the file for the record.
+
+    .. attribute:: payload_digest
+
+        The ``WARC-Payload-Digest`` value or `None`.
+    '''
+
+    __slots__ = ()
+
+
+def format_digest(algorithm, digest):
+    '''Return a digest field value of the algorithm name and `bytes`'''
+
+    return '{}:{}'.format(algorithm, base64.b32encode(digest).decode())
+
+
+def get_digest_algorithms(fields, name):
+    '''Return a `set` of the lowercase algorithm names of a digest field'''
+
+    return set(value.split(':', 1)[0].strip().lower()
+        for dummy, value in fields.get_list(name))
+
+
+def set_digests(fields, name, digests, keep=False):
+    '''Set a digest field to a list of tuples of algorithm names and
+    `bytes`.
+
+    If `keep` is `True`, the fields already present stay and the digests
+    are added after them.
+    '''
+
+    values = [format_digest(algorithm, digest)
+        for algorithm, digest in digests]
+
+    if not keep and values:
+        fields[name] = values.pop(0)
+
+    for value in values:
+        fields.add(name, value)
+
+
+class WARCWriter(object):
+    '''Writes records to a file object.
+
+    :meth:`write_record` computes the digests and length of a block while
+    reading it once. Output is collected into large writes.
+
+    Offsets count from where the writer started writing.
+
+    :param file_obj: A file object opened for writing `bytes`.
+    :param write_gzip: If `True`, each record is a gzip member.
+    :param compress_level: The zlib compression level.
+    :param digest_algorithm: A `hashlib` algorithm name or a list of
+        names. With more than one name, a digest field is written for each.
+    :param buffer_size: How much output to collect before writing.
+    :param spool_size: Blocks up to this size are held in memory while
+        their digests are computed. Larger blocks go to a temporary file.
+    '''
+
+    def __init__(self, file_obj, write_gzip=False, compress_level=6,
+    digest_algorithm='sha1', buffer_size=1048576, spool_size=10485760):
+        self.file_obj = file_obj
+        self.write_gzip = write_gzip
+        self.compress_level = compress_level
+        self.digest_algorithms = [digest_algorithm] \
+            if isinstance(digest_algorithm, str) else list(digest_algorithm)
+        self.buffer_size = buffer_size
+        self.spool_size = spool_size
+        self.offset = 0
+        self.file_offset = 0
+        self._buffer = bytearray()
+        self._compressor = None
+
+    def write_record(self, fields, block=b'', http_header=None,
+    length=None, payload_digest=None, keep_digests=False):
+        '''Write a record and return a :class:`WrittenRecord`.
+
+        ``Content-Length`` and ``WARC-Block-Digest`` are set.
+        ``WARC-Record-ID`` and ``WARC-Date`` are added if missing.
+
+        :param fields: A :class:`.Fields`, :class:`.Header`, or list of
+            name and value tuples. It is not modified.
+        :param block: `bytes` or a file object of the block. If
+            `http_header` is given, this is the payload after it.
+        :param http_header: A :class:`.HTTPHeader` or the `bytes` of the
+            HTTP header including the blank line after it. It starts the
+            block.
+        :param length: Read at most this much from a file object.
+        :param payload_digest: If `True`, ``WARC-Payload-Digest`` is set.
+            If `None`, it is set when `http_header` is given. If `False`,
+            it is left as is. Without `http_header`, the payload is the
+            whole block.
+        :param keep_digests: If `True`, digest fields of the algorithms
+            that are already in `fields` are kept, and only the digests of
+            the other algorithms are computed.
+        '''
+
+        if isinstance(fields, Header):
+            version = fields.version
+            fields = fields.fields
+        else:
+            version = Header.VERSION
+
+        fields = Fields(list(fields.list() if isinstance(fields, Fields)
+            else fields))
+
+        if 'WARC-Record-ID' not in fields:
+            fields['WARC-Record-ID'] = '<urn:uuid:{}>'.format(uuid.uuid4())
+
+        if 'WARC-Date' not in fields:
+            fields['WARC-Date'] = datetime.datetime.utcnow().strftime(
+                '%Y-%m-%dT%H:%M:%SZ')
+
+        if payload_digest is None:
+            payload_digest = http_header is not None
+
+        block_hashes = self._new_hashes(fields, 'WARC-Block-Digest',
+            keep_digests)
+        payload_hashes = self._new_hashes(fields, 'WARC-Payload-Digest',
+            keep_digests) if payload_digest else []
+
+        if http_header is not None and not isinstance(http_header, bytes):
+            http_header = bytes(http_header) + NEWLINE_BYTES
+
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_size) \
+        as spool_file:
+            with stats.recorder.time('digest'):
+                if http_header:
+                    for dummy, hash_obj in block_hashes:
+                        hash_obj.update(http_header)
+
+                block_length = self._spool(block, length, spool_file,
+                    [hash_obj for dummy, hash_obj
+                        in block_hashes + payload_hashes]) \
+                    + len(http_header or b'')
+
+            set_digests(fields, 'WARC-Block-Digest',
+                [(algorithm, hash_obj.digest())
+                    for algorithm, hash_obj in block_hashes],
+                keep=keep_digests)
+            set_digests(fields, 'WARC-Payload-Digest',
+                [(algorithm, hash_obj.digest())
+                    for algorithm, hash_obj in payload_hashes],
+                keep=keep_digests)
+
+            fields['Content-Length'] = str(block_length)
+            header = Header(version, fields)
+
+            if isinstance(block, bytes):
+                chunks = (bytes(header), http_header or b'', block,
+                    FIELD_DELIM_BYTES)
+            else:
+                spool_file.seek(0)
+                chunks = self._iter_spool(bytes(header), http_header,
+                    spool_file)
+
+            return self.write_bytes(chunks, fields['WARC-Record-ID'],
+                fields.get('WARC-Type'), fields.get('WARC-Payload-Digest'))
+
+    def _new_hashes(self, fields, name, keep_digests):
+        '''Return a list of tuples of algorithm names and hash objects of
+        the digests to compute'''
+
+        present = get_digest_algorithms(fields, name) if keep_digests \
+            else ()
+
+        return [(algorithm, hashlib.new(algorithm))
+            for algorithm in self.digest_algorithms
+            if algorithm not in present]
+
+    def _spool(self, block, length, spool_file, hash_objs):
+        '''Hash the block and copy a file object to the spool file'''
+
+        if isinstance(block, bytes):
+            for hash_obj in hash_objs:
+                hash_obj.update(block)
+
+            return len(block)
+
+        block_length = 0
+
+        while length is None or block_length < length:
+            read_size = util.BUFFER_SIZE if length is None \
+                else min(util.BUFFER_SIZE, length - block_length)
+            data = block.read(read_size)
+
+            if not data:
+                break
+
+            for hash_obj in hash_objs:
+                hash_obj.update(data)
+
+            spool_file.write(data)
+            block_length += len(data)
+
+        return block_length
+
+    def _iter_spool(self, header_bytes, http_header, spool_file):
+        yield header_bytes
+
+        if http_header:
+            yield http_header
+
+        while True:
+            data = spool_file.read(util.BUFFER_SIZE)
+
+            if not data:
+                break
+
+            yield data
+
+        yield FIELD_DELIM_BYTES
+
+    def write_bytes(self, chunks, record_id=None, warc_type=None,
+    payload_digest=None):
+        '''Write a serialized record as is and return a
+        :class:`WrittenRecord`.
+
+        :param chunks: An iterable of `bytes` such as
+            :meth:`.Record.iter_bytes`.
+        '''
+
+        offset = self.offset
+        file_offset = self.file_offset
+
+        with stats.recorder.time('write'):
+            if self.write_gzip:
+                self._compressor = zlib.compressobj(self.compress_level,
+                    zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+            for data in chunks:
+                self.offset += len(data)
+
+                if self._compressor:
+                    data = self._compressor.compress(data)
+
+                self._write(data)
+
+            if self._compressor:
+                self._write(self._compressor.flush())
+                self._compressor = None
+
+        stats.recorder.add('records')
+
+        written_record = WrittenRecord(record_id, warc_type, offset,
+            self.offset - offset, file_offset, self.file_offset - file_offset,
+            payload_digest)
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Wrote record %s at %d', record_id, file_offset)
+
+        return written_record
+
+    def _write(self, data):
+        self.file_offset += len(data)
+        self._buffer += data
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.file_obj.write(self._buffer)
+            self._buffer = bytearray()
+
+        self.file_obj.flush()
+
+    def close(self):
+        '''Flush the output. The file object is not closed.'''
+
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+__all__ = ['WARCWriter', 'WrittenRecord']
@@ -1,8 +1,9 @@
 import gzip
 
-from warcat import model, util
+from warcat import model, util, verify
 import io
 import os.path
+import tempfile
 import unittest
 
 
@@ -17,6 +18,39 @@ Content-LENGTH: 10\r\n
 ''')
 
 
+def write_warc(filename, records, digest_algorithm='sha1'):
+    '''Write a WARC file of tuples of the WARC type, the target URI or
+    `None`, and the block.
+
+    Requests and responses are HTTP records with a payload digest.
+    '''
+
+    with open(filename, 'wb') as f:
+        writer = model.WARCWriter(f, digest_algorithm=digest_algorithm)
+
+        for warc_type, target_uri, block in records:
+            fields = [('WARC-Type', warc_type),
+                ('WARC-Date', '2013-01-01T00:00:00Z')]
+            http_header = None
+
+            if target_uri:
+                fields.append(('WARC-Target-URI', target_uri))
+
+            if warc_type in ('request', 'response'):
+                fields.append(('Content-Type',
+                    'application/http;msgtype=' + warc_type))
+                http_header, delim, block = block.partition(b'\r\n\r\n')
+                http_header += delim
+            elif warc_type == 'warcinfo':
+                fields.append(('Content-Type', 'application/warc-fields'))
+            else:
+                fields.append(('Content-Type', 'text/plain'))
+
+            writer.write_record(fields, block, http_header=http_header)
+
+        writer.close()
+
+
 class TestModel(unittest.TestCase):
     def test_fields_parse(self):
         fields = model.Fields.parse(fields_str)
@@ -141,3 +175,101 @@ class TestReading(unittest.TestCase):
 
         warc.load(os.path.join(self.test_dir, 'at.warc'))
         bytes(warc)
+
+    def test_read_record_at(self):
+        filename = os.path.join(self.test_dir, 'at.warc')
+        record = model.WARC.read_record_at(filename, 2740)
+
+        self.assertEqual('<urn:uuid:5eadc318-9729-4418-8888-e55814dbcbe8>',
+            record.record_id)
+        self.assertEqual(2740, record.file_offset)
+
+    def test_read_record_at_gzip(self):
+        filename = os.path.join(self.test_dir, 'at.warc.gz')
+        record = model.WARC.read_record_at(filename, 2719, member_offset=1948)
+
+        self.assertEqual('response', record.warc_type)
+        self.assertEqual(2719, record.file_offset)
+        self.assertIn(b'<!DOCTYPE',
+            bytes(record.content_block.payload)[:20])
+
+        record = model.WARC.read_record_at(filename, None, member_offset=1948)
+        self.assertEqual('response', record.warc_type)
+
+        record = model.WARC.read_record_at(filename, 2719)
+        self.assertEqual('response', record.warc_type)
+
+    def test_decoded_payload(self):
+        body = b'Hello world! ' * 1000
+        gzip_body = gzip.compress(body)
+        http_block = b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n' \
+            b'Transfer-Encoding: chunked\r\n\r\n' \
+            + '{:x}\r\n'.format(len(gzip_body)).encode() + gzip_body \
+            + b'\r\n0\r\n\r\n'
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'test.warc')
+
+            write_warc(filename, [('response', None, http_block)])
+
+            record = model.WARC.read_record_at(filename, 0)
+
+            with record.content_block.get_decoded_payload() as f:
+                self.assertEqual(body, f.read())
+
+            with record.content_block.get_decoded_payload(
+            decode_content=False) as f:
+                self.assertEqual(gzip_body, f.read())
+
+    def test_writer(self):
+        payload = b'<html>' + os.urandom(100000) + b'</html>'
+        http_header = model.HTTPHeader([('Content-Type', 'text/html')],
+            status='HTTP/1.1 200 OK')
+
+        for write_gzip in (False, True):
+            file_obj = io.BytesIO()
+            writer = model.WARCWriter(file_obj, write_gzip=write_gzip,
+                spool_size=1024)
+            written_records = [
+                writer.write_record([('WARC-Type', 'warcinfo'),
+                    ('Content-Type', 'application/warc-fields')],
+                    b'software: warcat\r\n\r\n'),
+                writer.write_record([('WARC-Type', 'response'),
+                    ('WARC-Target-URI', 'http://example.com/'),
+                    ('Content-Type', 'application/http;msgtype=response')],
+                    io.BytesIO(payload), http_header=http_header),
+                writer.write_record(model.Header(fields=model.Fields(
+                    [('WARC-Type', 'resource'),
+                    ('Content-Type', 'text/plain')])),
+                    io.BytesIO(b'Hello world!!'), length=12,
+                    payload_digest=True),
+            ]
+            writer.close()
+
+            self.assertEqual(len(file_obj.getvalue()),
+                sum(record.file_length for record in written_records))
+            self.assertIsNone(written_records[0].payload_digest)
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                filename = os.path.join(temp_dir, 'test.warc')
+
+                with open(filename, 'wb') as f:
+                    f.write(file_obj.getvalue())
+
+                for written_record in written_records:
+                    record = model.WARC.read_record_at(filename,
+                        written_record.offset,
+                        member_offset=written_record.file_offset
+                            if write_gzip else None)
+
+                    self.assertEqual(written_record.record_id,
+                        record.record_id)
+                    self.assertTrue(verify.verify_block_digest(record))
+
+                    if written_record.warc_type == 'response':
+                        self.assertEqual(payload,
+                            bytes(record.content_block.payload))
+                        self.assertTrue(verify.verify_payload_digest(record))
+                    elif written_record.warc_type == 'resource':
+                        self.assertEqual(b'Hello world!',
+                            bytes(record.content_block))
@@ -0,0 +1,135 @@
+'''Content addressed storage of extracted files'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+
+_logger = logging.getLogger(__name__)
+
+
+class ObjectWriter(object):
+    '''A new object being written to an :class:`ObjectStore`.
+
+    Use it as a context manager. The object is added when the ``with``
+    block ends without an exception. Afterwards, :attr:`path` is the
+    filename of the object.
+    '''
+
+    def __init__(self, store, key=None):
+        self._store = store
+        self._key = key
+        self._hash = hashlib.sha1()
+        self._file = tempfile.NamedTemporaryFile(dir=store.temp_dir,
+            delete=False)
+        self.path = None
+
+    def write(self, data):
+        self._hash.update(data)
+        self._file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+
+        if exc_type:
+            os.remove(self._file.name)
+        else:
+            self.path = self._store.add_file(self._file.name,
+                self._hash.hexdigest(), self._key)
+
+
+class ObjectStore(object):
+    '''A directory of files named by the SHA-1 of their contents.
+
+    A sqlite database maps keys, such as a payload digest, to objects so a
+    known payload can be used again without reading it. The directory can
+    be used across runs.
+
+    The methods are thread safe.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.temp_dir = os.path.join(directory, 'tmp')
+        self._lock = threading.Lock()
+
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+        self._connection = sqlite3.connect(
+            os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS keys ('
+            'key TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def get(self, key):
+        '''Return the filename of the object of the key or `None`'''
+
+        with self._lock:
+            row = self._connection.execute('SELECT digest FROM keys '
+                'WHERE key = ?', (key,)).fetchone()
+
+        if row and os.path.exists(self.object_path(row[0])):
+            return self.object_path(row[0])
+
+    def new_object(self, key=None):
+        '''Return a :class:`ObjectWriter` for a new object'''
+
+        return ObjectWriter(self, key)
+
+    def add_file(self, filename, digest, key=None):
+        '''Move a file into the store and return the filename of the object.
+
+        If the object already exists, the file is removed.
+        '''
+
+        path = self.object_path(digest)
+
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(filename)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(filename, path)
+
+            if key:
+                with self._connection:
+                    self._connection.execute('INSERT OR REPLACE INTO keys '
+                        '(key, digest) VALUES (?, ?)', (key, digest))
+
+        return path
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+def link_file(object_path, path, symbolic=False):
+    '''Make a link to the object at the path, replacing any file there.
+
+    If a hard link cannot be made, such as across file systems, the object
+    is copied.
+    '''
+
+    if os.path.lexists(path):
+        os.remove(path)
+
+    if symbolic:
+        os.symlink(os.path.relpath(object_path, os.path.dirname(path)), path)
+        return
+
+    try:
+        os.link(object_path, path)
+    except OSError as error:
+        _logger.debug('Copying %s instead of linking: %s', object_path, error)
+        shutil.copyfile(object_path, path)
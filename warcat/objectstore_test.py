@@ -0,0 +1,50 @@
+from warcat.objectstore import ObjectStore, link_file
+import os.path
+import tempfile
+import unittest
+
+
+class TestObjectStore(unittest.TestCase):
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = ObjectStore(os.path.join(temp_dir, 'store'))
+
+            with store.new_object('key1') as f:
+                f.write(b'hello')
+
+            path = f.path
+
+            with store.new_object() as f:
+                f.write(b'hel')
+                f.write(b'lo')
+
+            self.assertEqual(path, f.path)
+            self.assertEqual(path, store.get('key1'))
+            self.assertIsNone(store.get('key2'))
+            self.assertFalse(os.listdir(store.temp_dir))
+
+            try:
+                with store.new_object('key2') as f:
+                    f.write(b'bye')
+                    raise ValueError()
+            except ValueError:
+                pass
+
+            self.assertIsNone(store.get('key2'))
+            self.assertFalse(os.listdir(store.temp_dir))
+            store.close()
+
+            store = ObjectStore(os.path.join(temp_dir, 'store'))
+            self.assertEqual(path, store.get('key1'))
+            store.close()
+
+            for symbolic in (False, True):
+                link_path = os.path.join(temp_dir, 'link')
+
+                with open(link_path, 'wb') as f:
+                    f.write(b'old')
+
+                link_file(path, link_path, symbolic=symbolic)
+
+                self.assertEqual(symbolic, os.path.islink(link_path))
+                self.assertTrue(os.path.samefile(path, link_path))
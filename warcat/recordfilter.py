@@ -0,0 +1,194 @@
+'''Record filtering'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import util
+import hashlib
+import logging
+import math
+import re
+
+
+_logger = logging.getLogger(__name__)
+
+
+def load_list(filename):
+    '''Return a list of lines in a file.
+
+    Blank lines and lines starting with ``#`` are ignored.
+    '''
+
+    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+        return [line.strip() for line in f
+            if line.strip() and not line.startswith('#')]
+
+
+class PrefixSet(object):
+    '''A set of prefixes.
+
+    Prefixes are grouped by length so matching a string costs one hash
+    lookup for each distinct prefix length instead of one comparison for
+    each prefix.
+    '''
+
+    def __init__(self, prefixes=()):
+        self._prefixes = set()
+        self._lengths = []
+
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        self._prefixes.add(prefix)
+
+        if len(prefix) not in self._lengths:
+            self._lengths.append(len(prefix))
+            self._lengths.sort()
+
+    def match(self, s):
+        '''Return whether the string starts with a prefix'''
+
+        for length in self._lengths:
+            if length > len(s):
+                break
+
+            if s[:length] in self._prefixes:
+                return True
+
+        return False
+
+    def __len__(self):
+        return len(self._prefixes)
+
+
+class BloomFilter(object):
+    '''A compact set that may have false positives.
+
+    :param capacity: The expected number of items.
+    :param error_rate: The rate of false positives at capacity.
+    '''
+
+    def __init__(self, capacity, error_rate=1e-6):
+        capacity = max(1, capacity)
+        self._num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)) | 1
+        self._num_hashes = max(1, int(round(
+            self._num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+        self._len = 0
+
+    def _iter_indexes(self, item):
+        digest = hashlib.sha1(item.encode()).digest()
+        hash_1 = int.from_bytes(digest[:8], 'big')
+        hash_2 = int.from_bytes(digest[8:16], 'big')
+
+        # Enhanced double hashing
+        for i in range(self._num_hashes):
+            yield (hash_1 + i * hash_2 + (i ** 3 - i) // 6) % self._num_bits
+
+    def add(self, item):
+        for index in self._iter_indexes(item):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+        self._len += 1
+
+    def __contains__(self, item):
+        for index in self._iter_indexes(item):
+            if not self._bits[index >> 3] & (1 << (index & 7)):
+                return False
+
+        return True
+
+    def __len__(self):
+        return self._len
+
+
+def new_set(items, approximate=False):
+    '''Return a `frozenset` or a :class:`BloomFilter` if approximate'''
+
+    if not approximate:
+        return frozenset(items)
+
+    items = list(items)
+    bloom_filter = BloomFilter(len(items))
+
+    for item in items:
+        bloom_filter.add(item)
+
+    return bloom_filter
+
+
+class RecordFilter(object):
+    '''Decides whether a record should be processed.
+
+    A record matches if its ID is one of the record IDs and its target URI
+    matches any of the URI criteria. Criteria that are not given always
+    match. Lists are hashed and patterns are compiled once so matching a
+    record does not depend on the length of the lists.
+
+    :param record_ids: Record IDs.
+    :param target_uris: Exact target URIs.
+    :param uri_prefixes: Prefixes of target URIs.
+    :param surt_prefixes: Prefixes of the SURT of target URIs.
+    :param uri_patterns: Regular expressions searched in target URIs.
+    :param approximate: If `True`, record IDs and target URIs are stored
+        in a :class:`BloomFilter`. It uses less memory but a small number
+        of extra records may match.
+    '''
+
+    def __init__(self, record_ids=None, target_uris=None, uri_prefixes=None,
+    surt_prefixes=None, uri_patterns=None, approximate=False):
+        self.record_ids = new_set(record_ids, approximate) \
+            if record_ids else None
+        self.target_uris = new_set(target_uris, approximate) \
+            if target_uris else None
+        self.uri_prefixes = PrefixSet(uri_prefixes) if uri_prefixes else None
+        self.surt_prefixes = PrefixSet(util.surt(prefix)
+            for prefix in surt_prefixes) if surt_prefixes else None
+        self.uri_pattern = re.compile('|'.join(
+            '(?:{})'.format(pattern) for pattern in uri_patterns)) \
+            if uri_patterns else None
+
+        self.has_uri_criteria = any(criteria is not None for criteria in (
+            self.target_uris, self.uri_prefixes, self.surt_prefixes,
+            self.uri_pattern))
+
+    def __bool__(self):
+        return self.record_ids is not None or self.has_uri_criteria
+
+    def match(self, record):
+        '''Return whether the :class:`.Record` should be processed'''
+
+        if self.record_ids is not None \
+        and record.record_id not in self.record_ids:
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug('Skipping %s due to record id filter',
+                    record.record_id)
+
+            return False
+
+        if self.has_uri_criteria and not self.match_uri(record.target_uri):
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug('Skipping %s due to target URI filter',
+                    record.target_uri)
+
+            return False
+
+        return True
+
+    def match_uri(self, uri):
+        '''Return whether the target URI matches any URI criteria'''
+
+        if self.target_uris is not None and uri in self.target_uris:
+            return True
+
+        if self.uri_prefixes and self.uri_prefixes.match(uri):
+            return True
+
+        if self.surt_prefixes and uri and \
+        self.surt_prefixes.match(util.surt(uri)):
+            return True
+
+        if self.uri_pattern and self.uri_pattern.search(uri):
+            return True
+
+        return False
@@ -0,0 +1,58 @@
+from warcat import recordfilter, model
+import os.path
+import tempfile
+import unittest
+
+
+class TestRecordFilter(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def test_prefix_set(self):
+        prefix_set = recordfilter.PrefixSet(['http://a.example/', 'http://b'])
+
+        self.assertTrue(prefix_set.match('http://a.example/index.html'))
+        self.assertTrue(prefix_set.match('http://b.example/'))
+        self.assertFalse(prefix_set.match('http://c.example/'))
+        self.assertFalse(prefix_set.match('http://'))
+
+    def test_bloom_filter(self):
+        bloom_filter = recordfilter.BloomFilter(1000)
+
+        for i in range(1000):
+            bloom_filter.add(str(i))
+
+        self.assertTrue(all(str(i) in bloom_filter for i in range(1000)))
+        self.assertLess(sum(str(i) in bloom_filter
+            for i in range(1000, 100000)), 5)
+
+    def test_load_list(self):
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('# comment\n<urn:uuid:1>\n\n  <urn:uuid:2>  \n')
+            f.flush()
+
+            self.assertEqual(['<urn:uuid:1>', '<urn:uuid:2>'],
+                recordfilter.load_list(f.name))
+
+    def test_record_filter(self):
+        warc = model.WARC()
+        warc.load(os.path.join(self.test_dir, 'at.warc'))
+
+        def count(**kwargs):
+            record_filter = recordfilter.RecordFilter(**kwargs)
+            return sum(record_filter.match(record) for record in warc.records)
+
+        self.assertEqual(8, count())
+        self.assertEqual(1, count(record_ids=[
+            '<urn:uuid:5eadc318-9729-4418-8888-e55814dbcbe8>']))
+        self.assertEqual(1, count(record_ids=[
+            '<urn:uuid:5eadc318-9729-4418-8888-e55814dbcbe8>'],
+            approximate=True))
+        self.assertEqual(2, count(
+            target_uris=['http://www.archiveteam.org/']))
+        self.assertEqual(4, count(
+            uri_prefixes=['http://www.archiveteam.org/']))
+        self.assertEqual(3, count(surt_prefixes=['org,gnu)/']))
+        self.assertEqual(5, count(surt_prefixes=['org,gnu)/'],
+            uri_patterns=[r'^http://www\.archiveteam\.org/$']))
+        self.assertEqual(1, count(uri_patterns=[r'title=Main_Page$'],
+            record_ids=['<urn:uuid:5eadc318-9729-4418-8888-e55814dbcbe8>']))
@@ -0,0 +1,410 @@
+'''Recovery of records from damaged archives'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import stats
+from warcat.gzipcheck import MEMBER_HEADER, Window, skip_padding
+from warcat.model.common import FIELD_DELIM_BYTES
+from warcat.model.field import Header
+from warcat.verify import ALGORITHM_MAP, parse_digest_field
+import binascii
+import collections
+import logging
+import os
+import tempfile
+import zlib
+
+
+_logger = logging.getLogger(__name__)
+
+RECORD_START = b'WARC/1.'
+MAX_HEADER_SIZE = 1048576
+READ_SIZE = 1048576
+
+
+class SalvageProblem(collections.namedtuple('SalvageProblem', ['offset',
+'message'])):
+    '''Damaged data that was skipped.
+
+    Offsets of gzip problems are in the compressed file. Other offsets are
+    in the recovered uncompressed data.
+    '''
+
+    __slots__ = ()
+
+    def __str__(self):
+        return 'Offset {}: {}'.format(self.offset, self.message)
+
+
+class RecordScanner(object):
+    '''Finds complete records in data that may have damaged parts.
+
+    Data is given with :meth:`feed`. A record is accepted only if its
+    header parses, its block has the length in the header, it is followed
+    by the record separator, and it does not span data that was lost.
+    Otherwise, scanning resumes at the next line starting with ``WARC/1.``.
+
+    At most `max_buffer_size` bytes are held in memory. Data after that
+    goes to a temporary file, so a record with a large Content-Length,
+    whether it is damaged or not, is checked without reading it into
+    memory.
+
+    :param check_digest: If `True`, records with a block digest that does
+        not match are also skipped. This catches blocks that lost or gained
+        data but happen to be followed by a separator.
+    :param max_buffer_size: The size of the data held in memory. It is at
+        least :data:`MAX_HEADER_SIZE`.
+    '''
+
+    MAX_BUFFER_SIZE = 16777216
+
+    def __init__(self, check_digest=True, max_buffer_size=MAX_BUFFER_SIZE):
+        self._check_digest = check_digest
+        self.max_buffer_size = max(max_buffer_size, MAX_HEADER_SIZE)
+        self._buffer = bytearray()
+        self._spool = None
+        self._spool_position = 0
+        self._spool_size = 0
+        self._offset = 0
+        self._gaps = collections.deque()
+        self._after_bad_record = False
+        self.problems = []
+
+    def feed(self, data):
+        if self._spool or len(self._buffer) + len(data) \
+        > self.max_buffer_size:
+            if not self._spool:
+                self._spool = tempfile.TemporaryFile()
+                self._spool_position = self._spool_size = 0
+
+            self._spool.seek(self._spool_size)
+            self._spool.write(data)
+            self._spool_size += len(data)
+        else:
+            self._buffer += data
+
+    def _fill(self):
+        '''Move data from the temporary file to the buffer'''
+
+        if not self._spool:
+            return
+
+        size = self.max_buffer_size - len(self._buffer)
+
+        if size > 0:
+            self._spool.seek(self._spool_position)
+            data = self._spool.read(size)
+            self._buffer += data
+            self._spool_position += len(data)
+
+        if self._spool_position == self._spool_size:
+            self._spool.close()
+            self._spool = None
+
+    def _available(self):
+        return len(self._buffer) + self._spool_size - self._spool_position \
+            if self._spool else len(self._buffer)
+
+    def _iter_range(self, start, end):
+        '''Yield the `bytes` of the data between the offsets from the
+        start of the buffer'''
+
+        if start < len(self._buffer):
+            yield bytes(self._buffer[start:min(end, len(self._buffer))])
+
+        start = max(start, len(self._buffer))
+        position = self._spool_position + start - len(self._buffer)
+
+        while start < end and self._spool:
+            self._spool.seek(position)
+            data = self._spool.read(min(end - start, READ_SIZE))
+
+            if not data:
+                break
+
+            start += len(data)
+            position += len(data)
+
+            yield data
+
+    def mark_gap(self):
+        '''Mark that data was lost at the current end of the data'''
+
+        self._gaps.append(self._offset + self._available())
+
+    def iter_records(self, final=False):
+        '''Return an iterator of tuples of the offset and an iterator of
+        the `bytes` of records.
+
+        The data of a record must be read before the next record.
+
+        :param final: If `True`, there is no more data, so incomplete
+            records at the end are discarded.
+        '''
+
+        while True:
+            self._fill()
+
+            if not self._buffer:
+                break
+
+            while self._gaps and self._gaps[0] <= self._offset:
+                self._gaps.popleft()
+
+            if not self._buffer.startswith(RECORD_START):
+                if not self._resync(final):
+                    return
+
+                continue
+
+            header_end = self._buffer.find(FIELD_DELIM_BYTES, 0,
+                MAX_HEADER_SIZE)
+
+            if header_end < 0:
+                if len(self._buffer) < MAX_HEADER_SIZE and not final:
+                    return
+
+                self._skip_bad('Record header not found')
+                continue
+
+            header_end += len(FIELD_DELIM_BYTES)
+
+            try:
+                header = Header.parse(bytes(self._buffer[:header_end]))
+                block_length = int(header.fields['Content-Length'])
+
+                if block_length < 0:
+                    raise ValueError('Negative Content-Length')
+            except (ValueError, KeyError, IOError, UnicodeError) as error:
+                self._skip_bad('Bad record header: {}'.format(error))
+                continue
+
+            record_length = header_end + block_length \
+                + len(FIELD_DELIM_BYTES)
+
+            if self._gaps and self._gaps[0] < self._offset + record_length:
+                self._skip_bad('Record spans lost data')
+                continue
+
+            if self._available() < record_length:
+                if not final:
+                    return
+
+                self._skip_bad('Record is truncated')
+                continue
+
+            if b''.join(self._iter_range(
+            record_length - len(FIELD_DELIM_BYTES), record_length)) \
+            != FIELD_DELIM_BYTES:
+                self._skip_bad('Block length does not match Content-Length')
+                continue
+
+            digest = header.fields.get('WARC-Block-Digest')
+
+            if digest and self._check_digest and not self._is_digest_ok(
+            digest, header_end, record_length - len(FIELD_DELIM_BYTES)):
+                self._skip_bad('Bad block digest')
+                continue
+
+            self._after_bad_record = False
+
+            yield (self._offset, self._iter_range(0, record_length))
+
+            self._consume(record_length)
+
+    def _is_digest_ok(self, digest, start, end):
+        try:
+            algorithm, digest_bytes = parse_digest_field(digest)
+        except (ValueError, binascii.Error):
+            return True
+
+        if algorithm not in ALGORITHM_MAP:
+            return True
+
+        hash_obj = ALGORITHM_MAP[algorithm]()
+
+        for data in self._iter_range(start, end):
+            hash_obj.update(data)
+
+        return hash_obj.digest() == digest_bytes
+
+    def _consume(self, length):
+        self._offset += length
+
+        if length > len(self._buffer):
+            self._spool_position += length - len(self._buffer)
+            length = len(self._buffer)
+
+        del self._buffer[:length]
+
+    def _skip_bad(self, message):
+        _logger.debug('Bad record at %d: %s', self._offset, message)
+        self.problems.append(SalvageProblem(self._offset, message))
+        self._consume(1)
+        self._after_bad_record = True
+
+    def _resync(self, final):
+        '''Discard data before the next record start.
+
+        Returns `False` if more data is needed.
+        '''
+
+        index = self._buffer.find(b'\n' + RECORD_START)
+        # Data in the temporary file follows the buffer
+        final = final and not self._spool
+
+        if index < 0:
+            if not final and not self._spool \
+            and len(self._buffer) <= len(RECORD_START):
+                return False
+
+            keep = 0 if final else len(RECORD_START)
+            length = len(self._buffer) - keep
+        else:
+            length = index + 1
+
+        if self._buffer[:length].strip() and not self._after_bad_record:
+            self.problems.append(SalvageProblem(self._offset,
+                'Skipped data that is not a record'))
+            self._after_bad_record = True
+
+        self._consume(length)
+
+        return index >= 0 or final or self._spool is not None
+
+
+def iter_plain_chunks(filename, read_size=1048576):
+    '''Yield the data of a file in chunks'''
+
+    with open(filename, 'rb') as file_obj:
+        while True:
+            data = file_obj.read(read_size)
+
+            if not data:
+                break
+
+            yield data
+
+
+def iter_gzip_chunks(filename, read_size=1048576):
+    '''Yield uncompressed data of the intact parts of a gzip file.
+
+    Data decompressed from a damaged member before the damage is included.
+    A :class:`SalvageProblem` is yielded where data is lost.
+    '''
+
+    with open(filename, 'rb') as file_obj:
+        size = os.fstat(file_obj.fileno()).st_size
+        window = Window(file_obj, read_size)
+        position = 0
+
+        while position is not None and position < size:
+            if window.get(position, len(MEMBER_HEADER)) != MEMBER_HEADER:
+                yield SalvageProblem(position, 'Not a gzip member')
+                position = window.find(MEMBER_HEADER, position + 1)
+                continue
+
+            member_offset = position
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            try:
+                while not decompressor.eof:
+                    data = window.get(position, read_size)
+
+                    if not data:
+                        yield SalvageProblem(member_offset,
+                            'Truncated gzip member')
+                        return
+
+                    yield decompressor.decompress(data, read_size)
+
+                    while decompressor.unconsumed_tail:
+                        yield decompressor.decompress(
+                            decompressor.unconsumed_tail, read_size)
+
+                    position += len(data) - len(decompressor.unused_data)
+            except zlib.error as error:
+                yield SalvageProblem(member_offset,
+                    'Bad gzip member: {}'.format(error))
+                position = window.find(MEMBER_HEADER, member_offset + 1)
+            else:
+                position = skip_padding(window, position)
+
+
+def iter_salvage(filename, force_gzip=False, check_digest=True):
+    '''Return an iterator of recovered records and problems.
+
+    Items are tuples of the offset and an iterator of the `bytes` of a
+    record, or :class:`SalvageProblem`.
+
+    .. seealso:: :class:`RecordScanner`
+    '''
+
+    if filename.endswith('.gz') or force_gzip:
+        chunks = iter_gzip_chunks(filename)
+    else:
+        chunks = iter_plain_chunks(filename)
+
+    scanner = RecordScanner(check_digest=check_digest)
+
+    for chunk in chunks:
+        if isinstance(chunk, SalvageProblem):
+            yield chunk
+            scanner.mark_gap()
+            continue
+
+        scanner.feed(chunk)
+
+        for item in scanner.iter_records():
+            yield item
+
+        for problem in scanner.problems:
+            yield problem
+
+        del scanner.problems[:]
+
+    for item in scanner.iter_records(final=True):
+        yield item
+
+    for problem in scanner.problems:
+        yield problem
+
+
+def salvage(filename, out_file, write_gzip=False, force_gzip=False):
+    '''Write the records that can be recovered from a file.
+
+    Records are copied byte for byte.
+
+    :param write_gzip: If `True`, compress each record as a gzip member.
+    :returns: A tuple of the number of records and a list of
+        :class:`SalvageProblem`.
+    '''
+
+    num_records = 0
+    problems = []
+
+    for item in iter_salvage(filename, force_gzip=force_gzip):
+        if isinstance(item, SalvageProblem):
+            _logger.warning('%s: %s', filename, item)
+            problems.append(item)
+            continue
+
+        offset, chunks = item
+
+        _logger.debug('Recovered record at %d', offset)
+
+        with stats.recorder.time('write'):
+            if write_gzip:
+                compressor = zlib.compressobj(9, zlib.DEFLATED,
+                    16 + zlib.MAX_WBITS)
+
+            for data in chunks:
+                out_file.write(compressor.compress(data) if write_gzip
+                    else data)
+
+            if write_gzip:
+                out_file.write(compressor.flush())
+
+        num_records += 1
+        stats.recorder.add('records')
+
+    return (num_records, problems)
@@ -0,0 +1,122 @@
+from warcat import model, salvage
+from warcat.tool import VerifyTool
+import gzip
+import io
+import os.path
+import tempfile
+import unittest
+
+
+class TestSalvage(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def salvage_data(self, data, suffix):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'a.warc' + suffix)
+
+            with open(filename, 'wb') as f:
+                f.write(data)
+
+            out_file = io.BytesIO()
+            num_records, problems = salvage.salvage(filename, out_file)
+
+            return num_records, problems, out_file.getvalue()
+
+    def test_intact(self):
+        with open(os.path.join(self.test_dir, 'at.warc'), 'rb') as f:
+            data = f.read()
+
+        num_records, problems, out_data = self.salvage_data(data, '')
+
+        self.assertEqual(8, num_records)
+        self.assertFalse(problems)
+        self.assertEqual(data, out_data)
+
+    def test_damaged(self):
+        with open(os.path.join(self.test_dir, 'at.warc'), 'rb') as f:
+            data = f.read()
+
+        # Add data to the block of the record at 2740
+        damaged_data = data[:4000] + b'junk' + data[4000:]
+        num_records, problems, out_data = self.salvage_data(damaged_data, '')
+
+        self.assertEqual(7, num_records)
+        self.assertEqual([2740], [problem.offset for problem in problems])
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(out_data)
+            f.flush()
+            tool = VerifyTool([f.name], preserve_block=False)
+            tool.process()
+
+            self.assertEqual(7, tool.num_records)
+
+    def test_damaged_gzip(self):
+        with open(os.path.join(self.test_dir, 'at.warc.gz'), 'rb') as f:
+            gzip_data = bytearray(f.read())
+            data = gzip.decompress(gzip_data)
+
+        # Damage the member of the response record at 1948
+        gzip_data[2100] ^= 0xff
+        num_records, problems, out_data = self.salvage_data(
+            bytes(gzip_data), '.gz')
+
+        self.assertEqual(7, num_records)
+        self.assertEqual(1948, problems[0].offset)
+        self.assertEqual(data[:2719], out_data[:2719])
+
+    def test_large_content_length(self):
+        with open(os.path.join(self.test_dir, 'at.warc'), 'rb') as f:
+            data = f.read()
+
+        large_record_file = io.BytesIO()
+
+        with model.WARCWriter(large_record_file) as writer:
+            writer.write_record([('WARC-Type', 'resource'),
+                ('Content-Type', 'application/octet-stream')],
+                os.urandom(3 * salvage.MAX_HEADER_SIZE))
+
+        # A damaged header followed by more data than is kept in memory
+        chunks = [b'WARC/1.0\r\nContent-Length: 1000000000000\r\n\r\n'] \
+            + [data] * 40 + [large_record_file.getvalue()]
+        scanner = salvage.RecordScanner(
+            max_buffer_size=salvage.MAX_HEADER_SIZE)
+        records = []
+
+        for chunk in chunks + [None]:
+            if chunk:
+                scanner.feed(chunk)
+
+            for offset, record_chunks in scanner.iter_records(
+            final=chunk is None):
+                records.append((offset, b''.join(record_chunks)))
+
+            self.assertLessEqual(len(scanner._buffer),
+                salvage.MAX_HEADER_SIZE)
+
+        self.assertEqual([0], [problem.offset for problem in scanner.problems])
+        self.assertEqual(8 * 40 + 1, len(records))
+        self.assertEqual(len(chunks[0]) + 40 * len(data), records[-1][0])
+        self.assertEqual(b''.join(chunks[1:]),
+            b''.join(record_data for offset, record_data in records))
+
+    def test_gap_after_buffer(self):
+        record_file = io.BytesIO()
+
+        with model.WARCWriter(record_file) as writer:
+            writer.write_record([('WARC-Type', 'resource'),
+                ('Content-Type', 'text/plain')], b'Hello world!')
+
+        record_data = record_file.getvalue()
+        scanner = salvage.RecordScanner(
+            max_buffer_size=salvage.MAX_HEADER_SIZE)
+
+        # The record is after the data held in memory when data is lost
+        scanner.feed(b'x' * 2 * salvage.MAX_HEADER_SIZE + b'\n')
+        scanner.feed(record_data[:100])
+        scanner.mark_gap()
+        scanner.feed(record_data[100:])
+
+        self.assertFalse(list(scanner.iter_records(final=True)))
+        self.assertIn('Record spans lost data',
+            [problem.message for problem in scanner.problems])
@@ -0,0 +1,283 @@
+'''Local HTTP server for records'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+from warcat import util
+from warcat.index import timestamp_to_seconds, to_timestamp
+from warcat.model import Record, BlockWithPayload, HTTPHeader, \
+    FIELD_DELIM_BYTES
+import collections
+import contextlib
+import http.server
+import logging
+import os.path
+import socketserver
+import threading
+import urllib.parse
+import zlib
+
+
+_logger = logging.getLogger(__name__)
+
+
+class HandlePool(object):
+    '''A pool of open archive file objects.
+
+    Handles of gzip files are :class:`.GzipMemberReader` and remember the
+    members that were seen so later reads of the archive are fast.
+
+    :param max_files: The maximum number of archives with open handles.
+    :param max_idle: The maximum number of idle handles for each archive.
+    '''
+
+    def __init__(self, max_files=64, max_idle=4):
+        self._max_files = max_files
+        self._max_idle = max_idle
+        self._handles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def open(self, filename, gzip=False):
+        '''Return a context manager of a handle for exclusive use'''
+
+        with self._lock:
+            handles = self._handles.get(filename)
+            handle = handles.pop() if handles else None
+
+        if not handle:
+            _logger.debug('Opening handle for %s', filename)
+
+            if gzip:
+                handle = util.GzipMemberReader(filename)
+            else:
+                handle = open(filename, 'rb')
+
+        try:
+            yield handle
+        except Exception:
+            handle.close()
+            raise
+        else:
+            self._release(filename, handle)
+
+    def _release(self, filename, handle):
+        with self._lock:
+            handles = self._handles.pop(filename, [])
+            self._handles[filename] = handles
+
+            if len(handles) < self._max_idle:
+                handles.append(handle)
+            else:
+                handle.close()
+
+            while len(self._handles) > self._max_files:
+                for old_handle in self._handles.popitem(last=False)[1]:
+                    old_handle.close()
+
+    def close(self):
+        with self._lock:
+            for handles in self._handles.values():
+                for handle in handles:
+                    handle.close()
+
+            self._handles.clear()
+
+
+class RecordServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    '''A HTTP server that returns records and payloads.
+
+    Records are requested with ``/record`` and payloads with ``/payload``
+    using one of these query strings:
+
+    * ``id=RECORD_ID``
+    * ``url=URL`` and optionally ``timestamp=TIMESTAMP``. The capture
+      closest to the timestamp or the latest capture is returned.
+    * ``filename=FILENAME`` and ``offset=OFFSET`` and optionally
+      ``member_offset=OFFSET`` for gzip files. The filename must be one of
+      the given filenames.
+
+    If no record can be read at the offset, the response is 400 for
+    offsets in the query string and 500 for offsets from the indexes.
+
+    :param address: A tuple of the host and port.
+    :param indexes: A list of :class:`.Index` used for IDs and URLs.
+    :param filenames: A list of archive filenames allowed to be read by
+        offset.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, address, indexes=(), filenames=(), force_gzip=False):
+        http.server.HTTPServer.__init__(self, address, RecordRequestHandler)
+        self.indexes = list(indexes)
+        self.filenames = frozenset(filenames)
+        self.force_gzip = force_gzip
+        self.pool = HandlePool()
+
+    def find_location(self, params):
+        '''Return the filename, offset, and member offset of a record'''
+
+        if 'id' in params:
+            for index in self.indexes:
+                entries = index.find_record(params['id'])
+
+                if entries:
+                    return self._entry_location(index, entries[0])
+        elif 'url' in params:
+            timestamp = params.get('timestamp', '99991231235959')
+            candidates = []
+
+            for index in self.indexes:
+                candidates.extend((index, entry) for entry in
+                    index.closest(params['url'], timestamp))
+
+            if candidates:
+                seconds = timestamp_to_seconds(to_timestamp(timestamp))
+                index, entry = min(candidates, key=lambda item: abs(
+                    timestamp_to_seconds(item[1].timestamp) - seconds))
+
+                return self._entry_location(index, entry)
+        elif 'filename' in params and 'offset' in params:
+            filename = os.path.normpath(params['filename'])
+
+            if filename not in self.filenames:
+                return
+
+            member_offset = params.get('member_offset')
+
+            return (filename, int(params['offset']),
+                int(member_offset) if member_offset else None)
+
+    def _entry_location(self, index, entry):
+        return (index.get_path(entry), entry.offset, entry.member_offset)
+
+    def is_gzip(self, filename, member_offset):
+        return filename.endswith('.gz') or self.force_gzip \
+            or member_offset is not None
+
+    def server_close(self):
+        http.server.HTTPServer.server_close(self)
+        self.pool.close()
+
+
+class RecordRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Handles requests to :class:`RecordServer`'''
+
+    def do_GET(self):
+        url_info = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url_info.query))
+
+        if url_info.path not in ('/record', '/payload'):
+            self.send_error(404)
+            return
+
+        try:
+            location = self.server.find_location(params)
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+
+        if not location:
+            self.send_error(404, 'Record not found')
+            return
+
+        filename, offset, member_offset = location
+        from_client = 'id' not in params and 'url' not in params
+        record = None
+
+        try:
+            with self.open_handle(filename, offset, member_offset,
+            from_client) as handle:
+                handle.seek(offset)
+                record = Record.load(handle,
+                    preserve_block=url_info.path == '/record',
+                    check_block_length=False)
+
+                if url_info.path == '/record':
+                    self.send_record(handle, record)
+                else:
+                    self.send_payload(handle, record)
+        except (IOError, EOFError, ValueError, zlib.error) as error:
+            if record is not None:
+                raise
+
+            _logger.warning('Cannot read record in %s at %d: %s', filename,
+                offset, error)
+            self.send_error(400 if from_client else 500,
+                'Cannot read record: {}'.format(error))
+
+    @contextlib.contextmanager
+    def open_handle(self, filename, offset, member_offset, from_client):
+        '''Return a context manager of a handle of the archive'''
+
+        gzip = self.server.is_gzip(filename, member_offset)
+
+        if gzip and member_offset is not None and from_client:
+            # A member offset from the client may be wrong, so it is not
+            # added to a pooled handle
+            with contextlib.closing(util.GzipMemberReader(filename,
+            member_offset=member_offset, position=offset)) as handle:
+                yield handle
+        else:
+            with self.server.pool.open(filename, gzip=gzip) as handle:
+                if gzip and member_offset is not None:
+                    handle.add_member(offset, member_offset)
+
+                yield handle
+
+    def send_record(self, handle, record):
+        block = record.content_block
+        length = block.file_offset + block.length \
+            + len(FIELD_DELIM_BYTES) - record.file_offset
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/warc')
+        self.send_header('Content-Length', length)
+        self.send_header('WARC-Record-ID', record.record_id)
+        self.end_headers()
+        handle.seek(record.file_offset)
+        util.copyfile_obj(handle, self.wfile, bufsize=65536,
+            max_length=length)
+
+    def send_payload(self, handle, record):
+        block = record.content_block
+        content_type = record.header.fields.get('Content-Type',
+            'application/octet-stream')
+
+        if isinstance(block, BlockWithPayload):
+            if isinstance(block.fields, HTTPHeader):
+                content_type = block.fields.get('Content-Type',
+                    'application/octet-stream')
+
+            block = block.payload
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', block.length)
+        self.send_header('WARC-Record-ID', record.record_id)
+        self.end_headers()
+        self.send_range(handle, block)
+
+    def send_range(self, handle, binary_file_ref):
+        handle.seek(binary_file_ref.file_offset)
+        util.copyfile_obj(handle, self.wfile, bufsize=65536,
+            max_length=binary_file_ref.length)
+
+    def log_message(self, format, *args):
+        _logger.info('%s %s', self.address_string(), format % args)
+
+
+def serve(address, indexes=(), filenames=(), force_gzip=False):
+    '''Run a :class:`RecordServer` until interrupted'''
+
+    server = RecordServer(address, indexes=indexes,
+        filenames=[os.path.normpath(filename) for filename in filenames],
+        force_gzip=force_gzip)
+
+    _logger.info('Serving on %s:%s', *server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,106 @@
+from warcat import model
+from warcat.index import Index, INDEX_EXTENSION
+from warcat.serve import RecordServer
+from warcat.tool import IndexTool
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class TestServe(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, 'at.warc.gz')
+        shutil.copy(os.path.join(self.test_dir, 'at.warc.gz'), self.filename)
+        IndexTool([self.filename]).process()
+
+        self.server = RecordServer(('localhost', 0),
+            indexes=[Index(self.filename + INDEX_EXTENSION)],
+            filenames=[self.filename])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def fetch(self, path, **params):
+        url = 'http://localhost:{}{}?{}'.format(self.server.server_address[1],
+            path, urllib.parse.urlencode(params))
+
+        with urllib.request.urlopen(url) as response:
+            return response.info(), response.read()
+
+    def test_record(self):
+        record_id = '<urn:uuid:972777d2-4177-4c63-9fde-3877dacc174e>'
+        info, data = self.fetch('/record', id=record_id)
+
+        self.assertEqual('application/warc', info['Content-Type'])
+        self.assertTrue(data.startswith(b'WARC/1.0\r\nWARC-Type: warcinfo'))
+        self.assertTrue(data.endswith(b'\r\n\r\n'))
+
+        info, data_by_offset = self.fetch('/record', filename=self.filename,
+            offset=0, member_offset=0)
+
+        self.assertEqual(data, data_by_offset)
+
+    def test_payload(self):
+        url = 'http://www.archiveteam.org/index.php?title=Main_Page'
+
+        for dummy in range(2):
+            info, data = self.fetch('/payload', url=url,
+                timestamp='20130409')
+
+            self.assertEqual('text/html; charset=UTF-8', info['Content-Type'])
+            self.assertIn(b'<!DOCTYPE html>', data[:30])
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.fetch('/record', id='<urn:uuid:123>')
+
+        self.assertEqual(404, context.exception.code)
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.fetch('/record', filename='/etc/passwd', offset=0)
+
+        self.assertEqual(404, context.exception.code)
+
+    def test_bad_offset(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.fetch('/record', filename=self.filename, offset=5)
+
+        self.assertEqual(400, context.exception.code)
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.fetch('/payload', filename=self.filename, offset=0,
+                member_offset=5)
+
+        self.assertEqual(400, context.exception.code)
+
+        info, data = self.fetch('/record', filename=self.filename, offset=0)
+
+        self.assertTrue(data.startswith(b'WARC/1.0\r\nWARC-Type: warcinfo'))
+
+    def test_wrong_member_offset(self):
+        warc = model.WARC()
+        warc.load(self.filename)
+        index = Index(self.filename + INDEX_EXTENSION)
+        entries = [index.find_record(record.record_id)[0]
+            for record in warc.records[1:3]]
+
+        # The member of another record
+        self.fetch('/record', filename=self.filename,
+            offset=entries[0].offset, member_offset=entries[1].member_offset)
+
+        info, data = self.fetch('/record', id=warc.records[1].record_id)
+
+        self.assertEqual(warc.records[1].record_id, info['WARC-Record-ID'])
@@ -0,0 +1,162 @@
+'''Throughput and timing statistics'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+import collections
+import json
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+_logger = logging.getLogger(__name__)
+
+STAGES = ('decompress', 'header_parse', 'block_parse', 'digest', 'write')
+'''The stages timed by the code that reads and writes records.
+
+Decompression happens while records are read, so its time is also part of
+the parse stages.
+'''
+
+
+class Timer(object):
+    '''Adds the time spent inside the ``with`` block to a stage'''
+
+    __slots__ = ('_stats', '_stage', '_start')
+
+    def __init__(self, stats, stage):
+        self._stats = stats
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.timers[self._stage] += time.perf_counter() - self._start
+
+
+class NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class NullStats(object):
+    '''A recorder that does nothing'''
+
+    enabled = False
+
+    def time(self, stage):
+        return NULL_TIMER
+
+    def add(self, name, value=1):
+        pass
+
+
+class Stats(object):
+    '''Records counters and the time spent in stages.
+
+    .. attribute:: counters
+
+        A `collections.Counter` of names such as ``records`` and
+        ``input_bytes``.
+
+    .. attribute:: timers
+
+        A `dict` of stage names to seconds.
+    '''
+
+    enabled = True
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.defaultdict(float)
+        self.start_time = time.perf_counter()
+
+    def time(self, stage):
+        '''Return a context manager that times a stage'''
+
+        return Timer(self, stage)
+
+    def add(self, name, value=1):
+        self.counters[name] += value
+
+    def report(self):
+        '''Return a `dict` of the statistics'''
+
+        elapsed = time.perf_counter() - self.start_time
+        result = collections.OrderedDict()
+        result['elapsed'] = elapsed
+
+        for name in ('records', 'input_bytes', 'uncompressed_bytes'):
+            result[name] = self.counters[name]
+            result[name + '_per_second'] = self.counters[name] / elapsed \
+                if elapsed else 0
+
+        result['stages'] = collections.OrderedDict(
+            (stage, self.timers.get(stage, 0.0)) for stage in STAGES)
+        result['counters'] = dict(self.counters)
+        result['peak_memory'] = peak_memory()
+
+        return result
+
+    def write_report(self, file=sys.stderr):
+        '''Print the statistics for people'''
+
+        for name, value in self.report().items():
+            if isinstance(value, dict):
+                for sub_name, sub_value in sorted(value.items()):
+                    print('{}.{}: {}'.format(name, sub_name,
+                        format_value(sub_value)), file=file)
+            else:
+                print('{}: {}'.format(name, format_value(value)), file=file)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '{:.3f}'.format(value)
+
+    return str(value)
+
+
+def peak_memory():
+    '''Return the peak resident memory of the process in bytes or `None`'''
+
+    if not resource:
+        return
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == 'darwin':
+        return max_rss
+
+    return max_rss * 1024
+
+
+recorder = NullStats()
+'''The current recorder. Use it as ``stats.recorder`` so :func:`enable`
+takes effect.'''
+
+
+def enable():
+    '''Start recording and return the :class:`Stats`'''
+
+    global recorder
+    recorder = Stats()
+
+    return recorder
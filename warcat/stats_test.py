@@ -0,0 +1,42 @@
+from warcat import stats
+from warcat.tool import VerifyTool
+import json
+import os.path
+import tempfile
+import unittest
+
+
+class TestStats(unittest.TestCase):
+    test_dir = os.path.join('example')
+
+    def tearDown(self):
+        stats.recorder = stats.NullStats()
+
+    def test_stats(self):
+        recorder = stats.enable()
+        tool = VerifyTool([os.path.join(self.test_dir, 'at.warc.gz')],
+            preserve_block=False)
+        tool.process()
+
+        report = recorder.report()
+
+        self.assertEqual(8, report['records'])
+        self.assertEqual(os.path.getsize(
+            os.path.join(self.test_dir, 'at.warc.gz')), report['input_bytes'])
+        self.assertGreater(report['uncompressed_bytes'],
+            report['input_bytes'])
+        self.assertGreater(report['stages']['decompress'], 0)
+        self.assertGreater(report['stages']['digest'], 0)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'stats.json')
+            recorder.write_json(filename)
+
+            with open(filename) as f:
+                self.assertEqual(8, json.load(f)['records'])
+
+    def test_null_stats(self):
+        with stats.recorder.time('write'):
+            stats.recorder.add('records')
+
+        self.assertFalse(stats.recorder.enabled)
@@ -1,12 +1,15 @@
 '''Archive process tools'''
 # Copyright 2013 Christopher Foo <chris.foo@gmail.com>
 # Licensed under GPLv3. See COPYING.txt for details.
-from warcat import model, util, verify
+from warcat import model, util, verify, index, recordfilter, stats, \
+    objectstore, extractarchive, digeststore
 import abc
+import concurrent.futures
 import gzip
 import http.client
 import isodate
 import itertools
+import json
 import logging
 import os.path
 import shutil
@@ -30,29 +33,22 @@ THROBBER = [
 # lol; so bouncy.
 
 
-class VerifyProblem(ValueError):
-    def __init__(self, message, iso_section=None, major=True):
-        ValueError.__init__(self, message, iso_section, major)
-
-    @property
-    def message(self):
-        return self.args[0]
-
-    @property
-    def iso_section(self):
-        return self.args[1]
-
-    @property
-    def major(self):
-        return self.args[2]
-
-
 class BaseIterateTool(metaclass=abc.ABCMeta):
-    '''Base class for iterating through records'''
+    '''Base class for iterating through records
+
+    :param checkpoint_filename: If given, the position and state are written
+        to this file periodically.
+    :param resume: If `True`, continue from the checkpoint file.
+    :param checkpoint_interval: The number of seconds between checkpoints.
+    :param slow_record_threshold: If given, records that take at least this
+        number of seconds to read and process are logged.
+    '''
 
     def __init__(self, filenames, out_file=None, write_gzip=False,
     force_read_gzip=None, read_record_ids=None, preserve_block=True,
-    out_dir=None, print_progress=False, keep_going=False, read_target_uris=None):
+    out_dir=None, print_progress=False, keep_going=False, read_target_uris=None,
+    record_filter=None, checkpoint_filename=None, resume=False,
+    checkpoint_interval=300, slow_record_threshold=None):
         if not out_file:
             try:
                 out_file = sys.stdout.buffer
@@ -70,7 +66,13 @@ class BaseIterateTool(metaclass=abc.ABCMeta):
         self.print_progress = print_progress
         self.keep_going = keep_going
         self.read_target_uris = read_target_uris
+        self.record_filter = record_filter or recordfilter.RecordFilter(
+            record_ids=read_record_ids, target_uris=read_target_uris)
         self.check_block_length = False
+        self.checkpoint_filename = checkpoint_filename
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.slow_record_threshold = slow_record_threshold
 
     def preprocess(self):
         pass
@@ -78,38 +80,83 @@ class BaseIterateTool(metaclass=abc.ABCMeta):
     def postprocess(self):
         pass
 
+    def preprocess_file(self):
+        pass
+
+    def postprocess_file(self):
+        pass
+
+    def skip_file(self):
+        '''Return whether the current file was handled without reading it'''
+
+        return False
+
+    def get_state(self, data_file):
+        '''Return a JSON serializable state of the tool for a checkpoint.
+
+        Large data can be written to the binary file object `data_file`.
+        '''
+
+        return {}
+
+    def set_state(self, state, data_file):
+        '''Restore the state returned by :meth:`get_state`'''
+
+        pass
+
     def process(self):
         self.num_records = 0
         throbber_iter = itertools.cycle(THROBBER)
         progress_msg = ''
         self.preprocess()
 
-        for filename in self.filenames:
+        checkpoint = self.load_checkpoint() if self.resume else None
+        self.checkpoint_sequence = checkpoint['sequence'] if checkpoint else 0
+        next_checkpoint_time = time.monotonic() + self.checkpoint_interval
+
+        for file_index, filename in enumerate(self.filenames):
             self.record_order = 0
             self.current_filename = filename
 
-            f = model.WARC.open(filename, force_gzip=self.force_read_gzip)
+            if checkpoint and file_index < checkpoint['file_index']:
+                continue
+            elif checkpoint:
+                _logger.info('Resuming %s at offset %d', filename,
+                    checkpoint['offset'])
+                f = model.WARC.open(filename,
+                    force_gzip=self.force_read_gzip,
+                    offset=checkpoint['offset'],
+                    member=checkpoint['member'])
+                self.current_file = f
+                self.preprocess_file()
+                self.record_order = checkpoint['record_order']
+                start_offset = checkpoint['offset']
+                self.num_records = checkpoint['num_records']
+                self.restore_state(checkpoint)
+                checkpoint = None
+            elif self.skip_file():
+                continue
+            else:
+                f = model.WARC.open(filename, force_gzip=self.force_read_gzip)
+                self.current_file = f
+                self.preprocess_file()
+                start_offset = 0
 
             while True:
+                if self.slow_record_threshold is not None \
+                and stats.recorder.enabled:
+                    stage_times = dict(stats.recorder.timers)
+                else:
+                    stage_times = None
+
+                start_time = time.perf_counter()
                 record, has_more = model.WARC.read_record(f,
                     preserve_block=self.preserve_block,
                     check_block_length=self.check_block_length)
+                read_time = time.perf_counter() - start_time
+                action_time = 0.0
 
-                skip = False
-
-                if self.read_record_ids:
-                    if record.record_id not in self.read_record_ids:
-                        skip = True
-                        _logger.debug('Skipping %s due to record id filter', record.record_id)
-
-
-                if self.read_target_uris:
-                    if record.target_uri not in self.read_target_uris:
-                        skip = True
-                        _logger.debug('Skipping %s due to target URI filter', record.target_uri)
-
-
-                if not skip:
+                if self.record_filter.match(record):
                     try:
                         self.action(record)
                     except Exception as e:
@@ -119,6 +166,14 @@ class BaseIterateTool(metaclass=abc.ABCMeta):
                         else:
                             raise
 
+                    action_time = time.perf_counter() - start_time \
+                        - read_time
+
+                if self.slow_record_threshold is not None \
+                and read_time + action_time >= self.slow_record_threshold:
+                    self.log_slow_record(record, read_time, action_time,
+                        stage_times)
+
                 if self.print_progress and self.num_records % 100 == 0:
                     s = next(throbber_iter)
                     sys.stderr.write('\b' * len(progress_msg))
@@ -128,18 +183,140 @@ class BaseIterateTool(metaclass=abc.ABCMeta):
 
                 self.record_order += 1
                 self.num_records += 1
+                stats.recorder.add('records')
 
                 if not has_more:
                     break
 
+                if self.checkpoint_filename \
+                and time.monotonic() >= next_checkpoint_time:
+                    self.save_checkpoint(file_index, f)
+                    next_checkpoint_time = time.monotonic() \
+                        + self.checkpoint_interval
+
+            self.postprocess_file()
+            stats.recorder.add('uncompressed_bytes', f.tell() - start_offset)
+            stats.recorder.add('input_bytes', os.path.getsize(filename))
             f.close()
 
         self.postprocess()
+        self.remove_checkpoint()
 
         if self.print_progress:
             sys.stderr.write('\nDone. {} records processed.\n'.format(
                 self.num_records))
 
+    def log_slow_record(self, record, read_time, action_time,
+    stage_times=None):
+        '''Log a record that took longer than the slow record threshold.
+
+        The stage is whichever of reading and the action took longer, or if
+        statistics are enabled, the statistics stage that grew the most
+        since `stage_times`.
+        '''
+
+        if stage_times is not None:
+            stage_deltas = dict((stage, elapsed - stage_times.get(stage, 0.0))
+                for stage, elapsed in stats.recorder.timers.items())
+        else:
+            stage_deltas = None
+
+        if stage_deltas and max(stage_deltas.values()) > 0:
+            stage = max(stage_deltas, key=stage_deltas.get)
+        else:
+            stage = 'read' if read_time >= action_time else 'action'
+
+        _logger.warning('Slow record %s in %s at offset %d: %d bytes, '
+            '%.1f ms (read %.1f ms, action %.1f ms), stage %s',
+            record.record_id, self.current_filename, record.file_offset,
+            record.content_length, (read_time + action_time) * 1000,
+            read_time * 1000, action_time * 1000, stage)
+
+    def _checkpoint_data_filename(self, sequence):
+        return '{}.{}.data'.format(self.checkpoint_filename, sequence)
+
+    def save_checkpoint(self, file_index, file_obj):
+        '''Write the position of the next record and the tool state'''
+
+        offset = file_obj.tell()
+        sequence = self.checkpoint_sequence + 1
+        data_filename = self._checkpoint_data_filename(sequence)
+
+        with open(data_filename, 'wb') as data_file:
+            state = self.get_state(data_file)
+
+        checkpoint = {
+            'filenames': list(self.filenames),
+            'file_index': file_index,
+            'offset': offset,
+            'member': util.get_nearest_member(file_obj, offset),
+            'record_order': self.record_order,
+            'num_records': self.num_records,
+            'sequence': sequence,
+            'state': state,
+        }
+        temp_filename = self.checkpoint_filename + '.tmp'
+
+        with open(temp_filename, 'w') as f:
+            json.dump(checkpoint, f)
+
+        os.replace(temp_filename, self.checkpoint_filename)
+
+        if os.path.exists(self._checkpoint_data_filename(sequence - 1)):
+            os.remove(self._checkpoint_data_filename(sequence - 1))
+
+        self.checkpoint_sequence = sequence
+
+        _logger.info('Checkpoint at record %d of %s', self.record_order,
+            self.current_filename)
+
+    def load_checkpoint(self):
+        '''Return the checkpoint or `None` if there is none'''
+
+        if not os.path.exists(self.checkpoint_filename):
+            _logger.info('No checkpoint to resume from')
+            return
+
+        with open(self.checkpoint_filename, 'r') as f:
+            checkpoint = json.load(f)
+
+        if checkpoint['filenames'] != list(self.filenames):
+            raise ValueError('Checkpoint is for different files')
+
+        return checkpoint
+
+    def truncate_output(self, file_offset):
+        '''Remove what was written to the output file after a checkpoint.
+
+        :param file_offset: The size of the output at the checkpoint.
+        :raises ValueError: The output is not a file that has all the data
+            written before the checkpoint.
+        '''
+
+        if file_offset is None or not self.out_file.seekable():
+            raise ValueError('Resuming needs an output file')
+
+        if self.out_file.seek(0, os.SEEK_END) < file_offset:
+            raise ValueError('Output file is shorter than at the checkpoint')
+
+        _logger.info('Truncating output to %d bytes', file_offset)
+        self.out_file.seek(file_offset)
+        self.out_file.truncate()
+
+    def restore_state(self, checkpoint):
+        with open(self._checkpoint_data_filename(checkpoint['sequence']),
+        'rb') as data_file:
+            self.set_state(checkpoint['state'], data_file)
+
+    def remove_checkpoint(self):
+        if not self.checkpoint_filename:
+            return
+
+        for filename in (self.checkpoint_filename,
+        self._checkpoint_data_filename(self.checkpoint_sequence)):
+            if os.path.exists(filename):
+                os.remove(filename)
+
     @abc.abstractmethod
     def action(self, record):
         pass
@@ -150,6 +327,13 @@ class ListTool(BaseIterateTool):
         print('Record:', record.record_id)
         print('  Order:', self.num_records)
         print('  File offset:', record.file_offset)
+
+        member_offset = util.get_member_offset(self.current_file,
+            record.file_offset)
+
+        if member_offset is not None:
+            print('  Member offset:', member_offset)
+
         print('  Type:', record.warc_type)
         print('  Date:', isodate.datetime_isoformat(record.date))
         print('  Size:', record.content_length)
@@ -159,19 +343,35 @@ class ConcatTool(BaseIterateTool):
     def preprocess(self):
         self.bytes_written = 0
 
+    def get_state(self, data_file):
+        self.out_file.flush()
+
+        return {'bytes_written': self.bytes_written,
+            'file_offset': self.out_file.tell()
+                if self.out_file.seekable() else None}
+
+    def set_state(self, state, data_file):
+        self.bytes_written = state['bytes_written']
+        self.truncate_output(state['file_offset'])
+
     def action(self, record):
         if self.write_gzip:
             f = gzip.GzipFile(fileobj=self.out_file, mode='wb')
         else:
             f = self.out_file
 
-        for v in record.iter_bytes():
-            _logger.debug('Wrote %d bytes', len(v))
-            f.write(v)
-            self.bytes_written += len(v)
+        debug = _logger.isEnabledFor(logging.DEBUG)
 
-        if self.write_gzip:
-            f.close()
+        with stats.recorder.time('write'):
+            for v in record.iter_bytes():
+                if debug:
+                    _logger.debug('Wrote %d bytes', len(v))
+
+                f.write(v)
+                self.bytes_written += len(v)
+
+            if self.write_gzip:
+                f.close()
 
         if self.num_records % 1000 == 0:
             _logger.info('Wrote %d records (%d bytes) so far',
@@ -194,18 +394,434 @@ class SplitTool(BaseIterateTool):
         else:
             f = open(record_filename, 'wb')
 
-        for v in record.iter_bytes():
-            _logger.debug('Wrote %d bytes', len(v))
-            f.write(v)
+        debug = _logger.isEnabledFor(logging.DEBUG)
 
-        f.close()
+        with stats.recorder.time('write'):
+            for v in record.iter_bytes():
+                if debug:
+                    _logger.debug('Wrote %d bytes', len(v))
+
+                f.write(v)
+
+            f.close()
 
         if self.num_records % 1000 == 0:
             _logger.info('Wrote %d records so far', self.num_records)
 
 
-class ExtractTool(BaseIterateTool):
+class BaseRewriteTool(BaseIterateTool):
+    '''Base class for tools that write records to a new archive.
+
+    Records are written with a :class:`.model.WARCWriter` to the output
+    file. When resuming, the output file is truncated to its size at the
+    checkpoint. Blocks are not parsed. :meth:`rewrite` is given a file object
+    of the archive at the start of the block, and the position of the
+    archive is put back afterwards.
+    '''
+
+    def preprocess(self):
+        self.preserve_block = True
+        self.writer = self.new_writer()
+
+    def new_writer(self):
+        return model.WARCWriter(self.out_file, write_gzip=self.write_gzip)
+
+    def postprocess(self):
+        self.writer.close()
+
+    def get_state(self, data_file):
+        self.writer.flush()
+
+        return {'offset': self.writer.offset,
+            'file_offset': self.writer.file_offset}
+
+    def set_state(self, state, data_file):
+        self.writer.offset = state['offset']
+        self.writer.file_offset = state['file_offset']
+        self.truncate_output(state['file_offset'])
+
     def action(self, record):
+        original_position = self.current_file.tell()
+
+        try:
+            file_obj = record.content_block.get_file(safe=False)
+            self.rewrite(record, file_obj)
+        finally:
+            self.current_file.seek(original_position)
+
+    @abc.abstractmethod
+    def rewrite(self, record, file_obj):
+        pass
+
+    def copy_record(self, record, file_obj):
+        '''Write the record with its block unchanged'''
+
+        file_obj.seek(record.content_block.file_offset)
+
+        return self.writer.write_bytes(self.iter_record(record, file_obj),
+            record.record_id, record.warc_type)
+
+    def copy_raw_record(self, record, file_obj):
+        '''Write the bytes of the record as they are in the archive'''
+
+        block = record.content_block
+        length = block.file_offset + block.length \
+            + len(model.FIELD_DELIM_BYTES) - record.file_offset
+        file_obj.seek(record.file_offset)
+
+        return self.writer.write_bytes(
+            self.iter_data(util.LimitedReader(file_obj, length)),
+            record.record_id, record.warc_type)
+
+    def iter_record(self, record, file_obj):
+        yield bytes(record.header)
+
+        for data in self.iter_data(
+        util.LimitedReader(file_obj, record.content_block.length)):
+            yield data
+
+        yield model.FIELD_DELIM_BYTES
+
+    def iter_data(self, file_obj):
+        while True:
+            data = file_obj.read(util.BUFFER_SIZE)
+
+            if not data:
+                break
+
+            yield data
+
+    def read_http_header(self, record, file_obj):
+        '''Return the `bytes` of the HTTP header at the start of the block
+        or `None` if it is not found'''
+
+        file_obj.seek(record.content_block.file_offset)
+
+        return util.read_header_bytes(file_obj, record.content_block.length)
+
+    def is_http_record(self, record, warc_types=('request', 'response')):
+        return record.warc_type in warc_types \
+            and record.header.fields.get('Content-Type', '').startswith(
+                'application/http')
+
+
+class AddDigestsTool(BaseRewriteTool):
+    '''Rewrite archives with the block and payload digests they are missing
+
+    Each block is read once from the archive while all of its digests are
+    computed. Existing digest fields are kept as they are.
+
+    Payload digests are added to HTTP requests and responses. The payload
+    is the data after the HTTP header, as in :class:`.model.BlockWithPayload`.
+
+    :param digest_algorithms: A list of names in
+        :data:`.verify.ALGORITHM_MAP`.
+    '''
+
+    def __init__(self, filenames, digest_algorithms=('sha1',), **kwargs):
+        BaseRewriteTool.__init__(self, filenames, **kwargs)
+        self.digest_algorithms = list(digest_algorithms)
+
+    def new_writer(self):
+        return model.WARCWriter(self.out_file, write_gzip=self.write_gzip,
+            digest_algorithm=self.digest_algorithms)
+
+    def is_missing_digests(self, fields, http_payload):
+        algorithms = set(self.digest_algorithms)
+        names = ['WARC-Block-Digest']
+
+        if http_payload:
+            names.append('WARC-Payload-Digest')
+
+        return any(not algorithms
+            <= model.writer.get_digest_algorithms(fields, name)
+            for name in names)
+
+    def rewrite(self, record, file_obj):
+        http_payload = self.is_http_record(record)
+
+        if not self.is_missing_digests(record.header.fields, http_payload):
+            self.copy_record(record, file_obj)
+            return
+
+        http_header = None
+        length = record.content_block.length
+
+        if http_payload:
+            http_header = self.read_http_header(record, file_obj)
+
+            if http_header is None:
+                _logger.warning('No HTTP header in %s. Not adding a payload '
+                    'digest.', record.record_id)
+            else:
+                length -= len(http_header)
+
+        self.writer.write_record(record.header, file_obj,
+            http_header=http_header, length=length,
+            payload_digest=http_header is not None, keep_digests=True)
+
+
+class DedupTool(BaseRewriteTool):
+    '''Rewrite archives with duplicate HTTP responses as revisit records
+
+    A response is a duplicate if its ``WARC-Payload-Digest`` is in the
+    digest store. The first capture of a digest is written as it is and
+    added to the store. Later captures keep their HTTP header and become
+    revisit records of the identical payload digest profile that refer to
+    the first capture. Responses without a payload digest or with an empty
+    payload are written as they are.
+
+    :param digest_store: A :class:`.digeststore.DigestStore`.
+
+    .. attribute:: num_revisits
+
+        The number of records written as revisits.
+
+    .. attribute:: bytes_saved
+
+        The number of block bytes left out of revisits.
+    '''
+
+    PROFILES = {
+        '1.0': 'http://netpreserve.org/warc/1.0/revisit/'
+            'identical-payload-digest',
+        '1.1': 'http://netpreserve.org/warc/1.1/revisit/'
+            'identical-payload-digest',
+    }
+
+    def __init__(self, filenames, digest_store=None, **kwargs):
+        BaseRewriteTool.__init__(self, filenames, **kwargs)
+        self.digest_store = digest_store
+        self.empty_digests = frozenset(
+            model.writer.format_digest(name, hash_class().digest())
+            for name, hash_class in verify.ALGORITHM_MAP.items())
+
+    def preprocess(self):
+        BaseRewriteTool.preprocess(self)
+        self.num_revisits = 0
+        self.bytes_saved = 0
+
+    def postprocess(self):
+        BaseRewriteTool.postprocess(self)
+        self.digest_store.flush()
+
+    def get_state(self, data_file):
+        state = BaseRewriteTool.get_state(self, data_file)
+        self.digest_store.flush()
+        state['num_revisits'] = self.num_revisits
+        state['bytes_saved'] = self.bytes_saved
+
+        return state
+
+    def set_state(self, state, data_file):
+        BaseRewriteTool.set_state(self, state, data_file)
+        self.num_revisits = state['num_revisits']
+        self.bytes_saved = state['bytes_saved']
+
+    def rewrite(self, record, file_obj):
+        fields = record.header.fields
+
+        if not self.is_http_record(record, ('response',)) \
+        or 'WARC-Payload-Digest' not in fields:
+            self.copy_record(record, file_obj)
+            return
+
+        digest = digeststore.normalize_digest(fields['WARC-Payload-Digest'])
+
+        if not digest or digest in self.empty_digests:
+            self.copy_record(record, file_obj)
+            return
+
+        capture = self.digest_store.get(digest)
+
+        # A resumed run may find the records it added before stopping
+        if not capture or capture.record_id == record.record_id:
+            if not capture:
+                self.digest_store.add(digest, digeststore.Capture(
+                    record.record_id, record.target_uri,
+                    fields.get('WARC-Date', '')))
+
+            self.copy_record(record, file_obj)
+            return
+
+        http_header = self.read_http_header(record, file_obj)
+
+        if http_header is None:
+            self.copy_record(record, file_obj)
+            return
+
+        self.write_revisit(record, http_header, capture)
+
+    def write_revisit(self, record, http_header, capture):
+        '''Write the record as a revisit of the capture'''
+
+        fields = model.Fields(list(record.header.fields.list()))
+        fields['WARC-Type'] = 'revisit'
+        fields['WARC-Profile'] = self.PROFILES.get(record.header.version,
+            self.PROFILES['1.0'])
+        fields['WARC-Refers-To'] = capture.record_id
+        fields['WARC-Refers-To-Target-URI'] = capture.target_uri
+        fields['WARC-Refers-To-Date'] = capture.date
+
+        self.writer.write_record(model.Header(record.header.version, fields),
+            http_header=http_header, payload_digest=False)
+
+        self.num_revisits += 1
+        self.bytes_saved += record.content_block.length - len(http_header)
+        stats.recorder.add('revisits')
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Wrote %s as a revisit of %s', record.record_id,
+                capture.record_id)
+
+
+class FilterTool(BaseRewriteTool):
+    '''Copy the records that match an expression to a new archive
+
+    Records are read without parsing their blocks. The expression is
+    evaluated on the record header, and the HTTP header is read only for
+    terms that need it. Matching records are copied byte for byte.
+
+    :param expression: A :class:`.expression.Expression`.
+
+    .. attribute:: num_matched
+
+        The number of records copied.
+    '''
+
+    def __init__(self, filenames, expression=None, **kwargs):
+        BaseRewriteTool.__init__(self, filenames, **kwargs)
+        self.expression = expression
+
+    def preprocess(self):
+        BaseRewriteTool.preprocess(self)
+        self.num_matched = 0
+
+    def get_state(self, data_file):
+        state = BaseRewriteTool.get_state(self, data_file)
+        state['num_matched'] = self.num_matched
+
+        return state
+
+    def set_state(self, state, data_file):
+        BaseRewriteTool.set_state(self, state, data_file)
+        self.num_matched = state['num_matched']
+
+    def rewrite(self, record, file_obj):
+        if self.expression and not self.expression.match(record, file_obj):
+            return
+
+        self.copy_raw_record(record, file_obj)
+        self.num_matched += 1
+
+
+class ExtractTool(BaseIterateTool):
+    '''Extract the payloads of HTTP responses to files
+
+    :param jobs: The number of threads that write files. If more than 1,
+        records are read while files are written. Writes to the same path,
+        or to a path inside the directory of another path, are done in
+        record order.
+    :param decode_content: If `True`, remove content codings such as
+        ``gzip`` from payloads.
+    :param object_store: If given, a :class:`.objectstore.ObjectStore`.
+        Each unique payload is stored once and the extracted files are
+        links to it. Payloads are looked up by ``WARC-Payload-Digest``, so
+        known payloads are not read again.
+    :param symbolic_links: If `True`, link to the object store with
+        symbolic links instead of hard links. Hard links share one
+        modification time.
+    :param plan_paths: If `True`, the record headers are read first to
+        find the final path of every file with :class:`.util.PathPlanner`.
+        Files are then written in place without checking the output
+        directory, and files that would be written over are skipped.
+    :param archive: If given, a writer from
+        :func:`.extractarchive.new_writer` that files are added to instead
+        of the output directory. Paths are always planned so names do not
+        conflict. Files are written in record order by one thread.
+    '''
+
+    def __init__(self, filenames, jobs=1, decode_content=False,
+    object_store=None, symbolic_links=False, plan_paths=False, archive=None,
+    **kwargs):
+        BaseIterateTool.__init__(self, filenames, **kwargs)
+
+        if archive:
+            self.out_dir = ''
+            jobs = 1
+            plan_paths = True
+
+        self.archive = archive
+        self.jobs = jobs
+        self.decode_content = decode_content
+        self.object_store = object_store
+        self.symbolic_links = symbolic_links
+        self.plan_paths = plan_paths
+        self.plan = None
+        self.made_dirs = set()
+        self.max_pending = jobs * 4
+        self.spool_size = 1048576
+        self.executor = None
+        self.pending = []
+
+    def preprocess(self):
+        if self.plan_paths:
+            self.plan, renames = self.make_plan()
+
+            for path, new_path in renames:
+                _logger.debug('Rename %s -> %s', path, new_path)
+                os.rename(path, new_path)
+
+        if self.jobs > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.jobs)
+
+    def make_plan(self):
+        '''Read the record headers and return a `dict` of tuples of the
+        filename and record order to paths and a list of existing files to
+        rename, as in :meth:`.util.PathPlanner.destinations`'''
+
+        planner = util.PathPlanner(self.out_dir)
+
+        for filename in self.filenames:
+            with model.WARC.open(filename,
+            force_gzip=self.force_read_gzip) as file_obj:
+                record_order = 0
+                has_more = True
+
+                while has_more:
+                    record, has_more = model.WARC.read_record(file_obj,
+                        check_block_length=self.check_block_length)
+
+                    if self.record_filter.match(record):
+                        try:
+                            path = self.get_path(record)
+                        except ValueError:
+                            path = None
+
+                        if path:
+                            planner.add((filename, record_order), path)
+
+                    record_order += 1
+
+        _logger.info('Planned extraction paths')
+
+        return planner.destinations()
+
+    def postprocess(self):
+        if self.executor:
+            self.wait_pending()
+            self.executor.shutdown()
+            self.executor = None
+
+    def get_state(self, data_file):
+        # The checkpoint offset is after records that are still being written
+        self.wait_pending()
+
+        return {}
+
+    def get_path(self, record):
+        '''Return the path to extract the record to or `None`'''
+
         if record.warc_type != 'response':
             return
         if not isinstance(record.content_block, model.BlockWithPayload):
@@ -216,197 +832,440 @@ class ExtractTool(BaseIterateTool):
             return
 
         url = record.header.fields['WARC-Target-URI']
-        binary_block = record.content_block.binary_block
-        file_obj = binary_block.get_file()
-        data = file_obj.read(binary_block.length)
-        response = util.parse_http_response(data)
         path_list = util.split_url_to_filename(url)
         path_list = util.truncate_filename_parts(path_list)
-        path = os.path.join(self.out_dir, *path_list)
+
+        return os.path.join(self.out_dir, *path_list)
+
+    def action(self, record):
+        path = self.get_path(record)
+
+        if not path:
+            return
+
+        if self.plan is not None:
+            path = self.plan.get((self.current_filename, self.record_order))
+
+            if not path:
+                _logger.debug('Skipping %s since it is written over later',
+                    record.record_id)
+                return
+
+        payload_digest = record.header.fields.get('WARC-Payload-Digest')
+        binary_block = record.content_block.binary_block
+
+        if not self.executor:
+            # The block is streamed from the archive, so the position of the
+            # archive is put back afterwards
+            original_position = self.current_file.tell()
+
+            try:
+                file_obj = binary_block.get_file(safe=False)
+                self.write_file(record.record_id, path, file_obj,
+                    binary_block.length, payload_digest)
+            finally:
+                self.current_file.seek(original_position)
+
+            return
+
+        if self.plan is None:
+            self.wait_pending(lambda pending_path:
+                is_path_conflict(path, pending_path))
+
+        while len(self.pending) >= self.max_pending:
+            self.wait_pending(count=1)
+
+        # Workers get a copy since the archive is being read
+        file_obj = binary_block.get_file(spool_size=self.spool_size)
+        future = self.executor.submit(self.write_file_copy, record.record_id,
+            path, file_obj, binary_block.length, payload_digest)
+        self.pending.append((record.record_id, path, future))
+
+    def wait_pending(self, conflict=None, count=None):
+        '''Wait for file writes to finish.
+
+        :param conflict: If given, wait only for the writes of paths that
+            the function returns `True` for.
+        :param count: If given, wait for at most this number of the oldest
+            writes.
+        '''
+
+        pending = []
+
+        for item in self.pending:
+            record_id, path, future = item
+
+            if conflict and not conflict(path) and not future.done() \
+            or count is not None and count <= 0:
+                pending.append(item)
+                continue
+
+            if count is not None:
+                count -= 1
+
+            try:
+                future.result()
+            except Exception:
+                if self.keep_going:
+                    _logger.exception('Error on record %s', record_id)
+                else:
+                    self.pending = []
+                    raise
+
+        self.pending = pending
+
+    def write_file_copy(self, record_id, path, file_obj, length,
+    payload_digest=None):
+        with file_obj:
+            self.write_file(record_id, path, file_obj, length, payload_digest)
+
+    def write_file(self, record_id, path, file_obj, length,
+    payload_digest=None):
+        '''Write the payload of the HTTP response in the file object'''
+
+        response = util.parse_http_response(file_obj, length)
+        timestamp = get_last_modified(response)
+
+        if self.archive:
+            name = extractarchive.archive_name(path)
+
+            with stats.recorder.time('write'), \
+            self.archive.open(name, timestamp) as f:
+                self.copy_body(record_id, response, f)
+
+            _logger.info('Extracted %s to %s', record_id, name)
+            return
+
         dir_path = os.path.dirname(path)
 
-        if os.path.isdir(path):
-            path = util.append_index_filename(path)
+        if self.plan is not None:
+            if dir_path not in self.made_dirs:
+                os.makedirs(dir_path, exist_ok=True)
+                self.made_dirs.add(dir_path)
+        else:
+            if os.path.isdir(path):
+                path = util.append_index_filename(path)
+
+            util.rename_filename_dirs(path)
+            os.makedirs(dir_path, exist_ok=True)
+
+        _logger.debug('Extracting %s to %s', record_id, path)
+
+        with stats.recorder.time('write'):
+            if self.object_store:
+                self.write_object(record_id, path, response, payload_digest)
+            else:
+                with open(path, 'wb') as f:
+                    self.copy_body(record_id, response, f)
+
+        if timestamp is not None:
+            if not self.symbolic_links:
+                os.utime(path, (time.time(), timestamp))
+            elif os.utime in os.supports_follow_symlinks:
+                os.utime(path, (time.time(), timestamp),
+                    follow_symlinks=False)
+
+            _logger.debug('Apply mtime %d to %s', timestamp, path)
 
-        _logger.debug('Extracting %s to %s', record.record_id, path)
-        util.rename_filename_dirs(path)
-        os.makedirs(dir_path, exist_ok=True)
+        _logger.info('Extracted %s to %s', record_id, path)
+
+    def copy_body(self, record_id, response, file_obj):
+        body = response
+        content_encoding = response.getheader('Content-Encoding')
+
+        # Only coded bodies are wrapped, so the partial data of a malformed
+        # response is still written otherwise
+        if self.decode_content and util.parse_codings(content_encoding):
+            try:
+                body = util.open_decoded(response,
+                    content_encoding=content_encoding, strict=False)
+            except ValueError as error:
+                _logger.warning('Not decoding %s: %s', record_id, error)
 
         try:
-            with open(path, 'wb') as f:
-                shutil.copyfileobj(response, f)
+            shutil.copyfileobj(body, file_obj)
         except http.client.IncompleteRead as error:
             _logger.warning('Malformed HTTP response: %s', error)
 
-            with open(path, 'wb') as f:
-                f.write(error.partial)
+            if body is response:
+                file_obj.write(error.partial)
 
-        last_modified_str = response.getheader('Last-Modified')
+    def write_object(self, record_id, path, response, payload_digest):
+        '''Link the path to the object of the payload, adding it to the
+        object store if needed'''
 
-        if last_modified_str:
-            try:
-                last_modified = util.parse_http_date(last_modified_str)
-            except ValueError:
-                pass
-            else:
-                timestamp = time.mktime(last_modified.utctimetuple())
-                os.utime(path, (time.time(), timestamp))
-                _logger.debug('Apply mtime %d to %s', timestamp, path)
+        if payload_digest:
+            # The file depends on the codings that are removed too
+            key = '\t'.join([payload_digest,
+                response.getheader('Transfer-Encoding', '').lower(),
+                response.getheader('Content-Encoding', '').lower()
+                    if self.decode_content else ''])
+            object_path = self.object_store.get(key)
+        else:
+            key = object_path = None
 
-        _logger.info('Extracted %s to %s', record.record_id, path)
+        if object_path:
+            _logger.debug('Payload of %s is already stored', record_id)
+        else:
+            with self.object_store.new_object(key) as object_file:
+                self.copy_body(record_id, response, object_file)
 
+            object_path = object_file.path
+
+        objectstore.link_file(object_path, path, symbolic=self.symbolic_links)
 
-class VerifyTool(BaseIterateTool):
-    MANDATORY_FIELDS = ['WARC-Record-ID', 'Content-Length', 'WARC-Date',
-        'WARC-Type']
+
+def get_last_modified(response):
+    '''Return the timestamp of the Last-Modified header or `None`'''
+
+    last_modified_str = response.getheader('Last-Modified')
+
+    if last_modified_str:
+        try:
+            last_modified = util.parse_http_date(last_modified_str)
+        except ValueError:
+            pass
+        else:
+            return time.mktime(last_modified.utctimetuple())
+
+
+def is_path_conflict(path, other_path):
+    '''Return whether the paths are the same or one is inside the other'''
+
+    return path == other_path \
+        or path.startswith(other_path + os.sep) \
+        or other_path.startswith(path + os.sep)
+
+
+class IndexTool(BaseIterateTool):
+    '''Write a sorted index next to each archive for random access'''
 
     def preprocess(self):
-        self.record_ids = set()
-        self.problems = 0
-        self.check_block_length = True
+        self.preserve_block = True
+
+    def preprocess_file(self):
+        self.index_lines = []
+        self.entry_filename = os.path.basename(self.current_filename)
 
     def action(self, record):
-        verify_actions = [
-            self.verify_mandatory_fields,
-#            self.check_transfer_encoding,
-            self.verify_block_digest,
-            self.verify_payload_digest,
-            self.verify_id_uniqueness,
-            self.verify_id_no_whitespace,
-            self.verify_content_type,
-            self.verify_concurrent_to,
-            self.verify_refers_to,
-            self.verify_target_uri,
-            self.verify_filename,
-            self.verify_profile,
-            self.verify_segment_origin_id,
-            self.verify_segment_total_length,
-        ]
-
-        for action in verify_actions:
-            try:
-                action(record)
-            except VerifyProblem:
-                self.problems += 1
-                _logger.exception('Record %s failed validation',
-                    record.record_id)
+        member_offset = util.get_member_offset(self.current_file,
+            record.file_offset)
 
-    def verify_block_digest(self, record):
-        if 'WARC-Block-Digest' in record.header.fields:
-            if not verify.verify_block_digest(record):
-                raise VerifyProblem('Bad block digest.', '5.8')
+        for entry in index.record_entries(record, self.entry_filename,
+        member_offset):
+            self.index_lines.append(entry.to_line())
 
-            _logger.debug('Block digest ok')
+    def postprocess_file(self):
+        index.write_index(self.index_lines,
+            self.current_filename + index.INDEX_EXTENSION)
 
-    def verify_payload_digest(self, record):
-        if 'WARC-Payload-Digest' in record.header.fields:
-            if not verify.verify_payload_digest(record):
-                raise VerifyProblem('Bad payload digest.', '5.9')
+    def get_state(self, data_file):
+        data_file.writelines(self.index_lines)
 
-            _logger.debug('Payload digest ok')
+        return {}
 
-    def verify_id_uniqueness(self, record):
-        if record.record_id in self.record_ids:
-            raise VerifyProblem('Duplicate record ID.')
+    def set_state(self, state, data_file):
+        self.index_lines = data_file.readlines()
 
-        self.record_ids.add(record.record_id)
 
-    def verify_id_no_whitespace(self, record):
-        if ' ' in record.record_id:
-            raise VerifyProblem('Whitespace in ID', '5.2')
+class CollectionIndexTool(IndexTool):
+    '''Add archives to a :class:`.CollectionIndex`.
 
-    def check_transfer_encoding(self, record):
-        if not isinstance(record.content_block, model.BlockWithPayload):
-            return
+    Archives unchanged since they were added are skipped. Up to date
+    indexes next to the archives are used instead of reading the archives.
+    '''
 
-        if 'Transfer-encoding' in record.content_block.fields:
-            raise VerifyProblem('Transfer-encoding found', '5.3.2', False)
+    def __init__(self, filenames, collection=None, **kwargs):
+        IndexTool.__init__(self, filenames, **kwargs)
+        self.collection = collection
 
-    def verify_mandatory_fields(self, record):
-        for name in self.MANDATORY_FIELDS:
-            if name not in record.header.fields:
-                raise VerifyProblem(
-                    'Mandatory {} field is missing'.format(name))
+    def preprocess(self):
+        IndexTool.preprocess(self)
+        self.run_filenames = []
+        self.indexed_filenames = []
+        filenames = []
 
-    def verify_content_type(self, record):
-        if record.warc_type != 'continuation':
-            return
+        for filename in self.filenames:
+            index_filename = filename + index.INDEX_EXTENSION
+
+            if self.collection.is_current(filename):
+                _logger.info('Skipping unchanged %s', filename)
+            elif os.path.exists(index_filename) and \
+            os.path.getmtime(index_filename) >= os.path.getmtime(filename):
+                _logger.info('Using index %s', index_filename)
+                self.add_run(filename, self.read_index_lines(filename))
+            else:
+                filenames.append(filename)
 
-        if record.content_length \
-        and 'Content-Type' not in record.header.fields:
-            raise VerifyProblem('Content-Type should be specified', '5.6',
-                False)
+        self.filenames = filenames
 
-    def verify_concurrent_to(self, record):
-        if 'WARC-Concurrent-To' not in record.header.fields:
-            return
+    def read_index_lines(self, filename):
+        entry_filename = self.collection.relative_path(filename)
 
-        record_id = record.header.fields['WARC-Concurrent-To']
+        with open(filename + index.INDEX_EXTENSION, 'rb') as f:
+            return [index.IndexEntry.parse(line)._replace(
+                filename=entry_filename).to_line() for line in f]
 
-        if record.warc_type in ('warcinfo', 'conversion', 'continuation'):
-            raise VerifyProblem('Unexpected WARC-Concurrent-To', '5.7')
+    def add_run(self, filename, lines):
+        self.run_filenames.append(self.collection.write_run(lines))
+        self.indexed_filenames.append(filename)
 
-        if record_id not in self.record_ids:
-            raise VerifyProblem('Concurrent Record ID {} not seen yet'.format(
-                record_id), major=False)
+    def preprocess_file(self):
+        IndexTool.preprocess_file(self)
+        self.entry_filename = self.collection.relative_path(
+            self.current_filename)
 
-    def verify_refers_to(self, record):
-        if 'WARC-Refers-To' not in record.header.fields:
-            return
+    def postprocess_file(self):
+        self.add_run(self.current_filename, self.index_lines)
+
+    def postprocess(self):
+        if self.run_filenames:
+            self.collection.add_runs(self.run_filenames,
+                self.indexed_filenames)
+
+    def get_state(self, data_file):
+        state = IndexTool.get_state(self, data_file)
+        state['run_filenames'] = self.run_filenames
+        state['indexed_filenames'] = self.indexed_filenames
+
+        return state
+
+    def set_state(self, state, data_file):
+        IndexTool.set_state(self, state, data_file)
+
+        for run_filename in self.run_filenames:
+            if run_filename not in state['run_filenames']:
+                os.remove(run_filename)
+
+        self.run_filenames = state['run_filenames']
+        self.indexed_filenames = state['indexed_filenames']
+
+
+class VerifyTool(BaseIterateTool):
+    '''Checks records with a :class:`.verify.Verifier`.
+
+    :param enabled_rules: Names of optional rules to enable.
+    :param disabled_rules: Names of rules to disable.
+    :param cache: A :class:`.VerifyCache`. Files that did not change since
+        they were cached are not read again. It is not used when records
+        are filtered.
+    :param max_problem_list: The number of problems kept in
+        :attr:`problem_list` and checkpoints. All problems are logged as
+        they are found.
+
+    .. attribute:: problems
+
+        The number of problems found.
+
+    .. attribute:: problem_list
 
-        record_id = record.header.fields['WARC-Refers-To']
+        A list of the first :class:`.verify.Problem` found.
+    '''
 
-        if record.warc_type in ('warcinfo', 'response', 'request',
-        'continuation'):
-            raise VerifyProblem('WARC-Refers-To field unexpected', '5.11')
+    CACHE_BATCH_SIZE = 1000
+    MAX_PROBLEM_LIST = 1000
 
-        if record_id not in self.record_ids:
-            raise VerifyProblem('Refer to record ID {} not seen yet'.format(
-                record_id), major=False)
+    def __init__(self, filenames, enabled_rules=(), disabled_rules=(),
+    cache=None, max_problem_list=MAX_PROBLEM_LIST, **kwargs):
+        BaseIterateTool.__init__(self, filenames, **kwargs)
+        self.max_problem_list = max_problem_list
+        self.verifier = verify.Verifier(enabled=enabled_rules,
+            disabled=disabled_rules)
+        self.cache = cache if not self.record_filter else None
+        self.rules_key = ','.join(rule.name for rule in self.verifier.rules)
 
-    def verify_target_uri(self, record):
-        uri = record.header.fields.get('WARC-Target-URI')
+    def preprocess(self):
+        self.record_ids = self.verifier.record_ids
+        self.problems = 0
+        self.problem_list = []
+        self.check_block_length = True
+
+    def skip_file(self):
+        if not self.cache:
+            return False
+
+        cached_records = self.cache.get(
+            self.cache.file_key(self.current_filename), self.rules_key)
+
+        if cached_records is None:
+            return False
+
+        _logger.info('Using cached results of %s', self.current_filename)
+
+        for fields, problems in cached_records:
+            for problem in self.verifier.check_ids(fields):
+                self.add_problem(problem)
+
+            for problem in problems:
+                self.add_problem(verify.Problem(
+                    fields.get('warc-record-id'), *problem))
+
+            self.num_records += 1
 
-        if not uri and record.warc_type in ('response', 'resource', 'request',
-        'revisit', 'conversion', 'continuation'):
-            raise VerifyProblem('Expected WARC-Target-URI', '5.12')
+        return True
 
-        if uri and record.warc_type == 'warc_info':
-            raise VerifyProblem('Unexpected WARC-Target-URI', '5.12')
+    def preprocess_file(self):
+        # A resumed file is not complete in the cache since the records
+        # before the checkpoint are not added
+        if self.cache:
+            self.cache_file_id = self.cache.begin(
+                self.cache.file_key(self.current_filename), self.rules_key)
+            self.cache_records = []
+            self.num_cached_records = 0
 
-        if uri and ' ' in uri:
-            raise VerifyProblem('Whitespace in URI', '5.12')
+    def action(self, record):
+        fields = verify.read_fields(record)
+        problems = self.verifier.check_record(record, fields)
+
+        if self.cache:
+            self.cache_records.append((self.record_order,
+                dict((name, fields[name]) for name in verify.ID_FIELDS
+                    if name in fields),
+                [problem[1:] for problem in problems]))
+
+            if len(self.cache_records) >= self.CACHE_BATCH_SIZE:
+                self.flush_cache()
+
+        for problem in self.verifier.check_ids(fields) + problems:
+            self.add_problem(problem)
+
+    def flush_cache(self):
+        self.cache.add_records(self.cache_file_id, self.cache_records)
+        self.num_cached_records += len(self.cache_records)
+        self.cache_records = []
+
+    def postprocess_file(self):
+        if self.cache:
+            self.flush_cache()
+
+            if self.num_cached_records == self.record_order:
+                self.cache.finish(self.cache_file_id)
+
+    def postprocess(self):
+        for problem in self.verifier.resolve():
+            self.add_problem(problem)
 
-    def verify_warcinfo_id(self, record):
-        record_id = record.header.fields.get('WARC-Warcinfo-ID')
+        self.verifier.close()
 
-        if record_id and record.warc_type == 'warcinfo':
-            raise VerifyProblem('Unexpected WARC-Warcinfo-ID', '5.14')
+    def get_state(self, data_file):
+        self.verifier.save(data_file)
 
-        if not record_id:
-            raise VerifyProblem('Expected WARC-Warcinfo-ID', '5.14', False)
+        return {
+            'problems': self.problems,
+            'problem_list': [list(problem) for problem in self.problem_list],
+        }
 
-    def verify_filename(self, record):
-        if 'WARC-Filename' in record.header.fields \
-        and record.warc_type != 'warcinfo':
-            raise VerifyProblem('Unexpected WARC-Filename', '5.15')
+    def set_state(self, state, data_file):
+        self.verifier.load(data_file)
+        self.problems = state['problems']
+        self.problem_list = [verify.Problem(*problem)
+            for problem in state['problem_list']]
 
-    def verify_profile(self, record):
-        if record.warc_type == 'revisit' \
-        and 'WARC-Profile' not in record.header.fields:
-            raise VerifyProblem('Expected WARC-Profile', '5.16')
+    def add_problem(self, problem):
+        self.problems += 1
 
-    def verify_segment_origin_id(self, record):
-        if record.warc_type == 'continuation':
-            if 'WARC-Segment-Origin-ID' not in record.header.fields:
-                raise VerifyProblem('Expected WARC-Segment-Origin-ID', '5.19')
-        elif 'WARC-Segment-Origin-ID' in record.header.fields:
-            raise VerifyProblem('Unexpected WARC-Segment-Origin-ID', '5.19')
+        if len(self.problem_list) < self.max_problem_list:
+            self.problem_list.append(problem)
 
-    def verify_segment_total_length(self, record):
-        if record.warc_type == 'continuation':
-            if 'WARC-Segment-Total-Length' not in record.header.fields:
-                raise VerifyProblem('Expected WARC-Segment-Total-Length',
-                    '5.20')
-        elif 'WARC-Segment-Total-Length' in record.header.fields:
-            raise VerifyProblem('Unexpected WARC-Segment-Total-Length', '5.20')
+        _logger.log(logging.ERROR if problem.major else logging.WARNING,
+            'Record %s failed validation: %s', problem.record_id, problem)
@@ -1,8 +1,46 @@
-from warcat.tool import ListTool, VerifyTool, SplitTool, ExtractTool, ConcatTool
+from warcat import extractarchive, model
+from warcat.digeststore import DigestStore
+from warcat.expression import Expression
+from warcat.model_test import write_warc
+from warcat.objectstore import ObjectStore
+from warcat.tool import ListTool, VerifyTool, SplitTool, ExtractTool, ConcatTool, \
+    AddDigestsTool, DedupTool, FilterTool
+from warcat.verifycache import VerifyCache
 import glob
+import gzip
+import io
+import json
 import os.path
+import tarfile
 import tempfile
 import unittest
+import zipfile
+
+
+class CrashError(Exception):
+    pass
+
+
+class CrashMixin(object):
+    crash_at = 5
+
+    def action(self, record):
+        if self.num_records == self.crash_at:
+            raise CrashError()
+
+        super().action(record)
+
+
+class CrashingVerifyTool(CrashMixin, VerifyTool):
+    pass
+
+
+class CrashingConcatTool(CrashMixin, ConcatTool):
+    pass
+
+
+class CrashingFilterTool(CrashMixin, FilterTool):
+    pass
 
 
 class TestTool(unittest.TestCase):
@@ -18,6 +56,152 @@ class TestTool(unittest.TestCase):
         tool.process()
 
         self.assertEqual(1, tool.problems)
+        self.assertEqual(1, len(tool.problem_list))
+        self.assertTrue(tool.problem_list[0].record_id)
+        self.assertTrue(tool.problem_list[0].message)
+
+    def test_verify_max_problem_list(self):
+        filenames = [os.path.join(self.test_dir, 'at.warc'),
+            os.path.join(self.test_dir, 'at.warc.gz')]
+        tool = VerifyTool(filenames, preserve_block=False)
+        tool.process()
+
+        self.assertEqual(2, tool.problems)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            checkpoint_filename = os.path.join(temp_dir, 'checkpoint')
+            tool = CrashingVerifyTool(filenames, preserve_block=False,
+                checkpoint_filename=checkpoint_filename,
+                checkpoint_interval=0, max_problem_list=1)
+            tool.crash_at = 15
+
+            self.assertRaises(CrashError, tool.process)
+
+            with open(checkpoint_filename) as f:
+                self.assertEqual(1,
+                    len(json.load(f)['state']['problem_list']))
+
+            tool = VerifyTool(filenames, preserve_block=False,
+                checkpoint_filename=checkpoint_filename, resume=True,
+                max_problem_list=1)
+            tool.process()
+
+        self.assertEqual(2, tool.problems)
+        self.assertEqual(1, len(tool.problem_list))
+
+    def test_slow_record(self):
+        tool = VerifyTool([os.path.join(self.test_dir, 'at.warc')],
+            preserve_block=False, slow_record_threshold=0)
+
+        with self.assertLogs('warcat.tool', 'WARNING') as logs:
+            tool.process()
+
+        slow_logs = [line for line in logs.output if 'Slow record' in line]
+
+        self.assertEqual(8, len(slow_logs))
+        self.assertIn('at offset 534', slow_logs[1])
+
+    def test_verify_cache(self):
+        filenames = [os.path.join(self.test_dir, 'at.warc'),
+            os.path.join(self.test_dir, 'at.warc.gz')]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = VerifyCache(os.path.join(temp_dir, 'cache.db'))
+            tool = VerifyTool(filenames, preserve_block=False, cache=cache)
+            tool.process()
+            problems = sorted(tool.problem_list)
+
+            for filename in filenames:
+                self.assertIsNotNone(cache.get(cache.file_key(filename),
+                    tool.rules_key))
+
+            tool = VerifyTool(filenames, preserve_block=False, cache=cache)
+            tool.process()
+            cache.close()
+
+            self.assertEqual(problems, sorted(tool.problem_list))
+            self.assertEqual(16, tool.num_records)
+
+    def test_checkpoint_resume(self):
+        filenames = [os.path.join(self.test_dir, 'at.warc.gz'),
+            os.path.join(self.test_dir, 'at.warc')]
+        tool = VerifyTool(filenames, preserve_block=False)
+        tool.process()
+        problems = sorted(tool.problem_list)
+
+        for crash_at in (5, 11):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                checkpoint_filename = os.path.join(temp_dir, 'checkpoint')
+                cache = VerifyCache(os.path.join(temp_dir, 'cache.db'))
+                tool = CrashingVerifyTool(filenames, preserve_block=False,
+                    checkpoint_filename=checkpoint_filename,
+                    checkpoint_interval=0, cache=cache)
+                tool.crash_at = crash_at
+
+                self.assertRaises(CrashError, tool.process)
+
+                tool = VerifyTool(filenames, preserve_block=False,
+                    checkpoint_filename=checkpoint_filename, resume=True,
+                    cache=cache)
+                tool.process()
+
+                self.assertEqual(problems, sorted(tool.problem_list))
+                self.assertEqual(16, tool.num_records)
+                self.assertFalse(glob.glob(checkpoint_filename + '*'))
+
+                # Only the file read from the start is complete
+                resumed_index = crash_at // 8
+                self.assertIsNone(cache.get(
+                    cache.file_key(filenames[resumed_index]),
+                    tool.rules_key))
+                self.assertIsNotNone(cache.get(
+                    cache.file_key(filenames[1 - resumed_index]),
+                    tool.rules_key))
+                cache.close()
+
+    def test_checkpoint_resume_output(self):
+        filenames = [os.path.join(self.test_dir, 'at.warc.gz'),
+            os.path.join(self.test_dir, 'at.warc')]
+
+        for tool_class, crashing_tool_class, write_gzip in [
+        (ConcatTool, CrashingConcatTool, False),
+        (FilterTool, CrashingFilterTool, True)]:
+            out_file = io.BytesIO()
+            tool_class(filenames, out_file=out_file,
+                write_gzip=write_gzip).process()
+            expected = out_file.getvalue()
+
+            for crash_at in (5, 11):
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    checkpoint_filename = os.path.join(temp_dir, 'checkpoint')
+                    out_filename = os.path.join(temp_dir, 'out.warc')
+
+                    with open(out_filename, 'wb') as f:
+                        tool = crashing_tool_class(filenames, out_file=f,
+                            write_gzip=write_gzip,
+                            checkpoint_filename=checkpoint_filename,
+                            checkpoint_interval=0)
+                        tool.crash_at = crash_at
+
+                        self.assertRaises(CrashError, tool.process)
+
+                        # A record written after the checkpoint
+                        f.write(b'WARC/1.0\r\n')
+
+                    # The output written before the checkpoint is missing
+                    self.assertRaises(ValueError, tool_class(filenames,
+                        out_file=io.BytesIO(), write_gzip=write_gzip,
+                        checkpoint_filename=checkpoint_filename,
+                        resume=True).process)
+
+                    with open(out_filename, 'r+b') as f:
+                        tool_class(filenames, out_file=f,
+                            write_gzip=write_gzip,
+                            checkpoint_filename=checkpoint_filename,
+                            resume=True).process()
+
+                    with open(out_filename, 'rb') as f:
+                        self.assertEqual(expected, f.read())
 
     def test_split(self):
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -36,6 +220,181 @@ class TestTool(unittest.TestCase):
             self.assertEqual(1, len(
                 glob.glob(os.path.join(temp_dir, '*', '*index*'))))
 
+    def test_extract_jobs(self):
+        urls = ['http://example.com/a', 'http://example.com/a/b',
+            'http://example.com/a', 'http://example.com/c',
+            'http://example.com/a/b/c', 'http://example.com/c']
+        trees = []
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'conflict.warc')
+
+            write_warc(filename, [('response', url,
+                b'HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\n'
+                + str(index).encode()) for index, url in enumerate(urls)])
+
+            for jobs, plan_paths in ((1, False), (3, False), (1, True),
+            (3, True)):
+                out_dir = os.path.join(temp_dir, str(len(trees)))
+                tool = ExtractTool([filename], out_dir=out_dir,
+                    preserve_block=False, jobs=jobs, plan_paths=plan_paths)
+                tool.process()
+
+                tree = {}
+
+                for path in glob.glob(os.path.join(out_dir, '**'),
+                recursive=True):
+                    if os.path.isfile(path):
+                        with open(path, 'rb') as f:
+                            tree[os.path.relpath(path, out_dir)] = f.read()
+
+                trees.append(tree)
+
+        self.assertEqual(4, len(trees[0]))
+
+        for tree in trees[1:]:
+            self.assertEqual(trees[0], tree)
+
+    def test_extract_existing_tree(self):
+        trees = []
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filenames = []
+
+            for index, url in enumerate(['http://example.com/a',
+            'http://example.com/a/b']):
+                filename = os.path.join(temp_dir, '{}.warc'.format(index))
+                filenames.append(filename)
+                write_warc(filename, [('response', url,
+                    b'HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\n'
+                    + str(index).encode())])
+
+            for plan_paths in (False, True):
+                out_dir = os.path.join(temp_dir, str(plan_paths))
+
+                for filename in filenames:
+                    ExtractTool([filename], out_dir=out_dir,
+                        preserve_block=False, plan_paths=plan_paths).process()
+
+                tree = {}
+
+                for path in glob.glob(os.path.join(out_dir, '**'),
+                recursive=True):
+                    if os.path.isfile(path):
+                        with open(path, 'rb') as f:
+                            tree[os.path.relpath(path, out_dir)] = f.read()
+
+                trees.append(tree)
+
+        self.assertEqual({
+            os.path.join('example.com', 'a_index_86f7e4'): b'0',
+            os.path.join('example.com', 'a', 'b'): b'1',
+        }, trees[0])
+        self.assertEqual(trees[0], trees[1])
+
+    def test_extract_decode_content(self):
+        body = b'Hello world! ' * 1000
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'gzip.warc')
+
+            write_warc(filename, [('response', 'http://example.com/a',
+                b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n\r\n'
+                + gzip.compress(body))])
+
+            tool = ExtractTool([filename], out_dir=temp_dir,
+                preserve_block=False, decode_content=True)
+            tool.process()
+
+            with open(os.path.join(temp_dir, 'example.com', 'a'), 'rb') as f:
+                self.assertEqual(body, f.read())
+
+    def test_extract_archive(self):
+        urls = ['http://example.com/a', 'http://example.com/a/b',
+            'http://example.com/c']
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'archive.warc')
+
+            write_warc(filename, [('response', url,
+                b'HTTP/1.1 200 OK\r\n'
+                b'Last-Modified: Tue, 01 Jan 2013 00:00:00 GMT\r\n\r\n'
+                + str(index).encode()) for index, url in enumerate(urls)])
+
+            out_dir = os.path.join(temp_dir, 'out')
+            ExtractTool([filename], out_dir=out_dir,
+                preserve_block=False).process()
+            expected = {}
+
+            for path in glob.glob(os.path.join(out_dir, '**'),
+            recursive=True):
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        expected[os.path.relpath(path, out_dir)] = f.read()
+
+            for archive_format in extractarchive.FORMATS:
+                if archive_format == 'zip' \
+                and not extractarchive.CAN_WRITE_ZIP:
+                    self.assertRaises(ValueError, extractarchive.new_writer,
+                        archive_format, io.BytesIO())
+                    continue
+
+                archive_file = io.BytesIO()
+                archive = extractarchive.new_writer(archive_format,
+                    archive_file)
+                ExtractTool([filename], preserve_block=False,
+                    archive=archive).process()
+                archive.close()
+                archive_file.seek(0)
+
+                if archive_format == 'tar':
+                    with tarfile.open(fileobj=archive_file) as tar:
+                        self.assertEqual(int(os.path.getmtime(
+                            os.path.join(out_dir, 'example.com', 'c'))),
+                            tar.getmember('example.com/c').mtime)
+                        files = dict((name, tar.extractfile(name).read())
+                            for name in tar.getnames())
+                else:
+                    with zipfile.ZipFile(archive_file) as zip_file:
+                        files = dict((name, zip_file.read(name))
+                            for name in zip_file.namelist())
+
+                self.assertEqual(expected, files)
+
+    def test_extract_dedup(self):
+        payloads = [b'same', b'other', b'same']
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'dedup.warc')
+
+            write_warc(filename, [('response',
+                'http://example.com/{}'.format(index),
+                b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n'
+                + payload) for index, payload in enumerate(payloads)])
+
+            store_dir = os.path.join(temp_dir, 'store')
+
+            for run in range(2):
+                out_dir = os.path.join(temp_dir, str(run))
+                object_store = ObjectStore(store_dir)
+                tool = ExtractTool([filename], out_dir=out_dir,
+                    preserve_block=False, object_store=object_store,
+                    jobs=run + 1)
+                tool.process()
+                object_store.close()
+
+                paths = [os.path.join(out_dir, 'example.com', str(index))
+                    for index in range(3)]
+
+                for path, payload in zip(paths, payloads):
+                    with open(path, 'rb') as f:
+                        self.assertEqual(payload, f.read())
+
+                self.assertTrue(os.path.samefile(paths[0], paths[2]))
+                self.assertFalse(os.path.samefile(paths[0], paths[1]))
+                self.assertEqual(2, len(glob.glob(
+                    os.path.join(store_dir, 'objects', '*', '*'))))
+
     def test_extract_long_url(self):
         with tempfile.TemporaryDirectory() as temp_dir:
             tool = ExtractTool([os.path.join(self.test_dir, 'long_url.warc')],
@@ -50,13 +409,18 @@ class TestTool(unittest.TestCase):
             self.assertLess(len(filename), 180)
 
     def test_extract_bad_http_chunked_content(self):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            tool = ExtractTool([os.path.join(self.test_dir, 'bad_http_chunked_content.warc')],
-                out_dir=temp_dir, preserve_block=False)
-            tool.process()
+        for decode_content in (False, True):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                tool = ExtractTool([os.path.join(self.test_dir, 'bad_http_chunked_content.warc')],
+                    out_dir=temp_dir, preserve_block=False,
+                    decode_content=decode_content)
+                tool.process()
 
-            self.assertEqual(1, len(
-                glob.glob(os.path.join(temp_dir, '*', '*index*'))))
+                paths = glob.glob(os.path.join(temp_dir, '*', '*index*'))
+                self.assertEqual(1, len(paths))
+
+                # The partial body is kept
+                self.assertEqual(3, os.path.getsize(paths[0]))
 
     def test_extract_not_utf8_http_header(self):
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -77,3 +441,129 @@ class TestTool(unittest.TestCase):
 
             self.assertEqual(1, tool.problems)
 
+
+    def test_add_digests(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'nodigest.warc')
+
+            write_warc(filename, [
+                ('warcinfo', None, b'software: warcat\r\n\r\n'),
+                ('response', 'http://example.com/', b'HTTP/1.1 200 OK\r\n'
+                    b'Content-Type: text/html\r\n\r\n' + os.urandom(100000)),
+                ('resource', 'http://example.com/', b'Hello world!'),
+            ], digest_algorithm=())
+
+            out_filename = os.path.join(temp_dir, 'digest.warc.gz')
+
+            with open(out_filename, 'wb') as f:
+                AddDigestsTool([filename], out_file=f, write_gzip=True,
+                    digest_algorithms=['sha1', 'sha256']).process()
+
+            tool = VerifyTool([out_filename], preserve_block=False)
+            tool.process()
+            self.assertEqual(0, tool.problems)
+
+            warc = model.WARC()
+            warc.load(out_filename)
+
+            for record in warc.records:
+                self.assertEqual(2,
+                    record.header.fields.count('WARC-Block-Digest'))
+                self.assertEqual(2 if record.warc_type == 'response' else 0,
+                    record.header.fields.count('WARC-Payload-Digest'))
+
+            self.assertEqual(b'Hello world!',
+                bytes(warc.records[2].content_block))
+
+            # Records with all the digests are copied as they are
+            out_file = io.BytesIO()
+            AddDigestsTool([out_filename], out_file=out_file,
+                digest_algorithms=['sha256']).process()
+
+            with gzip.open(out_filename) as f:
+                self.assertEqual(f.read(), out_file.getvalue())
+
+    def test_dedup(self):
+        payload = os.urandom(10000)
+        block = b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n' + payload
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filenames = []
+
+            for name in ('a', 'b'):
+                filename = os.path.join(temp_dir, name + '.warc')
+                filenames.append(filename)
+                write_warc(filename, [('response',
+                    'http://example.com/{}{}'.format(name, index), block)
+                    for index in range(2)])
+
+            digest_store = DigestStore(os.path.join(temp_dir, 'digests.db'))
+            out_filenames = []
+
+            for filename in filenames:
+                out_filename = filename + '.out.warc.gz'
+                out_filenames.append(out_filename)
+
+                with open(out_filename, 'wb') as f:
+                    tool = DedupTool([filename], out_file=f, write_gzip=True,
+                        digest_store=digest_store)
+                    tool.process()
+
+            digest_store.close()
+
+            self.assertEqual(2, tool.num_revisits)
+
+            tool = VerifyTool(out_filenames, preserve_block=False)
+            tool.process()
+            self.assertEqual(0, tool.problems)
+
+            warc = model.WARC()
+
+            for out_filename in out_filenames:
+                warc.load(out_filename)
+
+            self.assertEqual(['response', 'revisit', 'revisit', 'revisit'],
+                [record.warc_type for record in warc.records])
+            self.assertEqual(payload,
+                bytes(warc.records[0].content_block.payload))
+
+            for record in warc.records[1:]:
+                self.assertEqual(warc.records[0].record_id,
+                    record.header.fields['WARC-Refers-To'])
+                self.assertEqual('http://example.com/a0',
+                    record.header.fields['WARC-Refers-To-Target-URI'])
+                self.assertEqual(0, record.content_block.payload.length)
+
+    def test_filter(self):
+        filename = os.path.join(self.test_dir, 'at.warc.gz')
+
+        with gzip.open(filename) as f:
+            data = f.read()
+
+        out_file = io.BytesIO()
+        tool = FilterTool([filename], out_file=out_file)
+        tool.process()
+
+        self.assertEqual(8, tool.num_matched)
+        self.assertEqual(data, out_file.getvalue())
+
+        with tempfile.NamedTemporaryFile(suffix='.warc') as f:
+            tool = FilterTool([filename], out_file=f,
+                expression=Expression('type=warcinfo or status=200'))
+            tool.process()
+
+            self.assertEqual(2, tool.num_matched)
+
+            warc = model.WARC()
+            warc.load(f.name)
+
+            self.assertEqual(['warcinfo', 'response'],
+                [record.warc_type for record in warc.records])
+
+            f.seek(0)
+            out_data = f.read()
+
+        split_offset = warc.records[1].file_offset
+
+        self.assertTrue(data.startswith(out_data[:split_offset]))
+        self.assertIn(out_data[split_offset:], data)
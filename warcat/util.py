@@ -1,6 +1,9 @@
 '''Utility functions'''
 # Copyright 2013 Christopher Foo <chris.foo@gmail.com>
 # Licensed under GPLv3. See COPYING.txt for details.
+from warcat import stats
+import array
+import bisect
 import collections
 import datetime
 import email.utils
@@ -9,13 +12,25 @@ import http.client
 import io
 import logging
 import os
+import re
 import tempfile
 import threading
 import urllib.parse
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 _logger = logging.getLogger(__name__)
 
+MAX_LINE = 65536
+BUFFER_SIZE = 65536
+MAX_HEADER_SIZE = 1048576
+DECOMPRESS_CODINGS = frozenset(['gzip', 'x-gzip', 'deflate', 'br'])
+
 
 def printable_str_to_str(s):
     return s.translate(str.maketrans('', '', '\t\r\n'))\
@@ -66,6 +81,22 @@ inclusive=False):
     raise ValueError('Search for pattern exhausted')
 
 
+def read_header_bytes(file_obj, length, limit=MAX_HEADER_SIZE):
+    '''Read and return the `bytes` up to and including the first blank line.
+
+    At most the smaller of `length` and `limit` bytes are searched. If there
+    is no blank line, `None` is returned and the position is unchanged.
+    '''
+
+    try:
+        header_length = find_file_pattern(file_obj, b'\r\n\r\n',
+            bufsize=4096, limit=min(length, limit), inclusive=True)
+    except ValueError:
+        return
+
+    return file_obj.read(header_length)
+
+
 def strip_warc_extension(s):
     '''Removes ``.warc`` or ``.warc.gz`` from filename'''
 
@@ -79,17 +110,23 @@ def strip_warc_extension(s):
 
 
 class DiskBufferedReader(io.BufferedIOBase):
-    '''Buffers the file to disk large parts at a time'''
+    '''Buffers the file to disk large parts at a time
+
+    :param base_offset: The position where the first block starts. Data
+        before it cannot be read.
+    '''
 
     # Some segments lifted from _pyio.py
     # Copyright 2001-2011 Python Software Foundation
     # Licensed under Python Software Foundation License Version 2
 
-    def __init__(self, raw, disk_buffer_size=104857600, spool_size=10485760):
+    def __init__(self, raw, disk_buffer_size=104857600, spool_size=10485760,
+    base_offset=0):
         io.BufferedIOBase.__init__(self)
         self._raw = raw
         self._disk_buffer_size = disk_buffer_size
-        self._offset = 0
+        self._base_offset = base_offset
+        self._offset = base_offset
         self._block_index = None
         self._block_file = None
         self._spool_size = spool_size
@@ -117,11 +154,16 @@ class DiskBufferedReader(io.BufferedIOBase):
                 self._block_file = tempfile.SpooledTemporaryFile(
                     max_size=self._spool_size)
 
-                self._raw.seek(self._block_index * self._disk_buffer_size)
+                self._raw.seek(self._base_offset
+                    + self._block_index * self._disk_buffer_size)
                 copyfile_obj(self.raw, self._block_file,
                     max_length=self._disk_buffer_size)
                 self._cache.put(self._block_index, self._block_file)
 
+                if self._block_file.tell() > self._spool_size:
+                    stats.recorder.add('disk_buffer_spilled_bytes',
+                        self._block_file.tell())
+
                 _logger.debug('Buffer block file created. length=%d',
                     self._block_file.tell())
 
@@ -139,9 +181,14 @@ class DiskBufferedReader(io.BufferedIOBase):
                 self._offset += pos
 
             self._offset = pos
-            index = self._offset // self._disk_buffer_size
+
+            if pos < self._base_offset:
+                raise ValueError('Position is before the base offset')
+
+            index = (pos - self._base_offset) // self._disk_buffer_size
             self._set_block(index)
-            self._block_file.seek(self._offset % self._disk_buffer_size)
+            self._block_file.seek(
+                (pos - self._base_offset) % self._disk_buffer_size)
 
     def read(self, n=None):
         buf = io.BytesIO()
@@ -202,6 +249,269 @@ class DiskBufferedReader(io.BufferedIOBase):
         return self.raw.isatty()
 
 
+GZIP_MAGIC = b'\x1f\x8b'
+'''The bytes that begin a gzip member'''
+
+
+class GzipMemberReader(io.BufferedIOBase):
+    '''Reads a file of concatenated gzip members.
+
+    Members are decompressed with :mod:`zlib` and the location of each
+    member is recorded as it is found. Seeking backwards restarts
+    decompression at the closest known member instead of the start of the
+    file.
+
+    :param file: A filename or a file object opened in binary mode. The
+        file object is closed when the reader is closed.
+    :param member_offset: The offset in the compressed file of the member
+        to start reading from.
+    :param position: The offset in the uncompressed stream where the member
+        at `member_offset` begins.
+
+    .. attribute:: name
+
+        The filename if the reader was given a filename. Otherwise, `None`.
+    '''
+
+    def __init__(self, file, member_offset=0, position=0, read_size=65536,
+    lookbehind_size=1048576):
+        io.BufferedIOBase.__init__(self)
+
+        if hasattr(file, 'read'):
+            self._file = file
+            self.name = None
+        else:
+            self._file = open(file, 'rb')
+            self.name = file
+
+        self._read_size = read_size
+        self._lookbehind_size = lookbehind_size
+        self._member_starts = array.array('q')
+        self._member_offsets = array.array('q')
+        self._position = position
+
+        if member_offset and position:
+            self.add_member(0, 0)
+
+        self.add_member(position, member_offset)
+        self._restart(self._member_starts.index(position))
+
+    def add_member(self, position, offset):
+        '''Add the location of a member so seeking to it is fast.
+
+        :param position: The offset in the uncompressed stream.
+        :param offset: The offset of the member in the compressed file.
+        '''
+
+        index = bisect.bisect_left(self._member_starts, position)
+
+        if index < len(self._member_starts) \
+        and self._member_starts[index] == position:
+            return
+
+        self._member_starts.insert(index, position)
+        self._member_offsets.insert(index, offset)
+
+    def _restart(self, index):
+        self._input_offset = self._member_offsets[index]
+        self._file.seek(self._input_offset)
+        self._input = b''
+        self._decompressor = None
+        self._buffer = bytearray()
+        self._buffer_start = self._member_starts[index]
+
+        _logger.debug('Restart decompression at member offset %d',
+            self._input_offset)
+
+    def _fill(self):
+        '''Decompress more data into the buffer.
+
+        Returns `False` if there is no more data.
+        '''
+
+        while True:
+            if len(self._input) < len(GZIP_MAGIC):
+                data = self._file.read(self._read_size)
+
+                if not data:
+                    if self._decompressor:
+                        raise EOFError('Compressed file ended before the '
+                            'end-of-stream marker was reached')
+                    elif self._input.strip(b'\x00'):
+                        raise IOError('Trailing garbage after gzip member '
+                            '(offset={})'.format(self._input_offset))
+
+                    return False
+
+                self._input += data
+
+            if not self._decompressor:
+                data = self._input.lstrip(b'\x00')
+                self._input_offset += len(self._input) - len(data)
+                self._input = data
+
+                if len(data) < len(GZIP_MAGIC):
+                    continue
+
+                if not data.startswith(GZIP_MAGIC):
+                    raise IOError('Not a gzip member (offset={})'.format(
+                        self._input_offset))
+
+                self.add_member(self._buffer_start + len(self._buffer),
+                    self._input_offset)
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            with stats.recorder.time('decompress'):
+                data = self._decompressor.decompress(self._input,
+                    self._read_size)
+
+            if self._decompressor.eof:
+                remain = self._decompressor.unused_data
+                self._decompressor = None
+            else:
+                remain = self._decompressor.unconsumed_tail
+
+            self._input_offset += len(self._input) - len(remain)
+            self._input = remain
+
+            if data:
+                trim = min(len(self._buffer),
+                    self._position - self._lookbehind_size - self._buffer_start)
+
+                if trim > 0:
+                    del self._buffer[:trim]
+                    self._buffer_start += trim
+
+                self._buffer += data
+
+                return True
+
+    def nearest_member(self, position):
+        '''Return the start and offset of the closest known member at or
+        before the given position.'''
+
+        index = bisect.bisect_right(self._member_starts, position) - 1
+
+        return (self._member_starts[index], self._member_offsets[index])
+
+    def member_offset(self, position):
+        '''Return the offset of the member starting at given position.
+
+        Returns `None` if the position is not known to be the start of a
+        member.
+        '''
+
+        index = bisect.bisect_left(self._member_starts, position)
+
+        if index < len(self._member_starts) \
+        and self._member_starts[index] == position:
+            return self._member_offsets[index]
+
+    def read(self, n=-1):
+        if n is None:
+            n = -1
+
+        chunks = []
+
+        while n:
+            offset = self._position - self._buffer_start
+            available = len(self._buffer) - offset
+
+            if available > 0:
+                size = available if n < 0 else min(n, available)
+                chunks.append(bytes(self._buffer[offset:offset + size]))
+                self._position += size
+
+                if n > 0:
+                    n -= size
+            elif not self._fill():
+                break
+
+        return b''.join(chunks)
+
+    def read1(self, n=-1):
+        return self.read(n)
+
+    def peek(self, n=0):
+        while self._position - self._buffer_start >= len(self._buffer):
+            if not self._fill():
+                return b''
+
+        offset = self._position - self._buffer_start
+
+        return bytes(self._buffer[offset:offset + max(n, 1)])
+
+    def tell(self):
+        return self._position
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._position
+        elif whence != 0:
+            raise ValueError('Bad whence argument')
+
+        index = bisect.bisect_right(self._member_starts, pos) - 1
+
+        if index < 0:
+            raise ValueError('Position is before the first known member')
+
+        decoded_end = self._buffer_start + len(self._buffer)
+
+        if pos < self._buffer_start \
+        or self._member_starts[index] > decoded_end:
+            self._restart(index)
+
+        self._position = pos
+
+        return pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    @property
+    def mode(self):
+        return 'rb'
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+
+        io.BufferedIOBase.close(self)
+
+
+def get_member_offset(file_obj, position):
+    '''Return the gzip member offset of a record position in a file object.
+
+    The file object is one returned by :meth:`.WARC.open`. Returns `None`
+    if the file is not gzip compressed or the position is not at the start
+    of a member.
+    '''
+
+    raw = getattr(file_obj, 'raw', file_obj)
+
+    if isinstance(raw, GzipMemberReader):
+        return raw.member_offset(position)
+
+
+def get_nearest_member(file_obj, position):
+    '''Return the start and offset of the closest gzip member at or before
+    a position in a file object.
+
+    Returns `None` if the file is not gzip compressed.
+    '''
+
+    raw = getattr(file_obj, 'raw', file_obj)
+
+    if isinstance(raw, GzipMemberReader):
+        return raw.nearest_member(position)
+
+
 class FileCache(object):
     '''A cache containing references to file objects.
 
@@ -261,13 +571,70 @@ write_attr_name='write'):
         bytes_read += len(data)
 
 
-class HTTPSocketShim(io.BytesIO):
+class LimitedReader(io.RawIOBase):
+    '''Reads at most `length` bytes from the current position of a file.
+
+    :param close_file: If `True`, the file is closed when this reader is
+        closed.
+    '''
+
+    def __init__(self, file_obj, length, close_file=False):
+        io.RawIOBase.__init__(self)
+        self._file_obj = file_obj
+        self._remaining = length
+        self._close_file = close_file
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if self._close_file and not self.closed:
+            self._file_obj.close()
+
+        io.RawIOBase.close(self)
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+
+        if not size:
+            return 0
+
+        data = self._file_obj.read(size)
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+
+        return len(data)
+
+
+class HTTPSocketShim(object):
+    '''Presents a file object or `bytes` as a socket to
+    :class:`http.client.HTTPResponse`'''
+
+    def __init__(self, file_obj):
+        if isinstance(file_obj, (bytes, bytearray)):
+            file_obj = io.BytesIO(file_obj)
+
+        self.file_obj = file_obj
+
     def makefile(self, *args, **kwargs):
-        return self
+        return self.file_obj
+
 
+def parse_http_response(file_obj, length=None, buffer_size=65536):
+    '''Parse and return :class:`http.client.HTTPResponse`
 
-def parse_http_response(file_obj):
-    '''Parse and return :class:`http.client.HTTPResponse`'''
+    Only the status line and headers are read. The body is read from the
+    file object as the response is read, so it is not held in memory.
+
+    :param file_obj: A file object at the start of the status line, or
+        `bytes`.
+    :param length: If given, read at most this number of bytes from the
+        file object.
+    '''
+
+    if length is not None:
+        file_obj = io.BufferedReader(LimitedReader(file_obj, length),
+            buffer_size)
 
     response = http.client.HTTPResponse(HTTPSocketShim(file_obj))
     response.begin()
@@ -275,6 +642,251 @@ def parse_http_response(file_obj):
     return response
 
 
+class ChunkedReader(io.RawIOBase):
+    '''Removes the HTTP chunked transfer coding as data is read.
+
+    :param file_obj: A file object with ``readline``.
+    :param strict: If `False`, malformed chunks end the data with a warning
+        instead of raising `IOError`.
+    '''
+
+    def __init__(self, file_obj, strict=True):
+        io.RawIOBase.__init__(self)
+        self._file_obj = file_obj
+        self._strict = strict
+        self._remaining = 0
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._file_obj.close()
+
+        io.RawIOBase.close(self)
+
+    def readinto(self, buffer):
+        while not self._done and not self._remaining:
+            self._read_chunk_size()
+
+        if self._done:
+            return 0
+
+        data = self._file_obj.read(min(len(buffer), self._remaining))
+
+        if not data:
+            self._fail('Chunk is truncated')
+            return 0
+
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+
+        if not self._remaining and self._file_obj.readline(MAX_LINE).strip():
+            self._fail('Chunk is longer than its size')
+
+        return len(data)
+
+    def _read_chunk_size(self):
+        line = self._file_obj.readline(MAX_LINE)
+        size_str = line.split(b';', 1)[0].strip()
+
+        if not line.endswith(b'\n') \
+        or not re.match(br'[0-9a-fA-F]+\Z', size_str):
+            self._fail('Bad chunk size line {}'.format(line[:80]))
+            return
+
+        self._remaining = int(size_str, 16)
+
+        if not self._remaining:
+            self._done = True
+
+            # Trailer fields
+            while self._file_obj.readline(MAX_LINE).strip():
+                pass
+
+    def _fail(self, message):
+        if self._strict:
+            raise IOError(message)
+
+        _logger.warning('Malformed chunked data: %s', message)
+        self._done = True
+
+
+class BrotliDecompressor(object):
+    '''Presents :mod:`brotli` like a :mod:`zlib` decompressor'''
+
+    unconsumed_tail = b''
+    unused_data = b''
+
+    def __init__(self):
+        if not brotli:
+            raise ValueError('The brotli module is required for br coding')
+
+        self._decompressor = brotli.Decompressor()
+
+    @property
+    def eof(self):
+        return self._decompressor.is_finished()
+
+    def decompress(self, data, max_length=0):
+        return self._decompressor.process(data)
+
+
+def new_decompressor(coding, data):
+    '''Return a decompressor for a content coding.
+
+    :param data: The start of the coded data. It is used to tell zlib
+        wrapped deflate data from raw deflate data.
+    '''
+
+    if coding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif coding == 'deflate':
+        # Many servers send raw deflate data without the zlib wrapper
+        if len(data) >= 2 and data[0] & 0x0f == 8 \
+        and (data[0] << 8 | data[1]) % 31 == 0:
+            return zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            return zlib.decompressobj(-zlib.MAX_WBITS)
+    elif coding == 'br':
+        return BrotliDecompressor()
+
+    raise ValueError('Unsupported coding {}'.format(coding))
+
+
+class DecompressingReader(io.RawIOBase):
+    '''Decompresses a gzip, deflate, or br coded file as data is read.
+
+    :param strict: If `False`, bad data ends the data with a warning
+        instead of raising `IOError`.
+    '''
+
+    def __init__(self, file_obj, coding, strict=True, read_size=65536):
+        io.RawIOBase.__init__(self)
+
+        if coding not in DECOMPRESS_CODINGS:
+            raise ValueError('Unsupported coding {}'.format(coding))
+
+        self._file_obj = file_obj
+        self._coding = coding
+        self._strict = strict
+        self._read_size = read_size
+        self._decompressor = None
+        self._input = b''
+        self._output = bytearray()
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._file_obj.close()
+
+        io.RawIOBase.close(self)
+
+    def readinto(self, buffer):
+        while not self._output and not self._done:
+            try:
+                self._decompress()
+            except zlib.error as error:
+                self._fail('Bad {} data: {}'.format(self._coding, error))
+
+        size = min(len(buffer), len(self._output))
+        buffer[:size] = self._output[:size]
+        del self._output[:size]
+
+        return size
+
+    def _decompress(self):
+        if not self._input:
+            self._input = self._file_obj.read(self._read_size)
+
+        if self._decompressor and self._decompressor.eof:
+            # gzip data may have more than one member
+            if self._coding in ('gzip', 'x-gzip') \
+            and self._input.startswith(b'\x1f\x8b'):
+                self._decompressor = None
+            else:
+                self._done = True
+                return
+
+        if not self._input:
+            if self._decompressor and not self._decompressor.eof:
+                self._fail('{} data is truncated'.format(self._coding))
+            else:
+                self._done = True
+
+            return
+
+        if not self._decompressor:
+            self._decompressor = new_decompressor(self._coding, self._input)
+
+        with stats.recorder.time('decompress'):
+            self._output += self._decompressor.decompress(self._input,
+                self._read_size)
+
+        self._input = self._decompressor.unconsumed_tail \
+            or self._decompressor.unused_data
+
+    def _fail(self, message):
+        if self._strict:
+            raise IOError(message)
+
+        _logger.warning('Malformed coded data: %s', message)
+        self._done = True
+
+
+def parse_codings(value):
+    '''Return a list of lowercase codings in a Content-Encoding or
+    Transfer-Encoding value without ``identity``'''
+
+    return [coding.strip().lower() for coding in (value or '').split(',')
+        if coding.strip() and coding.strip().lower() != 'identity']
+
+
+def open_decoded(file_obj, length=None, transfer_encoding=None,
+content_encoding=None, strict=True, close_file=False):
+    '''Return a file object that decodes HTTP codings as it is read.
+
+    Codings are removed in the reverse order they were applied, transfer
+    codings first. Memory use does not depend on the size of the data.
+
+    :param file_obj: A file object at the start of the coded data.
+    :param length: If given, read at most this number of bytes.
+    :param transfer_encoding: The value of the Transfer-Encoding field.
+    :param content_encoding: The value of the Content-Encoding field or
+        `None` to keep content codings.
+    :param strict: If `False`, malformed data ends the data with a warning
+        instead of raising `IOError` when read.
+    :param close_file: If `True`, `file_obj` is closed with the returned
+        file object.
+    :raises ValueError: A coding is not supported.
+    '''
+
+    codings = parse_codings(content_encoding) \
+        + parse_codings(transfer_encoding)
+
+    for coding in codings:
+        if coding != 'chunked' and coding not in DECOMPRESS_CODINGS \
+        or coding == 'br' and not brotli:
+            raise ValueError('Unsupported coding {}'.format(coding))
+
+    raw = LimitedReader(file_obj, length if length is not None
+        else float('inf'), close_file=close_file)
+
+    for coding in reversed(codings):
+        buffered = io.BufferedReader(raw, BUFFER_SIZE)
+
+        if coding == 'chunked':
+            raw = ChunkedReader(buffered, strict=strict)
+        else:
+            raw = DecompressingReader(buffered, coding, strict=strict)
+
+    return io.BufferedReader(raw, BUFFER_SIZE)
+
+
 def split_url_to_filename(s):
     '''Attempt to split a URL to a filename on disk'''
 
@@ -345,6 +957,77 @@ def rename_filename_dirs(dest_filename):
             break
 
 
+class PathPlanner(object):
+    '''Finds where extracted files end up without touching the disk.
+
+    Paths are added in the order they would be written. The same rules as
+    writing with :func:`append_index_filename` and
+    :func:`rename_filename_dirs` are followed: a file that would be
+    written over a directory is written next to it instead, and a file in
+    the way of a new directory is renamed.
+
+    :param out_dir: If given, the existing files and directories in it
+        are read first. Existing files in the way of a new directory are
+        renamed too.
+    '''
+
+    def __init__(self, out_dir=None):
+        self._dirs = set()
+        self._files = {}
+        self._renames = []
+
+        if out_dir and os.path.isdir(out_dir):
+            for dir_path, dir_names, filenames in os.walk(out_dir):
+                self._dirs.add(dir_path)
+
+                for filename in filenames:
+                    self._files[os.path.join(dir_path, filename)] = None
+
+    def add(self, key, path):
+        '''Add a file to be written at the path'''
+
+        if path in self._dirs:
+            path = append_index_filename(path)
+
+        ancestor = path
+
+        while True:
+            ancestor, filename = os.path.split(ancestor)
+
+            if not filename:
+                break
+
+            if ancestor in self._files:
+                new_path = append_index_filename(ancestor)
+                ancestor_key = self._files.pop(ancestor)
+                self._files[new_path] = ancestor_key
+
+                if ancestor_key is None:
+                    self._renames.append((ancestor, new_path))
+
+                break
+
+        ancestor = os.path.dirname(path)
+
+        while ancestor not in self._dirs:
+            self._dirs.add(ancestor)
+            ancestor = os.path.dirname(ancestor)
+
+        self._files[path] = key
+
+    def destinations(self):
+        '''Return a `dict` of keys to the final paths of their files and a
+        list of tuples of the paths of existing files and their new paths.
+
+        Keys of files that are written over later are not included. The
+        existing files are renamed in the order of the list before any
+        file is written.
+        '''
+
+        return dict((key, path) for path, key in self._files.items()
+            if key is not None), list(self._renames)
+
+
 def truncate_filename_parts(path_parts, length=160):
     '''Truncate and suffix filename path parts if they exceed the given length.
 
@@ -364,6 +1047,48 @@ def truncate_filename_parts(path_parts, length=160):
     return new_parts
 
 
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def surt(url):
+    '''Return the Sort-friendly URI Reordering Transform of a URL.
+
+    The scheme, ``www.`` prefix, default port and fragment are removed, the
+    host name is reversed, query parameters are sorted, and the result is
+    lowercased. For example, ``http://www.example.com/a?b=1`` becomes
+    ``com,example)/a?b=1``.
+    '''
+
+    url_info = urllib.parse.urlsplit(url.strip())
+
+    if not url_info.netloc:
+        s = url.strip().lower()
+    else:
+        host = url_info.hostname or ''
+
+        try:
+            port = url_info.port
+        except ValueError:
+            port = None
+
+        if host.startswith('www.'):
+            host = host[4:]
+
+        s = ','.join(reversed(host.split('.')))
+
+        if port and port != DEFAULT_PORTS.get(url_info.scheme):
+            s += ':{}'.format(port)
+
+        s += ')' + (url_info.path or '/')
+
+        if url_info.query:
+            s += '?' + '&'.join(sorted(url_info.query.split('&')))
+
+        s = s.lower()
+
+    return re.sub(r'\s', lambda match: '%{:02X}'.format(ord(match.group())), s)
+
+
 def parse_http_date(s):
     t = email.utils.parsedate_tz(s)
 
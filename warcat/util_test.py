@@ -1,8 +1,11 @@
 from warcat import util
 import datetime
+import gzip
 import io
 import os.path
+import tempfile
 import unittest
+import zlib
 
 
 class TestUtil(unittest.TestCase):
@@ -77,3 +80,111 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(datetime.datetime(1995, 11, 20, 19, 12, 8,
             tzinfo=datetime.timezone(datetime.timedelta(-1, 68400))),
             util.parse_http_date('Mon, 20 Nov 1995 19:12:08 -0500'))
+
+    def test_gzip_member_reader(self):
+        members = [gzip.compress(b'abc' * i) for i in range(1, 5)]
+        f = util.GzipMemberReader(io.BytesIO(b''.join(members)), read_size=7)
+
+        self.assertEqual(b'abcabc', f.read(6))
+        self.assertEqual(b'a', f.peek(1)[:1])
+        f.seek(3)
+        self.assertEqual(b'abcabc', f.read(6))
+        self.assertEqual(b'abc' * 7, f.read())
+        self.assertEqual(b'', f.read())
+
+        self.assertEqual(0, f.member_offset(0))
+        self.assertEqual(len(members[0]), f.member_offset(3))
+        self.assertEqual(None, f.member_offset(4))
+
+        f = util.GzipMemberReader(io.BytesIO(b''.join(members)),
+            member_offset=len(members[0]) + len(members[1]), position=9)
+        self.assertEqual(b'abc' * 3, f.read(9))
+        f.seek(0)
+        self.assertEqual(b'abc', f.read(3))
+
+    def test_gzip_member_reader_garbage(self):
+        f = util.GzipMemberReader(io.BytesIO(gzip.compress(b'abc') + b'xyz'))
+        self.assertRaises(IOError, f.read)
+
+        f = util.GzipMemberReader(io.BytesIO(gzip.compress(b'abc')[:-4]))
+        self.assertRaises(EOFError, f.read)
+
+    def test_surt(self):
+        self.assertEqual('com,example)/a?a=2&b=1',
+            util.surt('http://www.Example.com:80/a?b=1&a=2#top'))
+        self.assertEqual('com,example:8080)/',
+            util.surt('http://example.com:8080'))
+        self.assertEqual('dns:example.com', util.surt('dns:example.com'))
+
+    def test_open_decoded_chunked(self):
+        data = b'3;name=value\r\nabc\r\n0004\r\ndefg\r\n0\r\nX-Trailer: 1\r\n\r\n'
+
+        f = util.open_decoded(io.BytesIO(data), transfer_encoding='chunked')
+        self.assertEqual(b'abcdefg', f.read())
+
+        f = util.open_decoded(io.BytesIO(data + b'extra'), length=len(data),
+            transfer_encoding='chunked')
+        self.assertEqual(b'abcdefg', f.read())
+
+        f = util.open_decoded(io.BytesIO(b'3\r\nabcd\r\n0\r\n\r\n'),
+            transfer_encoding='chunked')
+        self.assertRaises(IOError, f.read)
+
+        f = util.open_decoded(io.BytesIO(b'3\r\nabc\r\nzz\r\n'),
+            transfer_encoding='chunked', strict=False)
+        self.assertEqual(b'abc', f.read())
+
+    def test_open_decoded_content(self):
+        data = os.urandom(100000) * 3
+        gzip_data = gzip.compress(data[:1000]) + gzip.compress(data[1000:])
+        zlib_data = zlib.compress(data)
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        raw_deflate_data = compressor.compress(data) + compressor.flush()
+
+        f = util.open_decoded(io.BytesIO(gzip_data), content_encoding='gzip')
+        self.assertEqual(data, f.read())
+
+        for deflate_data in (zlib_data, raw_deflate_data):
+            f = util.open_decoded(io.BytesIO(deflate_data),
+                content_encoding='Deflate')
+            self.assertEqual(data, f.read())
+
+        chunked_data = '{:x}\r\n'.format(len(gzip_data)).encode() \
+            + gzip_data + b'\r\n0\r\n\r\n'
+        f = util.open_decoded(io.BytesIO(chunked_data),
+            transfer_encoding='chunked', content_encoding='identity, gzip')
+        self.assertEqual(data, f.read(len(data) // 2) + f.read())
+
+        f = util.open_decoded(io.BytesIO(gzip_data[:-100]),
+            content_encoding='gzip')
+        self.assertRaises(IOError, f.read)
+
+        self.assertRaises(ValueError, util.open_decoded, io.BytesIO(),
+            content_encoding='compress')
+
+    def test_path_planner(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'x'))
+
+            with open(os.path.join(temp_dir, 'y'), 'wb'):
+                pass
+
+            a_path = os.path.join(temp_dir, 'a')
+            b_path = os.path.join(a_path, 'b')
+            x_path = os.path.join(temp_dir, 'x')
+            y_path = os.path.join(temp_dir, 'y')
+            planner = util.PathPlanner(temp_dir)
+
+            planner.add(1, a_path)
+            planner.add(2, b_path)
+            planner.add(3, x_path)
+            planner.add(4, b_path)
+            planner.add(5, os.path.join(y_path, 'z'))
+
+            self.assertEqual(({
+                1: util.append_index_filename(a_path),
+                3: util.append_index_filename(x_path),
+                4: b_path,
+                5: os.path.join(y_path, 'z'),
+            }, [(y_path, util.append_index_filename(y_path))]),
+                planner.destinations())
@@ -3,8 +3,10 @@
 # Licensed under GPLv3. See COPYING.txt for details.
 import hashlib
 import base64
-from warcat import util, model
+from warcat import util, model, stats
+from warcat.idstore import RecordIDStore, ReferenceQueue
 import binascii
+import collections
 
 
 ALGORITHM_MAP = {
@@ -47,8 +49,9 @@ def verify_block_digest(record):
     else:
         content_block = record.content_block
 
-    util.copyfile_obj(content_block.get_file(), hash_obj,
-        max_length=content_block.length, write_attr_name='update')
+    with stats.recorder.time('digest'):
+        util.copyfile_obj(content_block.get_file(), hash_obj,
+            max_length=content_block.length, write_attr_name='update')
 
     return given_digest == hash_obj.digest()
 
@@ -61,7 +64,351 @@ def verify_payload_digest(record):
     hash_obj = ALGORITHM_MAP[alg_name]()
     content_block = record.content_block.payload
 
-    util.copyfile_obj(content_block.get_file(), hash_obj,
-        max_length=content_block.length, write_attr_name='update')
+    with stats.recorder.time('digest'):
+        util.copyfile_obj(content_block.get_file(), hash_obj,
+            max_length=content_block.length, write_attr_name='update')
 
     return given_digest == hash_obj.digest()
+
+
+class Problem(collections.namedtuple('Problem', ['record_id', 'message',
+'iso_section', 'major'])):
+    '''A conformance problem of a record.
+
+    .. attribute:: iso_section
+
+        The section of ISO 28500 or `None`.
+
+    .. attribute:: major
+
+        `False` if the problem is only a recommendation.
+    '''
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '{}{} ({})'.format(self.message,
+            ' (section {})'.format(self.iso_section)
+            if self.iso_section else '',
+            'major' if self.major else 'minor')
+
+
+class Rule(collections.namedtuple('Rule', ['name', 'function', 'enabled'])):
+    '''A conformance rule.
+
+    .. attribute:: function
+
+        A function that accepts a :class:`Verifier`, a record, and a `dict`
+        of lowercase header field names to values. It returns `None` or a
+        tuple of the message, ISO section, and whether the problem is
+        major.
+
+    .. attribute:: enabled
+
+        Whether the rule is enabled by default.
+    '''
+
+    __slots__ = ()
+
+
+MANDATORY_FIELDS = ('warc-record-id', 'content-length', 'warc-date',
+    'warc-type')
+TARGET_URI_TYPES = frozenset(['response', 'resource', 'request', 'revisit',
+    'conversion', 'continuation'])
+CONCURRENT_TO_UNEXPECTED_TYPES = frozenset(['warcinfo', 'conversion',
+    'continuation'])
+REFERS_TO_UNEXPECTED_TYPES = frozenset(['warcinfo', 'response', 'request',
+    'continuation'])
+
+
+def check_mandatory_fields(verifier, record, fields):
+    for name in MANDATORY_FIELDS:
+        if name not in fields:
+            return ('Mandatory {} field is missing'.format(name), None, True)
+
+
+def check_block_digest(verifier, record, fields):
+    if 'warc-block-digest' not in fields:
+        return
+
+    try:
+        ok = verify_block_digest(record)
+    except (KeyError, ValueError) as error:
+        return ('Unreadable block digest: {}'.format(error), '5.8', True)
+
+    if not ok:
+        return ('Bad block digest.', '5.8', True)
+
+
+def check_payload_digest(verifier, record, fields):
+    '''Check the payload digest against the parsed payload.
+
+    The payload digest of a revisit is of the payload of the record it
+    refers to, so it is not checked. A payload digest on a record without
+    a parsed payload, such as a record that is not HTTP or a block read
+    with `preserve_block`, cannot be checked and is a minor problem.
+    '''
+
+    if 'warc-payload-digest' not in fields:
+        return
+
+    # The payload digest of a revisit is of the payload it refers to
+    if fields.get('warc-type') == 'revisit':
+        return
+
+    if not isinstance(record.content_block, model.BlockWithPayload):
+        return ('Payload digest on record without payload.', '5.9', False)
+
+    try:
+        ok = verify_payload_digest(record)
+    except (KeyError, ValueError) as error:
+        return ('Unreadable payload digest: {}'.format(error), '5.9', True)
+
+    if not ok:
+        return ('Bad payload digest.', '5.9', True)
+
+
+def check_id_uniqueness(verifier, record, fields):
+    record_id = fields.get('warc-record-id')
+
+    if record_id is None:
+        return
+
+    if record_id in verifier.record_ids:
+        return ('Duplicate record ID.', None, True)
+
+    verifier.record_ids.add(record_id)
+
+
+def check_id_no_whitespace(verifier, record, fields):
+    if ' ' in fields.get('warc-record-id', ''):
+        return ('Whitespace in ID', '5.2', True)
+
+
+def check_transfer_encoding(verifier, record, fields):
+    if isinstance(record.content_block, model.BlockWithPayload) \
+    and 'Transfer-encoding' in record.content_block.fields:
+        return ('Transfer-encoding found', '5.3.2', False)
+
+
+def check_content_type(verifier, record, fields):
+    if fields.get('warc-type') == 'continuation' \
+    and fields.get('content-length', '0') not in ('0', '') \
+    and 'content-type' not in fields:
+        return ('Content-Type should be specified', '5.6', False)
+
+
+def check_concurrent_to(verifier, record, fields):
+    record_id = fields.get('warc-concurrent-to')
+
+    if record_id is None:
+        return
+
+    if fields.get('warc-type') in CONCURRENT_TO_UNEXPECTED_TYPES:
+        return ('Unexpected WARC-Concurrent-To', '5.7', True)
+
+    if record_id not in verifier.record_ids:
+        verifier.references.add(fields.get('warc-record-id'), record_id,
+            'WARC-Concurrent-To')
+
+
+def check_refers_to(verifier, record, fields):
+    record_id = fields.get('warc-refers-to')
+
+    if record_id is None:
+        return
+
+    if fields.get('warc-type') in REFERS_TO_UNEXPECTED_TYPES:
+        return ('WARC-Refers-To field unexpected', '5.11', True)
+
+    if record_id not in verifier.record_ids:
+        verifier.references.add(fields.get('warc-record-id'), record_id,
+            'WARC-Refers-To')
+
+
+def check_target_uri(verifier, record, fields):
+    uri = fields.get('warc-target-uri')
+    warc_type = fields.get('warc-type')
+
+    if not uri and warc_type in TARGET_URI_TYPES:
+        return ('Expected WARC-Target-URI', '5.12', True)
+
+    if uri and warc_type == 'warcinfo':
+        return ('Unexpected WARC-Target-URI', '5.12', True)
+
+    if uri and ' ' in uri:
+        return ('Whitespace in URI', '5.12', True)
+
+
+def check_warcinfo_id(verifier, record, fields):
+    record_id = fields.get('warc-warcinfo-id')
+
+    if record_id and fields.get('warc-type') == 'warcinfo':
+        return ('Unexpected WARC-Warcinfo-ID', '5.14', True)
+
+    if not record_id and fields.get('warc-type') != 'warcinfo':
+        return ('Expected WARC-Warcinfo-ID', '5.14', False)
+
+
+def check_filename(verifier, record, fields):
+    if 'warc-filename' in fields and fields.get('warc-type') != 'warcinfo':
+        return ('Unexpected WARC-Filename', '5.15', True)
+
+
+def check_profile(verifier, record, fields):
+    if fields.get('warc-type') == 'revisit' and 'warc-profile' not in fields:
+        return ('Expected WARC-Profile', '5.16', True)
+
+
+def check_segment_origin_id(verifier, record, fields):
+    if fields.get('warc-type') == 'continuation':
+        if 'warc-segment-origin-id' not in fields:
+            return ('Expected WARC-Segment-Origin-ID', '5.19', True)
+    elif 'warc-segment-origin-id' in fields:
+        return ('Unexpected WARC-Segment-Origin-ID', '5.19', True)
+
+
+def check_segment_total_length(verifier, record, fields):
+    if fields.get('warc-type') == 'continuation':
+        if 'warc-segment-total-length' not in fields:
+            return ('Expected WARC-Segment-Total-Length', '5.20', True)
+    elif 'warc-segment-total-length' in fields:
+        return ('Unexpected WARC-Segment-Total-Length', '5.20', True)
+
+
+RULES = (
+    Rule('mandatory-fields', check_mandatory_fields, True),
+    Rule('transfer-encoding', check_transfer_encoding, False),
+    Rule('block-digest', check_block_digest, True),
+    Rule('payload-digest', check_payload_digest, True),
+    Rule('id-uniqueness', check_id_uniqueness, True),
+    Rule('id-no-whitespace', check_id_no_whitespace, True),
+    Rule('content-type', check_content_type, True),
+    Rule('concurrent-to', check_concurrent_to, True),
+    Rule('refers-to', check_refers_to, True),
+    Rule('target-uri', check_target_uri, True),
+    Rule('warcinfo-id', check_warcinfo_id, False),
+    Rule('filename', check_filename, True),
+    Rule('profile', check_profile, True),
+    Rule('segment-origin-id', check_segment_origin_id, True),
+    Rule('segment-total-length', check_segment_total_length, True),
+)
+'''The table of :class:`Rule` in the order they are checked'''
+
+ID_RULES = frozenset(['id-uniqueness', 'concurrent-to', 'refers-to'])
+'''Rules that depend on the record IDs seen in other records.
+
+They only read the fields in :data:`ID_FIELDS`.
+'''
+
+ID_FIELDS = ('warc-record-id', 'warc-type', 'warc-concurrent-to',
+    'warc-refers-to')
+
+
+def read_fields(record):
+    '''Return a `dict` of lowercase header field names to values'''
+
+    fields = {}
+
+    for name, value in record.header.fields.list():
+        fields.setdefault(name.lower(), value)
+
+    return fields
+
+
+class Verifier(object):
+    '''Checks records against the conformance rules.
+
+    The header fields are read once per record into a `dict` shared by the
+    rules. Problems are returned as data instead of raised.
+
+    Rules in :data:`ID_RULES` are checked by :meth:`check_ids` and the
+    others by :meth:`check_record`, so the results of a record can be
+    replayed without reading it again.
+
+    :param enabled: Names of rules to enable in addition to the defaults.
+    :param disabled: Names of rules to disable.
+
+    .. attribute:: record_ids
+
+        A :class:`.RecordIDStore` of the record IDs seen so far.
+
+    .. attribute:: references
+
+        A :class:`.ReferenceQueue` of references to records not seen yet.
+        They are checked by :meth:`resolve`.
+    '''
+
+    def __init__(self, enabled=(), disabled=()):
+        names = frozenset(rule.name for rule in RULES)
+
+        for name in tuple(enabled or ()) + tuple(disabled or ()):
+            if name not in names:
+                raise ValueError('Unknown rule {}'.format(name))
+
+        self.rules = [rule for rule in RULES
+            if (rule.enabled or rule.name in (enabled or ()))
+            and rule.name not in (disabled or ())]
+        self.record_rules = [rule for rule in self.rules
+            if rule.name not in ID_RULES]
+        self.id_rules = [rule for rule in self.rules if rule.name in ID_RULES]
+        self.record_ids = RecordIDStore()
+        self.references = ReferenceQueue()
+
+    def check(self, record):
+        '''Return a list of :class:`Problem`'''
+
+        fields = read_fields(record)
+
+        return self.check_ids(fields) + self.check_record(record, fields)
+
+    def check_record(self, record, fields):
+        '''Return a list of :class:`Problem` of rules local to the record'''
+
+        return self._check(self.record_rules, record, fields)
+
+    def check_ids(self, fields):
+        '''Check and add the record ID and references.
+
+        :param fields: A `dict` containing at least the :data:`ID_FIELDS`
+            of the record.
+        :returns: A list of :class:`Problem`
+        '''
+
+        return self._check(self.id_rules, None, fields)
+
+    def _check(self, rules, record, fields):
+        record_id = fields.get('warc-record-id')
+        problems = []
+
+        for rule in rules:
+            result = rule.function(self, record, fields)
+
+            if result:
+                problems.append(Problem(record_id, *result))
+
+        return problems
+
+    def resolve(self):
+        '''Return a list of :class:`Problem` for references never seen'''
+
+        return [Problem(record_id,
+            'Referenced record ID {} in {} not found'.format(
+                referenced_id, name), None, False)
+            for record_id, referenced_id, name
+            in self.references.resolve(self.record_ids)]
+
+    def save(self, file_obj):
+        '''Write the record IDs and references to a binary file object'''
+
+        self.record_ids.save(file_obj)
+        self.references.save(file_obj)
+
+    def load(self, file_obj):
+        '''Add the record IDs and references written by :meth:`save`'''
+
+        self.record_ids.load(file_obj)
+        self.references.load(file_obj)
+
+    def close(self):
+        self.record_ids.close()
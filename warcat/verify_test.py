@@ -0,0 +1,110 @@
+from warcat import verify, model
+import io
+import unittest
+
+
+def make_record(*fields, block=b'', preserve_block=True):
+    data = b'WARC/1.0\r\n' + b''.join(
+        field.encode() + b'\r\n' for field in fields) \
+        + 'Content-Length: {}\r\n\r\n'.format(len(block)).encode() \
+        + block + b'\r\n\r\n'
+
+    file_obj = io.BytesIO(data)
+    file_obj.name = None
+
+    return model.Record.load(file_obj, preserve_block=preserve_block)
+
+
+class TestVerifier(unittest.TestCase):
+    def test_rules(self):
+        verifier = verify.Verifier()
+        record = make_record('WARC-Type: resource',
+            'WARC-Record-ID: <urn:test:1>',
+            'WARC-Date: 2013-01-01T00:00:00Z',
+            'WARC-Filename: a.warc')
+
+        problems = verifier.check(record)
+
+        self.assertEqual(['5.12', '5.15'],
+            [problem.iso_section for problem in problems])
+        self.assertEqual('<urn:test:1>', problems[0].record_id)
+        self.assertEqual(1, len(verifier.check(record)) - len(problems))
+
+    def test_warcinfo_id(self):
+        record = make_record('WARC-Type: metadata',
+            'WARC-Record-ID: <urn:test:1>',
+            'WARC-Date: 2013-01-01T00:00:00Z')
+
+        self.assertFalse(verify.Verifier().check(record))
+
+        verifier = verify.Verifier(enabled=['warcinfo-id'])
+        problems = verifier.check(record)
+
+        self.assertEqual(1, len(problems))
+        self.assertEqual('5.14', problems[0].iso_section)
+        self.assertFalse(problems[0].major)
+
+    def test_payload_digest(self):
+        http_block = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n'
+        fields = ('WARC-Record-ID: <urn:test:1>',
+            'WARC-Date: 2013-01-01T00:00:00Z',
+            'WARC-Target-URI: http://example.com/',
+            'Content-Type: application/http;msgtype=response',
+            'WARC-Payload-Digest: sha1:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA')
+        response = make_record('WARC-Type: response', *fields,
+            block=http_block + b'Hello', preserve_block=False)
+        problems = verify.Verifier().check(response)
+
+        self.assertEqual([('Bad payload digest.', '5.9', True)],
+            [problem[1:] for problem in problems])
+
+        # The digest is of the payload the revisit refers to
+        revisit = make_record('WARC-Type: revisit', *fields,
+            'WARC-Refers-To: <urn:test:2>',
+            'WARC-Profile: http://netpreserve.org/warc/1.0/revisit/'
+                'identical-payload-digest',
+            block=http_block, preserve_block=False)
+
+        self.assertFalse(verify.Verifier(disabled=['refers-to']).check(
+            revisit))
+
+        # The payload is not parsed
+        response = make_record('WARC-Type: response', *fields,
+            block=http_block + b'Hello')
+        problems = verify.Verifier().check(response)
+
+        self.assertEqual([('Payload digest on record without payload.',
+            '5.9', False)], [problem[1:] for problem in problems])
+
+    def test_disabled(self):
+        record = make_record('WARC-Type: resource',
+            'WARC-Record-ID: <urn:test:1>',
+            'WARC-Date: 2013-01-01T00:00:00Z')
+        verifier = verify.Verifier(disabled=['target-uri'])
+
+        self.assertFalse(verifier.check(record))
+        self.assertRaises(ValueError, verify.Verifier, enabled=['asdf'])
+
+    def test_forward_reference(self):
+        verifier = verify.Verifier()
+        request = make_record('WARC-Type: request',
+            'WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-000000000001>',
+            'WARC-Date: 2013-01-01T00:00:00Z',
+            'WARC-Target-URI: http://example.com/',
+            'WARC-Concurrent-To: '
+            '<urn:uuid:00000000-0000-0000-0000-000000000002>')
+        response = make_record('WARC-Type: response',
+            'WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-000000000002>',
+            'WARC-Date: 2013-01-01T00:00:00Z',
+            'WARC-Target-URI: http://example.com/',
+            'WARC-Concurrent-To: <urn:test:missing>')
+
+        self.assertFalse(verifier.check(request))
+        self.assertFalse(verifier.check(response))
+
+        problems = verifier.resolve()
+
+        self.assertEqual(1, len(problems))
+        self.assertEqual('<urn:uuid:00000000-0000-0000-0000-000000000002>',
+            problems[0].record_id)
+        self.assertIn('<urn:test:missing>', problems[0].message)
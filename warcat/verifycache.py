@@ -0,0 +1,141 @@
+'''Persistent cache of verification results'''
+# Copyright 2013 Christopher Foo <chris.foo@gmail.com>
+# Licensed under GPLv3. See COPYING.txt for details.
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+
+_logger = logging.getLogger(__name__)
+
+PARTIAL_HASH_SIZE = 65536
+
+
+class FileKey(collections.namedtuple('FileKey', ['path', 'size', 'mtime',
+'partial_hash'])):
+    '''The identity of a file used to decide whether it changed'''
+
+    __slots__ = ()
+
+
+def partial_hash(filename, size=PARTIAL_HASH_SIZE):
+    '''Return the SHA-1 hex digest of the start and end of a file'''
+
+    hash_obj = hashlib.sha1()
+
+    with open(filename, 'rb') as f:
+        hash_obj.update(f.read(size))
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        hash_obj.update(f.read(size))
+
+    return hash_obj.hexdigest()
+
+
+class VerifyCache(object):
+    '''A sqlite database of the verification results of files.
+
+    A file is identified by its path, size, modification time, and
+    optionally a hash of its start and end. For each record, the fields
+    needed to check record IDs again and the problems local to the record
+    are stored.
+
+    :param filename: The filename of the database.
+    :param use_hash: If `True`, include :func:`partial_hash` in the key.
+    '''
+
+    def __init__(self, filename, use_hash=False):
+        self.use_hash = use_hash
+        self._connection = sqlite3.connect(filename)
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                partial_hash TEXT NOT NULL,
+                rules TEXT NOT NULL,
+                complete INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                file_id INTEGER NOT NULL,
+                record_order INTEGER NOT NULL,
+                fields TEXT NOT NULL,
+                problems TEXT NOT NULL,
+                PRIMARY KEY (file_id, record_order)
+            );
+        ''')
+
+    def file_key(self, filename):
+        '''Return a :class:`FileKey` of the file as it is now'''
+
+        stat_result = os.stat(filename)
+
+        return FileKey(os.path.abspath(filename), stat_result.st_size,
+            stat_result.st_mtime_ns,
+            partial_hash(filename) if self.use_hash else '')
+
+    def get(self, key, rules):
+        '''Return an iterator of cached records or `None`.
+
+        :param key: A :class:`FileKey`.
+        :param rules: A string of the enabled rule names.
+        :returns: An iterator of tuples of a `dict` of fields and a list
+            of tuples of the problem message, ISO section, and major flag.
+        '''
+
+        row = self._connection.execute('SELECT id FROM files WHERE path = ? '
+            'AND size = ? AND mtime = ? AND partial_hash = ? AND rules = ? '
+            'AND complete = 1', tuple(key) + (rules,)).fetchone()
+
+        if not row:
+            return
+
+        return self._iter_records(row[0])
+
+    def _iter_records(self, file_id):
+        cursor = self._connection.execute('SELECT fields, problems '
+            'FROM records WHERE file_id = ? ORDER BY record_order',
+            (file_id,))
+
+        for fields, problems in cursor:
+            yield json.loads(fields), json.loads(problems)
+
+    def begin(self, key, rules):
+        '''Remove the results of the file and return a new file ID'''
+
+        with self._connection:
+            self._connection.execute('DELETE FROM records WHERE file_id IN '
+                '(SELECT id FROM files WHERE path = ?)', (key.path,))
+            self._connection.execute('DELETE FROM files WHERE path = ?',
+                (key.path,))
+
+            return self._connection.execute('INSERT INTO files (path, size, '
+                'mtime, partial_hash, rules, complete) '
+                'VALUES (?, ?, ?, ?, ?, 0)', tuple(key) + (rules,)).lastrowid
+
+    def add_records(self, file_id, records):
+        '''Store records.
+
+        :param records: A list of tuples of the record order, a `dict` of
+            fields, and a list of problem tuples.
+        '''
+
+        self._connection.executemany('INSERT INTO records (file_id, '
+            'record_order, fields, problems) VALUES (?, ?, ?, ?)',
+            [(file_id, record_order, json.dumps(fields), json.dumps(problems))
+                for record_order, fields, problems in records])
+
+    def finish(self, file_id):
+        '''Mark the results of the file as complete'''
+
+        with self._connection:
+            self._connection.execute('UPDATE files SET complete = 1 '
+                'WHERE id = ?', (file_id,))
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()